@@ -0,0 +1,179 @@
+import numpy as np
+
+#--Done--
+# This module computes the comparative statistics of a school's subject year for the class_data page:
+# every student's average and percentile, every class's average, spread and rank, and the spread and
+# grade distribution of every test. All the marks of the subject year are collected into NumPy arrays
+# in one pass and every statistic is then a grouped reduction over those arrays (np.bincount for sums
+# and counts, one np.lexsort for the medians and quartiles), rather than a Python loop per class.
+
+#--Done--
+# This function rounds an array to one decimal place with Python's round(), which every page and
+# report uses for averages. np.round gives a different result for halves such as 0.15, whose
+# nearest binary value is just below the half.
+def _round(values):
+    return np.array([round(value, 1) for value in values.tolist()], dtype=float)
+
+#--Done--
+# This function converts a rounded statistic to a plain float for the templates, or None if it is
+# not defined (a group with no values).
+def _plain(value):
+    return None if np.isnan(value) else float(value)
+
+#--Done--
+# This function calculates grouped statistics of values in one go.
+# It performs the following steps:
+# 1. Counts and sums the values of every group with np.bincount and divides for the means.
+# 2. Calculates the population standard deviations from the deviations from each group's mean.
+# 3. Sorts the values by group and then by value with one np.lexsort, so each group's values are a
+#    sorted run starting at the cumulative count of the groups before it.
+# 4. Reads the minimum and maximum at the ends of each run, and the quartiles and median by linear
+#    interpolation within it (the same as np.percentile on each group's values).
+# 5. Returns the counts and a dict of arrays with NaN for the groups that have no values.
+def grouped_statistics(groups, values, size):
+    counts = np.bincount(groups, minlength=size)
+    has_values = counts > 0
+    means = np.full(size, np.nan)
+    means[has_values] = np.bincount(groups, weights=values, minlength=size)[has_values] / counts[has_values]
+    std = np.full(size, np.nan)
+    std[has_values] = np.sqrt(np.bincount(groups, weights=(values - means[groups]) ** 2, minlength=size)[has_values] / counts[has_values])
+    ordered = values[np.lexsort((values, groups))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_values]
+    last = counts[has_values] - 1
+
+    def quantile(q):
+        result = np.full(size, np.nan)
+        position = q * last
+        lower = ordered[starts + np.floor(position).astype(int)]
+        upper = ordered[starts + np.ceil(position).astype(int)]
+        result[has_values] = lower + (upper - lower) * (position - np.floor(position))
+        return result
+
+    return counts, {
+        'mean': means,
+        'std': std,
+        'min': quantile(0),
+        'lower_quartile': quantile(0.25),
+        'median': quantile(0.5),
+        'upper_quartile': quantile(0.75),
+        'max': quantile(1)
+    }
+
+#--Done--
+# This function calculates the statistics of one school's subject year from its classes.
+# It performs the following steps:
+# 1. Collects every mark of a student in the class's student list into three parallel arrays: the
+#    (class, student) row, the (class, test) group and the percentage.
+# 2. Calculates each student's average percentage per class (rounded like every other page) and
+#    their percentile in the subject year: the share of the year's students below them, counting
+#    ties as half.
+# 3. Calculates each class's average of its students' averages (as class_data always has), their
+#    spread and median, and grades the class averages with the subject year's GradeScale.
+# 4. Ranks the classes that have marks by average, highest first; classes with the same average
+#    share a rank.
+# 5. Calculates the year's overall average, spread and median over every student's average.
+# 6. Calculates each test's spread and quartiles, the mean of the same test across the year's
+#    classes, and the number of marks at each grade (highest grade first, with the default grade
+#    counted together with a boundary of the same name).
+# 7. Returns plain dicts and lists, so the result can be cached and passed to the templates as is.
+def subject_year_statistics(classes, scale):
+    rows = {}
+    row_classes = []
+    tests = {}
+    test_classes = []
+    test_names = []
+    mark_rows = []
+    mark_tests = []
+    percentages = []
+    for index, class_entry in enumerate(classes):
+        for student_id in class_entry.get('students', []):
+            if (index, student_id) not in rows:
+                rows[(index, student_id)] = len(row_classes)
+                row_classes.append(index)
+        for test in class_entry.get('tests', []):
+            key = (index, test['test_name'])
+            if key not in tests:
+                tests[key] = len(test_classes)
+                test_classes.append(index)
+                test_names.append(test['test_name'])
+            for student_id, marks in test.get('students_marks', {}).items():
+                row = rows.get((index, student_id))
+                if row is not None:
+                    mark_rows.append(row)
+                    mark_tests.append(tests[key])
+                    percentages.append(marks['percentage'])
+    row_classes = np.array(row_classes, dtype=int)
+    mark_rows = np.array(mark_rows, dtype=int)
+    mark_tests = np.array(mark_tests, dtype=int)
+    percentages = np.array(percentages, dtype=float)
+
+    row_counts = np.bincount(mark_rows, minlength=len(row_classes))
+    graded = np.flatnonzero(row_counts)
+    averages = _round(np.bincount(mark_rows, weights=percentages, minlength=len(row_classes))[graded] / row_counts[graded])
+    ordered_averages = np.sort(averages)
+    below = np.searchsorted(ordered_averages, averages, side='left')
+    ties = np.searchsorted(ordered_averages, averages, side='right') - below
+    student_percentiles = _round((below + ties / 2) / max(len(averages), 1) * 100)
+
+    class_counts, class_stats = grouped_statistics(row_classes[graded], averages, len(classes))
+    class_stats = {name: _round(values) for name, values in class_stats.items()}
+    ranked = np.flatnonzero(class_counts)
+    class_averages = class_stats['mean']
+    ordered_classes = np.sort(-class_averages[ranked])
+    class_ranks = np.zeros(len(classes), dtype=int)
+    class_ranks[ranked] = np.searchsorted(ordered_classes, -class_averages[ranked], side='left') + 1
+    class_grades = dict(zip(ranked.tolist(), scale.grade_all(class_averages[ranked])))
+
+    test_counts, test_stats = grouped_statistics(mark_tests, percentages, len(test_classes))
+    test_stats = {name: _round(values) for name, values in test_stats.items()}
+    names = {}
+    test_name_groups = np.array([names.setdefault(name, len(names)) for name in test_names], dtype=int)
+    name_counts = np.bincount(test_name_groups[mark_tests], minlength=len(names))
+    name_sums = np.bincount(test_name_groups[mark_tests], weights=percentages, minlength=len(names))
+    year_test_means = _round(np.divide(name_sums, name_counts, out=np.full(len(names), np.nan), where=name_counts > 0))[test_name_groups]
+    labels = scale.labels.tolist()
+    label_order = list(range(len(labels) - 2, -1, -1)) + [len(labels) - 1]
+    distributions = np.bincount(mark_tests * len(labels) + scale.indexes(percentages), minlength=len(test_classes) * len(labels)).reshape(len(test_classes), len(labels))
+
+    student_ids = [student_id for _, student_id in rows]
+    statistics = {
+        'year': {
+            'average': round(float(averages.mean()), 1) if len(averages) else None,
+            'std': round(float(averages.std()), 1) if len(averages) else None,
+            'median': round(float(np.median(averages)), 1) if len(averages) else None,
+            'students': len(averages),
+            'classes': len(ranked)
+        },
+        'classes': {},
+        'ranking': [],
+        'students': {class_entry['code']: {} for class_entry in classes},
+        'tests': {class_entry['code']: [] for class_entry in classes}
+    }
+    for index, class_entry in enumerate(classes):
+        statistics['classes'][class_entry['code']] = {
+            'code': class_entry['code'],
+            'classname': class_entry.get('classname'),
+            'students': int(class_counts[index]),
+            'average': _plain(class_averages[index]),
+            'grade': class_grades.get(index, 'N/A'),
+            'std': _plain(class_stats['std'][index]),
+            'median': _plain(class_stats['median'][index]),
+            'rank': int(class_ranks[index]) or None
+        }
+    for index in sorted(ranked.tolist(), key=lambda index: (class_ranks[index], classes[index].get('classname') or '')):
+        statistics['ranking'].append(statistics['classes'][classes[index]['code']])
+    for row, average, percentile in zip(graded.tolist(), averages.tolist(), student_percentiles.tolist()):
+        statistics['students'][classes[row_classes[row]]['code']][student_ids[row]] = {'average': average, 'percentile': percentile}
+    for group, index in enumerate(test_classes):
+        test = {name: _plain(values[group]) for name, values in test_stats.items()}
+        distribution = {}
+        for label in label_order:
+            distribution[labels[label]] = distribution.get(labels[label], 0) + int(distributions[group, label])
+        test.update({
+            'test_name': test_names[group],
+            'count': int(test_counts[group]),
+            'year_mean': _plain(year_test_means[group]),
+            'distribution': list(distribution.items())
+        })
+        statistics['tests'][classes[index]['code']].append(test)
+    return statistics
@@ -0,0 +1,100 @@
+# This script benchmarks requests per second on /class_data/<class_code>.
+# It performs the following steps:
+# 1. Connects to a local mongod (--mongo) or swaps in mongomock as a stand-in (the default).
+# 2. Seeds one class with the requested number of students and tests, and the subject year's grade
+#    boundaries the way add_test writes them (ensure_grade_boundaries), since class_data only reads them.
+# 3. Logs a teacher in through the Flask test client.
+# 4. Requests the class data page repeatedly and reports requests per second.
+# 5. With --per-call-client, rebuilds the old behaviour of a new MongoClient per
+#    testdb()/accounts() call so the before and after numbers can be compared.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_class_data.py --students 300 --requests 200
+#   python benchmarks/bench_class_data.py --students 300 --requests 200 --per-call-client
+#   python benchmarks/bench_class_data.py --mongo mongodb://localhost:27017/
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark /class_data/<class_code> requests per second.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--tests', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--per-call-client', action='store_true', help='create a new MongoClient on every testdb()/accounts() call')
+    return parser.parse_args()
+
+
+def seed(main, school, students, tests):
+    class_code = 'BENCH'
+    teacher_id = str(uuid.uuid4())
+    student_ids = [str(uuid.uuid4()) for _ in range(students)]
+    main.accounts().insert_one({'user_id': teacher_id, 'username': 'bench-teacher', 'school': school, 'type': 'teacher'})
+    main.accounts().insert_many([
+        {'user_id': student_id, 'username': f'student{i}', 'email': f'student{i}@example.com', 'school': school, 'type': 'student'}
+        for i, student_id in enumerate(student_ids)
+    ])
+    boundaries = {'A*': 90, 'A': 80, 'B': 70, 'C': 60, 'D': 50, 'E': 40, 'U': 0}
+    class_entry = {
+        'classname': 'Bench', 'year': '10', 'subject': 'Maths', 'code': class_code, 'school': school,
+        'teacher': teacher_id, 'students': student_ids,
+        'tests': [{
+            'subject': 'Maths', 'test_name': f'Test {t}', 'test_type': 'test', 'max_mark': '100',
+            'grading_type': 'boundaries', 'grade_boundaries': boundaries,
+            'students_marks': {student_id: {'mark': (i + t) % 100, 'percentage': float((i + t) % 100)} for i, student_id in enumerate(student_ids)}
+        } for t in range(tests)]
+    }
+    main.testdb().insert_one(class_entry)
+    main.ensure_grade_boundaries(main.testdb(), class_entry['subject'], class_entry['year'], class_entry['tests'])
+    return class_code, teacher_id
+
+
+def main_():
+    args = parse_args()
+    if not args.mongo:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import main
+    if args.mongo:
+        main.config['mongodbaddress'] = args.mongo
+    school = f'bench-{uuid.uuid4().hex[:8]}'
+    # The subject year boundaries are shared by every school, so they are only removed afterwards if the seed created them.
+    boundaries_existed = main.testdb().count_documents({'subject_year': 'Maths-Y10', 'test_name': None}, limit=1) > 0
+    class_code, teacher_id = seed(main, school, args.students, args.tests)
+    if args.per_call_client:
+        # mongomock keeps data per client, so per-call stand-in clients share the seeded store.
+        extra = {} if args.mongo else {'_store': main.mongo_client()._store}
+        def per_call(name):
+            return main.MongoClient(main.config['mongodbaddress'], connect=False, **extra)["TestTracking"][name]
+        main.testdb = lambda: per_call("data")
+        main.accounts = lambda: per_call("accounts")
+    client = main.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = 'bench-teacher'
+        sess['user_id'] = teacher_id
+        sess['school'] = school
+    client.get(f'/class_data/{class_code}')
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        response = client.get(f'/class_data/{class_code}')
+        assert response.status_code == 200, response.status_code
+    elapsed = time.perf_counter() - start
+    mode = 'per-call client' if args.per_call_client else 'shared client'
+    print(f'{mode}: {args.requests} requests in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s '
+          f'({args.students} students, {args.tests} tests)')
+    main.testdb().delete_many({'school': school})
+    main.accounts().delete_many({'school': school})
+    main.student_summaries().delete_many({'classes.code': class_code})
+    if not boundaries_existed:
+        main.testdb().delete_one({'subject_year': 'Maths-Y10', 'test_name': None})
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,106 @@
+# This script benchmarks propagating subject-year grades to student accounts.
+# It performs the following steps:
+# 1. Connects to a local mongod (--mongo) or swaps in mongomock as a stand-in (the default).
+# 2. Seeds the requested number of student accounts, half of them already holding an entry for the subject year.
+# 3. Runs the previous per-student implementation (find_one, optional $set, then update_one or $push)
+#    and the bulk implementation (update_students_subjects) against the same accounts.
+# 4. Counts the database round trips each one makes and reports them with the wall time.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_grade_propagation.py --students 2000
+#   python benchmarks/bench_grade_propagation.py --students 2000 --mongo mongodb://localhost:27017/
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROUND_TRIP_METHODS = {'find_one', 'update_one', 'bulk_write'}
+
+
+# This class wraps a collection and counts calls that each cost one round trip.
+# bulk_write is counted once per call (pymongo splits it further only past 100,000 operations).
+class CountingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name in ROUND_TRIP_METHODS:
+            def counted(*args, **kwargs):
+                self.round_trips += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+
+# This function is the per-student implementation that update_students_subjects replaced,
+# pointed at the accounts collection.
+def legacy_update_student_subjects(db, student_id, subject_year, average_score, grade, test_name=None):
+    student_doc = db.find_one({'user_id': student_id})
+    if not student_doc:
+        return
+    if 'subjects' not in student_doc or not isinstance(student_doc['subjects'], list):
+        db.update_one({'user_id': student_id}, {'$set': {'subjects': []}})
+        student_doc['subjects'] = []
+    existing_subject = next((subj for subj in student_doc['subjects'] if subj['subject_year'] == subject_year and subj['test_name'] == test_name), None)
+    if existing_subject:
+        db.update_one(
+            {'user_id': student_id, 'subjects.subject_year': subject_year, 'subjects.test_name': test_name},
+            {'$set': {'subjects.$.average_percentage': average_score, 'subjects.$.grade': grade}}
+        )
+    else:
+        db.update_one(
+            {'user_id': student_id},
+            {'$push': {'subjects': {'subject_year': subject_year, 'test_name': test_name, 'average_percentage': average_score, 'grade': grade}}}
+        )
+
+
+def seed(main, school, students, subject_year):
+    student_ids = [str(uuid.uuid4()) for _ in range(students)]
+    main.accounts().insert_many([
+        {'user_id': student_id, 'username': f'student{i}', 'school': school, 'type': 'student',
+         'subjects': [{'subject_year': subject_year, 'test_name': None, 'average_percentage': 0, 'grade': 'U'}] if i % 2 else []}
+        for i, student_id in enumerate(student_ids)
+    ])
+    return {student_id: (float(i % 100), 'B') for i, student_id in enumerate(student_ids)}
+
+
+def main_():
+    parser = argparse.ArgumentParser(description='Benchmark subject-year grade propagation to student accounts.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--students', type=int, default=2000)
+    args = parser.parse_args()
+    if not args.mongo:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import main
+    if args.mongo:
+        main.config['mongodbaddress'] = args.mongo
+    subject_year = 'Bench-Y10'
+    for label in ('per-student', 'bulk_write'):
+        school = f'bench-{uuid.uuid4().hex[:8]}'
+        grades = seed(main, school, args.students, subject_year)
+        counting = CountingCollection(main.accounts())
+        start = time.perf_counter()
+        if label == 'per-student':
+            for student_id, (average_score, grade) in grades.items():
+                legacy_update_student_subjects(counting, student_id, subject_year, average_score, grade)
+        else:
+            original_accounts = main.accounts
+            main.accounts = lambda: counting
+            try:
+                main.update_students_subjects(subject_year, grades)
+            finally:
+                main.accounts = original_accounts
+        elapsed = time.perf_counter() - start
+        print(f'{label:>11}: {counting.round_trips} round trips, {elapsed:.3f}s for {args.students} students')
+        main.accounts().delete_many({'school': school})
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,90 @@
+# This script checks that concurrent /join_class requests never lose a join.
+# It performs the following steps:
+# 1. Connects to a local mongod (--mongo) or swaps in mongomock as a stand-in (the default).
+# 2. Creates one empty class and the requested number of student accounts.
+# 3. Fires every student's /join_class request at once from a thread pool, each through its own
+#    logged-in Flask test client.
+# 4. With --legacy, swaps in the previous read-modify-write join (find_one, append, $set the
+#    whole students array) so the lost updates can be compared.
+# 5. Reports how many students ended up in the class and exits with an error if any join was lost.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_join_class.py --students 500 --workers 32
+#   python benchmarks/bench_join_class.py --students 500 --workers 32 --legacy
+#   python benchmarks/bench_join_class.py --mongo mongodb://localhost:27017/
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check that concurrent /join_class requests are never lost.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--legacy', action='store_true', help='use the previous read-modify-write join')
+    return parser.parse_args()
+
+
+# This function is the student branch of join_class before it used $addToSet.
+def legacy_join(main, class_code, user_id):
+    db = main.testdb()
+    class_entry = db.find_one({'code': class_code})
+    students = class_entry.get('students', [])
+    if user_id not in students:
+        students.append(user_id)
+        db.update_one({'code': class_code}, {'$set': {'students': students}})
+
+
+def main_():
+    args = parse_args()
+    if not args.mongo:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import main
+    if args.mongo:
+        main.config['mongodbaddress'] = args.mongo
+    school = f'bench-{uuid.uuid4().hex[:8]}'
+    class_code = uuid.uuid4().hex[:5].upper()
+    student_ids = [str(uuid.uuid4()) for _ in range(args.students)]
+    main.testdb().insert_one({'classname': 'Bench', 'year': '10', 'subject': 'Bench', 'code': class_code, 'school': school, 'teacher': 'bench-teacher', 'students': [], 'tests': []})
+    main.accounts().insert_many([
+        {'user_id': student_id, 'username': f'student{i}', 'school': school, 'type': 'student'}
+        for i, student_id in enumerate(student_ids)
+    ])
+
+    def join(student_id):
+        if args.legacy:
+            legacy_join(main, class_code, student_id)
+            return 302
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session['user'] = student_id
+            session['user_id'] = student_id
+            session['school'] = school
+            session['user_type'] = 'student'
+        return client.post('/join_class', data={'class_code': class_code}).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        statuses = list(pool.map(join, student_ids))
+    elapsed = time.perf_counter() - start
+    joined = set(main.testdb().find_one({'code': class_code}, {'students': 1})['students'])
+    lost = len(set(student_ids) - joined)
+    print(f"{'legacy' if args.legacy else '$addToSet'}: {len(joined)}/{args.students} joined, {lost} lost, "
+          f"{sum(status != 302 for status in statuses)} failed requests, {elapsed:.3f}s")
+    main.testdb().delete_many({'school': school})
+    main.accounts().delete_many({'school': school})
+    main.student_summaries().delete_many({'student_id': {'$in': student_ids}})
+    if lost:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,108 @@
+# This script measures the throughput of the bulk report export in PDFs per second.
+# It performs the following steps:
+# 1. Connects to a local mongod (--mongo) or swaps in mongomock as a stand-in (the default).
+# 2. Creates a school with the requested number of students spread over classes in several
+#    subjects, each class with a few marked tests, and builds the students' summaries.
+# 3. For each worker count in --workers, starts the report export pool (0 renders inline in this
+#    process), warms it up with one report, then times export_student_reports for the whole school.
+# 4. Reports the reports exported, the time taken and the PDFs per second for each worker count,
+#    and the same for one merged PDF with --merged.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_report_export.py --students 500 --workers 0,1,2,4
+#   python benchmarks/bench_report_export.py --students 500 --workers 4 --merged
+#   python benchmarks/bench_report_export.py --mongo mongodb://localhost:27017/
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUBJECTS = ['Maths', 'English', 'Science', 'History']
+BOUNDARIES = {'A*': 90, 'A': 80, 'B': 70, 'C': 60, 'D': 50, 'E': 40, 'U': 0}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure bulk report export throughput in PDFs/sec.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--class-size', type=int, default=30)
+    parser.add_argument('--tests', type=int, default=4, help='marked tests per class')
+    parser.add_argument('--workers', default='0,1,2,4', help='comma separated report worker counts to compare')
+    parser.add_argument('--merged', action='store_true', help='also time one merged PDF per worker count')
+    return parser.parse_args()
+
+
+# This function creates the school's students and classes (every student takes every subject).
+def seed(main, school, args):
+    rng = random.Random(0)
+    student_ids = [str(uuid.uuid4()) for _ in range(args.students)]
+    main.accounts().insert_many([
+        {'user_id': student_id, 'username': f'student{i:05d}', 'email': f'student{i}@example.com', 'school': school, 'type': 'student'}
+        for i, student_id in enumerate(student_ids)
+    ])
+    classes = []
+    for subject in SUBJECTS:
+        for number, start in enumerate(range(0, len(student_ids), args.class_size)):
+            students = student_ids[start:start + args.class_size]
+            classes.append({
+                'classname': f'{subject} {number}', 'year': '10', 'subject': subject, 'code': uuid.uuid4().hex[:5].upper(),
+                'school': school, 'teacher': 'bench-teacher', 'students': students,
+                'tests': [{
+                    'subject': subject, 'test_name': f'{subject} test {t}', 'test_type': 'test', 'max_mark': '100',
+                    'grading_type': 'boundaries', 'grade_boundaries': BOUNDARIES,
+                    'students_marks': {student_id: {'mark': (mark := rng.randint(0, 100)), 'percentage': float(mark)} for student_id in students}
+                } for t in range(args.tests)]
+            })
+    main.testdb().insert_many(classes)
+    main.refresh_student_summaries(student_ids)
+    return student_ids
+
+
+# This function times one export of the whole school and returns (reports, seconds).
+def time_export(main, school, merged):
+    path = os.path.join(tempfile.gettempdir(), f'bench-export-{uuid.uuid4().hex}.{"pdf" if merged else "zip"}')
+    start = time.perf_counter()
+    result = main.export_student_reports(school, path, merged=merged)
+    elapsed = time.perf_counter() - start
+    os.remove(path)
+    return result['reports'], elapsed
+
+
+def main_():
+    args = parse_args()
+    if not args.mongo:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import main
+    import reports
+    if args.mongo:
+        main.config['mongodbaddress'] = args.mongo
+    school = f'bench-{uuid.uuid4().hex[:8]}'
+    student_ids = seed(main, school, args)
+    try:
+        for workers in [int(value) for value in args.workers.split(',')]:
+            main.config['reportworkers'] = workers
+            pool = main._process_pools.pop('report', None)
+            if pool:
+                pool.shutdown()
+            pool = main.report_pool()
+            if pool:
+                student, summary = main.report_export_data(school)[0]
+                pool.submit(reports.render_student_report, student, summary).result()
+            for merged in ([False, True] if args.merged else [False]):
+                count, elapsed = time_export(main, school, merged)
+                print(f"{'merged PDF' if merged else 'ZIP'} with {workers} workers: {count} reports in {elapsed:.2f}s, {count / elapsed:.1f} PDFs/sec")
+    finally:
+        main.testdb().delete_many({'school': school})
+        main.accounts().delete_many({'school': school})
+        main.student_summaries().delete_many({'student_id': {'$in': student_ids}})
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,377 @@
+# This script load tests the app's main routes against a synthetic school and keeps baselines.
+# It performs the following steps:
+# 1. Connects to a local mongod (--mongo) or swaps in mongomock as a stand-in (the default).
+#    mongomock sends no command events, so its collection methods are wrapped to report each call
+#    to the app's command listener as one round trip; the DB ops figures then match a mongod run
+#    apart from getMore batches.
+# 2. Generates a synthetic school (see synthetic_school.py) and logs the admin, the class teachers
+#    and a student in through the real /login route.
+# 3. Drives each scenario's route --requests times from --concurrency threads, through the Flask
+#    test client or, with --server, over HTTP against a local threaded WSGI server:
+#    - index_admin, index_teacher, index_student: GET / as each user type;
+#    - class_data: GET /class_data/<class_code> over every class;
+#    - admin_subject_year_details and subject_details: GET over every subject year and subject;
+#    - submit_marks: POST /submit_marks with new marks for every class and test in turn;
+#    - generate_report: GET /generate_report/<student_id> over the students (the first pass is uncached);
+#    - update_school: POST /update_school, waiting for each background job so update_school_job
+#      reports the time the whole school recompute took.
+# 4. Reports p50/p95/p99 latency, requests per second, DB ops per request (from the
+#    X-DB-Round-Trips header), the most DB writes in one request (X-DB-Writes), errors and the
+#    process's peak RSS after each scenario. A scenario in READ_ONLY_SCENARIOS that sends any
+#    write fails the run (exit status 1), so pages that should only read stay that way.
+# 5. With --save-baseline NAME, stores the results in benchmarks/baselines/NAME.json; with
+#    --compare NAME, prints the change against that baseline and (with --fail-on-regression)
+#    exits with an error when a scenario's p95 grows by more than --threshold percent or it sends
+#    more DB ops per request.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_routes.py --students 300 --requests 50 --save-baseline main
+#   python benchmarks/bench_routes.py --students 300 --requests 50 --compare main --fail-on-regression
+#   python benchmarks/bench_routes.py --server --concurrency 8 --mongo mongodb://localhost:27017/
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import synthetic_school
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+SCENARIOS = ['index_admin', 'index_teacher', 'index_student', 'class_data', 'admin_subject_year_details',
+             'subject_details', 'submit_marks', 'generate_report', 'update_school']
+# These are the mongomock collection methods reported as round trips, with the command a mongod
+# would receive for each (bulk_write is reported as one update, which is what the app sends).
+ROUND_TRIP_METHODS = {'find': 'find', 'find_one': 'find', 'insert_one': 'insert', 'insert_many': 'insert',
+                      'update_one': 'update', 'update_many': 'update', 'replace_one': 'update', 'delete_one': 'delete',
+                      'delete_many': 'delete', 'bulk_write': 'update', 'aggregate': 'aggregate', 'distinct': 'distinct',
+                      'count_documents': 'aggregate', 'find_one_and_update': 'findAndModify', 'create_indexes': 'createIndexes'}
+# These scenarios only read, so any MongoDB write they send is reported as a failure.
+READ_ONLY_SCENARIOS = {'index_admin', 'index_teacher', 'class_data', 'admin_subject_year_details', 'subject_details'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test the main routes against a synthetic school.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--server', action='store_true', help='send requests over HTTP to a local WSGI server instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    parser.add_argument('--update-requests', type=int, default=3, help='requests for the update_school scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios to run')
+    parser.add_argument('--save-baseline', metavar='NAME', help='store the results as benchmarks/baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with benchmarks/baselines/NAME.json')
+    parser.add_argument('--threshold', type=float, default=10.0, help='p95 growth (percent) reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with an error when --compare finds a regression')
+    synthetic_school.add_arguments(parser)
+    return parser.parse_args()
+
+
+# This function makes mongomock report every collection call to the app's command listener as one
+# round trip. Calls made by other wrapped methods (find_one calls find) are not counted twice.
+def instrument_mongomock(metrics):
+    import mongomock.collection
+    listener = metrics.CommandMetrics()
+    state = threading.local()
+
+    def wrap(command, method):
+        def wrapper(self, *args, **kwargs):
+            if getattr(state, 'depth', 0):
+                return method(self, *args, **kwargs)
+            state.depth = 1
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                state.depth = 0
+                listener.succeeded(SimpleNamespace(command_name=command, duration_micros=int((time.perf_counter() - start) * 1e6)))
+        return wrapper
+
+    for name, command in ROUND_TRIP_METHODS.items():
+        setattr(mongomock.collection.Collection, name, wrap(command, getattr(mongomock.collection.Collection, name)))
+
+
+# This function creates the indexes on mongomock, which does not support partial indexes.
+def create_mongomock_indexes(main):
+    for name, indexes in main.INDEXES.items():
+        for index in indexes:
+            document = dict(index.document)
+            if 'partialFilterExpression' not in document:
+                keys = list(document.pop('key').items())
+                main.collection(name).create_index(keys, **document)
+
+
+# This class sends requests through the Flask test client (one client per thread, no cookie jar).
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, cookie=None, data=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client(use_cookies=False)
+        headers = {'Cookie': f'session={cookie}'} if cookie else {}
+        response = client.open(path, method=method, data=data, headers=headers)
+        body = response.get_data()
+        response.close()
+        return response.status_code, response.headers, body
+
+
+# This class sends requests over HTTP to a threaded WSGI server running the app in this process.
+class ServerTransport:
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, cookie=None, data=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        headers = {'Cookie': f'session={cookie}'} if cookie else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        content = response.read()
+        connection.close()
+        return response.status, response.headers, content
+
+    def close(self):
+        self.server.shutdown()
+
+
+# This function logs a user in through /login and returns their session cookie. It then loads '/'
+# once, so the cookie also holds the user type the app stores in the session on the first request.
+def login(transport, school, username):
+    cookie = None
+    for method, path, data in [('POST', '/login', {'school': school, 'username': username, 'password': synthetic_school.PASSWORD}), ('GET', '/', None)]:
+        status, headers, _ = transport.request(method, path, cookie, data)
+        for header in headers.get_all('Set-Cookie') if hasattr(headers, 'get_all') else headers.getlist('Set-Cookie'):
+            morsel = SimpleCookie(header).get('session')
+            if morsel is not None:
+                cookie = morsel.value
+    if cookie is None:
+        raise RuntimeError(f'Logging in as {username} failed')
+    return cookie
+
+
+# This function returns the requests of a scenario: a list of (user, method, path, form data).
+def scenario_requests(name, school, count, rng):
+    classes = school['classes']
+    students = school['student_ids']
+    subject_years = school['subject_years']
+    subjects = sorted({subject for subject, _ in subject_years})
+    if name == 'index_admin':
+        return [(school['admin'], 'GET', '/', None)] * count
+    if name == 'index_teacher':
+        return [(classes[i % len(classes)]['teacher'], 'GET', '/', None) for i in range(count)]
+    if name == 'index_student':
+        return [(school['students'][0], 'GET', '/', None)] * count
+    if name == 'class_data':
+        return [(school['admin'], 'GET', f"/class_data/{classes[i % len(classes)]['code']}", None) for i in range(count)]
+    if name == 'admin_subject_year_details':
+        return [(school['admin'], 'GET', f'/admin_subject_year_details/{subject}/{year}', None) for subject, year in (subject_years[i % len(subject_years)] for i in range(count))]
+    if name == 'subject_details':
+        return [(school['admin'], 'GET', f'/subject_details/{subjects[i % len(subjects)]}', None) for i in range(count)]
+    if name == 'submit_marks':
+        requests = []
+        for i in range(count):
+            entry = classes[i % len(classes)]
+            form = {'class_code': entry['code'], 'test_name': entry['tests'][(i // len(classes)) % len(entry['tests'])]}
+            form.update({f'marks[{student_id}]': str(rng.randint(0, 40)) for student_id in entry['students']})
+            requests.append((entry['teacher'], 'POST', '/submit_marks', form))
+        return requests
+    if name == 'generate_report':
+        return [(school['admin'], 'GET', f'/generate_report/{students[i % len(students)]}', None) for i in range(count)]
+    if name == 'update_school':
+        return [(school['admin'], 'POST', '/update_school', None)] * count
+    raise ValueError(f'Unknown scenario {name}')
+
+
+# This function returns the process's peak resident memory in bytes.
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+# This function summarises a scenario's latencies (seconds), DB ops and DB writes per request.
+def summarise(latencies, db_ops, db_writes, errors, elapsed):
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'db_ops_mean': round(float(np.mean(db_ops)), 1) if db_ops else None,
+        'db_ops_max': max(db_ops) if db_ops else None,
+        'db_writes_max': max(db_writes) if db_writes else None,
+        'errors': errors,
+        'peak_rss_mib': round(peak_rss() / 2 ** 20, 1)
+    }
+
+
+# This function runs one scenario and returns its summary (and, for update_school, the job's).
+def run_scenario(name, transport, cookies, requests, concurrency, expected):
+    results = []
+    job_times = []
+
+    def send(request):
+        user, method, path, data = request
+        start = time.perf_counter()
+        status, headers, body = transport.request(method, path, cookies[user], data)
+        latency = time.perf_counter() - start
+        if name == 'update_school' and status == 202:
+            status_url = json.loads(body)['status_url']
+            while True:
+                job = json.loads(transport.request('GET', status_url, cookies[user])[2])
+                if job['status'] in ('finished', 'failed'):
+                    job_times.append(job['finished'] - job['started'])
+                    break
+                time.sleep(0.01)
+        round_trips = headers.get('X-DB-Round-Trips')
+        writes = headers.get('X-DB-Writes')
+        return latency, int(round_trips) if round_trips is not None else None, int(writes) if writes is not None else None, status in expected
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - start
+    summaries = {name: summarise([result[0] for result in results], [result[1] for result in results if result[1] is not None],
+                                 [result[2] for result in results if result[2] is not None], sum(not result[3] for result in results), elapsed)}
+    if job_times:
+        summaries['update_school_job'] = summarise(job_times, [], [], 0, sum(job_times))
+    return summaries
+
+
+# This function returns the current git commit of the repository, or None outside a git checkout.
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# This function prints the change of every scenario against a baseline and returns the regressions.
+def compare(results, baseline, threshold):
+    regressions = []
+    for key in ('school', 'database', 'transport', 'concurrency'):
+        if baseline['meta'][key] != results['meta'][key]:
+            print(f"warning: the baseline used a different {key} ({baseline['meta'][key]})")
+    print(f"\nagainst baseline {baseline['meta'].get('commit')} ({baseline['meta']['date']}):")
+    print(f"{'scenario':<28}{'p50':>18}{'p95':>18}{'p99':>18}{'db ops':>16}")
+    for name, current in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            print(f'{name:<28} (not in baseline)')
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (current[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            cells.append(f'{current[key]:.1f} ({change:+.0f}%)')
+        ops = '-' if current['db_ops_mean'] is None else f"{current['db_ops_mean']} ({current['db_ops_mean'] - (before['db_ops_mean'] or 0):+.1f})"
+        print(f'{name:<28}' + ''.join(f'{cell:>18}' for cell in cells) + f'{ops:>16}')
+        if before['p95_ms'] and (current['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 > threshold:
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {current['p95_ms']} ms")
+        if current['db_ops_mean'] is not None and before['db_ops_mean'] is not None and current['db_ops_mean'] > before['db_ops_mean']:
+            regressions.append(f"{name}: DB ops per request {before['db_ops_mean']} -> {current['db_ops_mean']}")
+    return regressions
+
+
+def main_():
+    args = parse_args()
+    os.chdir(ROOT)
+    if not args.mongo:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import main
+    import metrics
+    if args.mongo:
+        main.config['mongodbaddress'] = args.mongo
+        main.ensure_indexes()
+    else:
+        instrument_mongomock(metrics)
+        main.config['ensureindexes'] = False
+        create_mongomock_indexes(main)
+    school_name = f'bench-{uuid.uuid4().hex[:8]}'
+    start = time.perf_counter()
+    school = synthetic_school.generate_school(main, school_name, args)
+    print(f"generated {len(school['students'])} students, {len(school['classes'])} classes, "
+          f"{len(school['classes']) * args.tests} tests in {time.perf_counter() - start:.1f}s")
+    transport = ServerTransport(main.app) if args.server else TestClientTransport(main.app)
+    rng = random.Random(args.seed)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': 'mongod' if args.mongo else 'mongomock',
+            'transport': 'server' if args.server else 'test client',
+            'concurrency': args.concurrency,
+            'school': {key: getattr(args, key) for key in ('students', 'class_size', 'subjects', 'years', 'tests', 'curve_tests', 'marked', 'seed')}
+        },
+        'scenarios': {}
+    }
+    failures = []
+    try:
+        cookies = {}
+        print(f"{'scenario':<28}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}{'db ops':>9}{'writes':>8}{'errors':>8}{'peak RSS':>11}")
+        for name in args.scenarios.split(','):
+            count = args.update_requests if name == 'update_school' else args.requests
+            requests = scenario_requests(name, school, count, rng)
+            for user in {request[0] for request in requests} - set(cookies):
+                cookies[user] = login(transport, school_name, user)
+            expected = {202} if name == 'update_school' else {302} if name == 'submit_marks' else {200}
+            for scenario, summary in run_scenario(name, transport, cookies, requests, args.concurrency, expected).items():
+                results['scenarios'][scenario] = summary
+                ops = '-' if summary['db_ops_mean'] is None else summary['db_ops_mean']
+                writes = '-' if summary['db_writes_max'] is None else summary['db_writes_max']
+                print(f"{scenario:<28}{summary['requests']:>9}{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+                      f"{summary['requests_per_sec']:>9.1f}{ops:>9}{writes:>8}{summary['errors']:>8}{summary['peak_rss_mib']:>7.1f} MiB")
+                if scenario in READ_ONLY_SCENARIOS and summary['db_writes_max']:
+                    failures.append(f"{scenario} is read only but a request sent {summary['db_writes_max']} MongoDB writes")
+    finally:
+        if args.server:
+            transport.close()
+        synthetic_school.delete_school(main, school)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f'{args.save_baseline}.json')
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'saved baseline {path}')
+    for failure in failures:
+        print(f'failure: {failure}')
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json')) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_()
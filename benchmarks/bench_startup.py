@@ -0,0 +1,95 @@
+# This script measures how quickly a fresh worker process becomes ready to serve.
+# It performs the following steps:
+# 1. Runs `python -X importtime -c "import main"` and reports the total import time of main
+#    together with the slowest top-level packages it pulls in.
+# 2. Starts fresh worker processes that import main, serve their first request ('/') through
+#    the Flask test client and report back; the time from process start to that response is
+#    the time to first request.
+# 3. Reports each worker's resident memory (RSS) once it is idle after that first request,
+#    and which of the heavy modules (numpy, pandas, matplotlib, seaborn, reportlab) it loaded.
+# MongoDB is swapped for mongomock unless --mongo is given, as in the other benchmarks.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_startup.py --runs 5
+#   python benchmarks/bench_startup.py --runs 5 --mongo mongodb://localhost:27017/
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['numpy', 'pandas', 'matplotlib', 'seaborn', 'reportlab']
+
+# This is the worker each run starts: it imports the app, serves '/' once and prints its state.
+WORKER = '''
+import json, os, sys
+mongo = sys.argv[1]
+if not mongo:
+    import mongomock, pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+import main
+if mongo:
+    main.config['mongodbaddress'] = mongo
+status = main.app.test_client().get('/').status_code
+rss = None
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({'status': status, 'rss': rss, 'modules': [name for name in %r if name in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure worker import time, time to first request and idle RSS.')
+    parser.add_argument('--mongo', help='MongoDB address of a local mongod; mongomock is used when omitted')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='number of slowest packages to list')
+    return parser.parse_args()
+
+
+# This function runs python -X importtime on main and returns (total microseconds, slowest packages).
+def import_times(top):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT, capture_output=True, text=True)
+    packages = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        if name == 'main':
+            total = int(cumulative)
+        elif depth <= 3:
+            package = name.split('.')[0]
+            packages[package] = max(packages.get(package, 0), int(cumulative))
+    return total, sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main_():
+    args = parse_args()
+    total, packages = import_times(args.top)
+    print(f'import main: {total / 1000:.1f} ms' if total else 'import main: failed')
+    for package, cumulative in packages:
+        print(f'  {package:<20} {cumulative / 1000:8.1f} ms')
+    ready_times = []
+    rss_values = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', WORKER, args.mongo or ''], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        ready_times.append(time.perf_counter() - start)
+        state = json.loads(output.strip().splitlines()[-1])
+        rss_values.append(state['rss'])
+    print(f'time to first request: median {statistics.median(ready_times) * 1000:.0f} ms over {args.runs} runs (min {min(ready_times) * 1000:.0f} ms)')
+    print(f"idle worker RSS: median {statistics.median(rss_values) / 2 ** 20:.1f} MiB (first response {state['status']})")
+    print(f"heavy modules loaded: {', '.join(state['modules']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,156 @@
+# This module generates synthetic schools for the benchmarks.
+# It writes documents in the exact shapes the app itself produces:
+# - accounts as create_school and create_account store them (one admin, the teachers, the students);
+# - classes as create_class stores them, with students added as join_class does;
+# - tests as add_test pushes them and marks as submit_marks stores them ({'mark', 'percentage'});
+# - the subject year boundary documents that ensure_grade_boundaries upserts, and the curve
+#   boundaries that submit_marks sets (through calculate_boundaries_and_graph).
+# It then runs the app's own whole school grade update (mass_update_grades_for_school), which builds
+# the subject year aggregates, the students' subject grades, the student summaries and the charts,
+# and moves the marks into the marks collection when 'marksstorage' is 'collection'.
+#
+# It can also be run on its own to seed a local mongod for manual testing (from the repository root):
+#   python benchmarks/synthetic_school.py --mongo mongodb://localhost:27017/ --school "Synthetic School" --students 1200
+import argparse
+import os
+import random
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUBJECTS = ['Maths', 'English', 'Science', 'History', 'Geography', 'French', 'Art', 'Music']
+BOUNDARIES = {'A*': 90, 'A': 80, 'B': 70, 'C': 60, 'D': 50, 'E': 40, 'U': 0}
+PASSWORD = 'password'
+
+
+# This function adds the synthetic school options to an argument parser.
+def add_arguments(parser):
+    parser.add_argument('--students', type=int, default=300, help='students in the school, spread evenly over the years')
+    parser.add_argument('--class-size', type=int, default=30)
+    parser.add_argument('--subjects', type=int, default=4, help=f'subjects every student takes (at most {len(SUBJECTS)})')
+    parser.add_argument('--years', default='10,11', help='comma separated year groups')
+    parser.add_argument('--tests', type=int, default=4, help='tests per class')
+    parser.add_argument('--curve-tests', type=float, default=0.25, help='share of tests graded on a curve instead of boundaries')
+    parser.add_argument('--marked', type=float, default=0.95, help='share of students with a mark in each test')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, so the same options always build the same school')
+
+
+# This function generates a school and returns a description of it for the benchmarks:
+# the school name, the usernames by type, the class codes (with their teacher and tests),
+# the subject years and the student ids.
+def generate_school(main, school, args):
+    from werkzeug.security import generate_password_hash
+    rng = random.Random(args.seed)
+    years = [year.strip() for year in args.years.split(',') if year.strip()]
+    subjects = SUBJECTS[:args.subjects]
+    password = generate_password_hash(PASSWORD)
+
+    def account(username, account_type):
+        return {'user_id': str(uuid.uuid4()), 'username': username, 'email': f'{username}@example.com', 'password': password, 'school': school, 'type': account_type}
+
+    admin = {'user_id': str(uuid.uuid4()), 'school': school, 'email': 'admin@example.com', 'username': 'admin', 'password': password, 'type': 'admin'}
+    students = [account(f'student{i:05d}', 'student') for i in range(args.students)]
+    students_by_year = {year: students[i::len(years)] for i, year in enumerate(years)}
+    classes = []
+    teachers = []
+    boundaries = []
+    for year in years:
+        year_students = [student['user_id'] for student in students_by_year[year]]
+        for subject in subjects:
+            subject_year = f'{subject}-Y{year}'
+            tests = [{
+                'subject': subject,
+                'test_name': f'{subject} Test {number + 1}',
+                'test_type': rng.choice(['Test', 'Mock', 'Homework']),
+                'max_mark': str(rng.choice([40, 50, 60, 80, 100])),
+                'grading_type': 'curve' if rng.random() < args.curve_tests else 'boundaries'
+            } for number in range(args.tests)]
+            for test in tests:
+                test['grade_boundaries'] = dict(BOUNDARIES) if test['grading_type'] == 'boundaries' else {}
+            if any(test['grading_type'] == 'boundaries' for test in tests):
+                boundaries.append({'subject_year': subject_year, 'test_name': None, 'grade_boundaries': dict(BOUNDARIES)})
+            for number, start in enumerate(range(0, len(year_students), args.class_size)):
+                teacher = account(f'teacher{len(teachers):04d}', 'teacher')
+                teachers.append(teacher)
+                members = year_students[start:start + args.class_size]
+                class_tests = []
+                for test in tests:
+                    max_mark = int(test['max_mark'])
+                    students_marks = {}
+                    for student_id in members:
+                        if rng.random() < args.marked:
+                            mark = min(max_mark, max(0, round(rng.gauss(0.62, 0.18) * max_mark)))
+                            students_marks[student_id] = {'mark': mark, 'percentage': round(((mark / max_mark) * 100), 1)}
+                    class_tests.append(dict(test, students_marks=students_marks))
+                classes.append({
+                    'classname': f'{year}{subject[:2].upper()}{number + 1}',
+                    'year': year,
+                    'subject': subject,
+                    'school': school,
+                    'teacher': teacher['user_id'],
+                    'code': main.random_class_codes(1)[0],
+                    'students': members,
+                    'tests': class_tests
+                })
+    main.accounts().insert_many([admin] + teachers + students)
+    main.testdb().insert_many(classes)
+    for entry in classes:
+        for test in entry['tests']:
+            if test['grading_type'] == 'curve' and test['students_marks']:
+                averages = {student_id: marks['percentage'] for student_id, marks in test['students_marks'].items()}
+                main.calculate_boundaries_and_graph(list(averages.values()), entry['subject'], entry['year'], averages, school, test_name=test['test_name'])
+    for entry in boundaries:
+        main.testdb().update_one({'subject_year': entry['subject_year'], 'test_name': None}, {'$set': {'grade_boundaries': entry['grade_boundaries']}}, upsert=True)
+    if main.marks_in_collection():
+        main.migrate_marks_to_collection()
+    main.mass_update_grades_for_school(school)
+    return {
+        'school': school,
+        'admin': admin['username'],
+        'teachers': [teacher['username'] for teacher in teachers],
+        'students': [student['username'] for student in students],
+        'student_ids': [student['user_id'] for student in students],
+        'classes': [{'code': entry['code'], 'teacher': teachers[i]['username'], 'students': entry['students'], 'tests': [test['test_name'] for test in entry['tests']]} for i, entry in enumerate(classes)],
+        'subject_years': [(subject, year) for year in years for subject in subjects]
+    }
+
+
+# This function deletes everything a generated school wrote, including its charts (once the
+# charts still queued on the render pool have been drawn).
+def delete_school(main, description):
+    import shutil
+    import time
+    school = description['school']
+    deadline = time.monotonic() + 60
+    while main._pending_charts and time.monotonic() < deadline:
+        time.sleep(0.05)
+    codes = [entry['code'] for entry in description['classes']]
+    main.testdb().delete_many({'school': school})
+    main.accounts().delete_many({'school': school})
+    main.marks().delete_many({'class_code': {'$in': codes}})
+    main.subject_year_stats().delete_many({'school': school})
+    main.student_summaries().delete_many({'student_id': {'$in': description['student_ids']}})
+    shutil.rmtree(os.path.join('static', 'subject_years', school), ignore_errors=True)
+    try:
+        os.removedirs(os.path.join('static', 'subject_years'))
+    except OSError:
+        pass
+
+
+def main_():
+    parser = argparse.ArgumentParser(description='Seed a synthetic school into MongoDB.')
+    parser.add_argument('--mongo', required=True, help='MongoDB address of a local mongod')
+    parser.add_argument('--school', default='Synthetic School')
+    add_arguments(parser)
+    args = parser.parse_args()
+    import main
+    main.config['mongodbaddress'] = args.mongo
+    main.ensure_indexes()
+    description = generate_school(main, args.school, args)
+    print(f"Created {args.school}: {len(description['students'])} students, {len(description['teachers'])} teachers, "
+          f"{len(description['classes'])} classes; every account's password is '{PASSWORD}' (admin username 'admin')")
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+#--Done--
+# This module renders the score distribution charts shown on the subject year and test pages.
+# It is kept separate from main.py so the render worker processes only import the plotting
+# stack (and never the Flask app or a MongoDB client). Matplotlib and seaborn are imported
+# inside render_histogram, so importing this module for chart keys stays cheap.
+
+#--Done--
+# These are the figure parameters every histogram is drawn with. They are part of the
+# chart key, so changing them makes every cached chart stale.
+HISTOGRAM_PARAMS = {'figsize': [12, 8], 'bins': 20, 'kde': True, 'alpha': 0.7, 'transparent': True, 'version': 1}
+
+#--Done--
+# This function returns the content key of a histogram.
+# The key is a SHA-256 hash of the sorted scores, the boundary values, the grade labels and
+# the figure parameters, so two charts with the same key are pixel for pixel the same.
+def chart_key(scores, percentile_ranks, grades):
+    payload = json.dumps([sorted(scores), list(percentile_ranks), list(grades), HISTOGRAM_PARAMS])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+#--Done--
+# This function returns the key stored alongside a rendered chart, or None if there is none.
+def read_chart_key(filename):
+    try:
+        with open(filename + '.key') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+#--Done--
+# This function atomically writes data to filename through a temporary file in the same directory.
+def _atomic_write(filename, write):
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+
+#--Done--
+# This function draws a histogram of scores with the grade boundaries marked and saves it as a PNG.
+# It performs the following steps:
+# 1. Creates a standalone Figure attached to an Agg canvas (no global pyplot state, so it is safe to call concurrently).
+# 2. Plots a histogram of the scores with a KDE curve.
+# 3. Adds a dashed vertical line and a label for each grade boundary.
+# 4. Saves the chart with a transparent background, atomically replacing the target file
+#    so pages never see a half written image.
+# 5. If a chart key is given, atomically writes it next to the PNG (filename + '.key').
+# 6. Returns the time the render took in seconds (reported on /metrics by the web workers).
+def render_histogram(filename, scores, percentile_ranks, grades, key=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import seaborn as sns
+    start = time.perf_counter()
+    fig = Figure(figsize=HISTOGRAM_PARAMS['figsize'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    sns.histplot(scores, bins=HISTOGRAM_PARAMS['bins'], kde=HISTOGRAM_PARAMS['kde'], edgecolor='k', alpha=HISTOGRAM_PARAMS['alpha'], ax=ax)
+    for grade, perc in zip(grades, percentile_ranks):
+        ax.axvline(perc, color='r', linestyle='--', linewidth=1)
+        ax.text(perc, ax.get_ylim()[1] * 0.9, f'{grade} ({int(perc)})', color='r', ha='center', va='bottom')
+    ax.set_xlabel('Scores')
+    ax.set_ylabel('Number of Students')
+    _atomic_write(filename, lambda f: fig.savefig(f, format='png', transparent=HISTOGRAM_PARAMS['transparent']))
+    if key:
+        _atomic_write(filename + '.key', lambda f: f.write(key.encode('utf-8')))
+    return time.perf_counter() - start
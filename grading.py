@@ -0,0 +1,74 @@
+from functools import lru_cache
+import numpy as np
+
+#--Done--
+# This module converts percentages to grades for every page and report.
+# Boundaries are sorted once into NumPy arrays and whole arrays of percentages are graded
+# with a single np.searchsorted call, instead of looping over the boundaries per score.
+
+#--Done--
+# This dictionary converts letter grades to the GCSE 9-4 scale used for Year 11 and below.
+GRADE_CONVERSION = {
+    "A*": 9,
+    "A": 8,
+    "B": 7,
+    "C": 6,
+    "D": 5,
+    "E": 4,
+    "U": "U"
+}
+
+#--Done--
+# This function returns True if grades for the given year are shown on the GCSE 9-4 scale.
+def uses_numeric_grades(year):
+    try:
+        return int(year) <= 11
+    except (TypeError, ValueError):
+        return False
+
+#--Done--
+# This function converts the grade labels of a boundaries dictionary to the GCSE 9-4 scale.
+def convert_boundaries(grade_boundaries):
+    return {GRADE_CONVERSION.get(grade, grade): boundary for grade, boundary in grade_boundaries.items()}
+
+#--Done--
+# This class grades percentages against one set of grade boundaries.
+# It performs the following steps:
+# 1. Drops empty boundaries and sorts the rest by boundary, highest first; boundaries that tie keep
+#    their original order, so the first listed grade wins (as the previous per-score loops did).
+# 2. Stores the boundaries in ascending order as a NumPy array with the matching labels,
+#    converting the labels to the GCSE 9-4 scale when numeric is True.
+# 3. grade_all() finds, for every percentage at once, the highest boundary it reaches using
+#    np.searchsorted; percentages below every boundary (or not a number) get the default.
+# 4. indexes() returns the same positions into labels without looking the labels up, for callers
+#    that count grades with NumPy (the default label is last).
+# 5. grade() grades a single percentage.
+class GradeScale:
+    def __init__(self, grade_boundaries, default='U', numeric=False):
+        ordered = sorted(((grade, boundary) for grade, boundary in grade_boundaries.items() if boundary is not None), key=lambda x: x[1], reverse=True)[::-1]
+        labels = [GRADE_CONVERSION.get(grade, grade) if numeric else grade for grade, _ in ordered]
+        self.thresholds = np.array([boundary for _, boundary in ordered], dtype=float)
+        self.labels = np.array(labels + [default], dtype=object)
+        self.default = default
+
+    def indexes(self, percentages):
+        values = np.asarray(percentages, dtype=float).reshape(-1)
+        indexes = np.searchsorted(self.thresholds, values, side='right') - 1
+        indexes[(indexes < 0) | np.isnan(values)] = len(self.labels) - 1
+        return indexes
+
+    def grade_all(self, percentages):
+        return self.labels[self.indexes(percentages)].tolist()
+
+    def grade(self, percentage):
+        return self.grade_all([percentage])[0]
+
+#--Done--
+# This function returns a GradeScale for a boundaries dictionary, reusing scales already built
+# for the same boundaries in this process.
+def grade_scale(grade_boundaries, default='U', numeric=False):
+    return _cached_grade_scale(tuple(grade_boundaries.items()), default, numeric)
+
+@lru_cache(maxsize=1024)
+def _cached_grade_scale(items, default, numeric):
+    return GradeScale(dict(items), default, numeric)
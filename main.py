@@ -1,21 +1,30 @@
-from flask import Flask, render_template, request, redirect, session, jsonify, url_for, Response
+from flask import Flask, render_template, request, redirect, session, jsonify, url_for, Response, g, send_file, before_render_template, template_rendered
 import uuid
 from yaml.loader import SafeLoader
 import yaml
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReplaceOne, IndexModel, ASCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
 from werkzeug.security import generate_password_hash, check_password_hash
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, FrameBreak
-from reportlab.lib.styles import getSampleStyleSheet
-import io
+from werkzeug.utils import secure_filename
 import csv
+import click
+import itertools
+import tempfile
+import threading
+import time
+import zipfile
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import charts
+import metrics
+import analytics
+from grading import GradeScale, grade_scale, uses_numeric_grades, convert_boundaries
 
 #--Done--
 # This code snippet initializes the Flask application and configures its settings.
@@ -37,125 +46,826 @@ with open('config.yaml') as f:
     config = yaml.load(f, Loader=SafeLoader)
 
 #--Done--
-# This function connects to the MongoDB database and returns the test data collection.
+# This code snippet holds the process-wide MongoDB client and collection registry.
+# A single MongoClient keeps its own connection pool and monitor threads, so it is
+# created once per process and shared by every request instead of once per call.
+# The client is never carried across a fork (e.g. gunicorn pre-fork workers): the
+# owning pid is recorded and a child process builds its own client on first use.
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_collections = {}
+_mongo_lock = threading.Lock()
+
+#--Done--
+# This function returns the shared MongoClient for the current process.
 # It performs the following steps:
-# 1. Creates a MongoClient object using the MongoDB address from the config.
-# 2. Connects to the "TestTracking" database.
-# 3. Retrieves the "data" collection from the database.
-# 4. Returns the test data collection.
-def testdb():
-    cluster = MongoClient(config['mongodbaddress'], connect=False)
-    db = cluster["TestTracking"]
-    testdbs = db["data"]
-    return testdbs
+# 1. Returns the existing client if it was created by this process.
+# 2. Otherwise takes the registry lock and checks again, so concurrent threads only build one client.
+# 3. Creates a MongoClient using the MongoDB address and the pool sizing and timeouts from the config,
+#    with the command listener that times every command when 'metrics' is enabled.
+# 4. Records the owning pid and clears any collections cached from a parent process.
+# 5. Returns the client.
+def mongo_client():
+    global _mongo_client, _mongo_client_pid
+    pid = os.getpid()
+    if _mongo_client is not None and _mongo_client_pid == pid:
+        return _mongo_client
+    with _mongo_lock:
+        if _mongo_client is None or _mongo_client_pid != pid:
+            _mongo_client = MongoClient(
+                config['mongodbaddress'],
+                connect=False,
+                maxPoolSize=config.get('mongomaxpoolsize', 100),
+                minPoolSize=config.get('mongominpoolsize', 0),
+                maxIdleTimeMS=config.get('mongomaxidletimems'),
+                connectTimeoutMS=config.get('mongoconnecttimeoutms', 20000),
+                socketTimeoutMS=config.get('mongosockettimeoutms'),
+                serverSelectionTimeoutMS=config.get('mongoserverselectiontimeoutms', 30000),
+                waitQueueTimeoutMS=config.get('mongowaitqueuetimeoutms'),
+                event_listeners=[metrics.CommandMetrics()] if config.get('metrics', True) else []
+            )
+            _mongo_client_pid = pid
+            _mongo_collections.clear()
+    return _mongo_client
 
 #--Done--
-# This function connects to the MongoDB database and returns the accounts collection.
+# This function returns a collection from the "TestTracking" database.
 # It performs the following steps:
-# 1. Creates a MongoClient object using the MongoDB address from the config.
-# 2. Connects to the "TestTracking" database.
-# 3. Retrieves the "accounts" collection from the database.
-# 4. Returns the accounts collection.
+# 1. Gets the shared client for the current process.
+# 2. Returns the cached collection if it was created from that client.
+# 3. Otherwise retrieves the collection from the database and caches it by name.
+def collection(name):
+    client = mongo_client()
+    cached = _mongo_collections.get(name)
+    if cached is None or cached.database.client is not client:
+        cached = client["TestTracking"][name]
+        _mongo_collections[name] = cached
+    return cached
+
+#--Done--
+# This function drops the shared client in a freshly forked child process.
+# The parent's sockets and monitor threads are not usable after a fork, so the
+# child forgets them and mongo_client() creates a new client on first use.
+def _reset_mongo_client_after_fork():
+    global _mongo_client, _mongo_client_pid, _mongo_lock
+    _mongo_client = None
+    _mongo_client_pid = None
+    _mongo_collections.clear()
+    _mongo_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_mongo_client_after_fork)
+
+#--Done--
+# This function returns the test data collection from the shared MongoDB client.
+def testdb():
+    return collection("data")
+
+#--Done--
+# This function returns the accounts collection from the shared MongoDB client.
 def accounts():
-    cluster = MongoClient(config['mongodbaddress'], connect=False)
-    db = cluster["TestTracking"]
-    accountsdb = db["accounts"]
-    return accountsdb
+    return collection("accounts")
+
+#--Done--
+# This code snippet instruments every request when 'metrics' is enabled in the config.
+# It performs the following steps:
+# 1. Before the request, records the start time and attributes everything the request does
+#    (MongoDB commands, templates, charts and reports) to its endpoint.
+# 2. After the request, records its duration and MongoDB round trips in the metrics histograms.
+#    The round trips are sent back in an X-DB-Round-Trips header, the write commands among them in
+#    an X-DB-Writes header, and the MongoDB and total time in a Server-Timing header, so N+1 query
+#    patterns and writes from pages that should only read show up on every response.
+# 3. When the request is torn down, restores the thread's context for the next request.
+@app.before_request
+def start_request_metrics():
+    if not config.get('metrics', True):
+        return
+    g.metrics_start = time.perf_counter()
+    g.metrics_tokens = (
+        metrics.current_endpoint.set(request.endpoint or 'unknown'),
+        metrics.request_stats.set({'db_round_trips': 0, 'db_writes': 0, 'db_seconds': 0.0})
+    )
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_start' not in g:
+        return response
+    endpoint = metrics.current_endpoint.get()
+    stats = metrics.request_stats.get()
+    elapsed = time.perf_counter() - g.metrics_start
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.REQUEST_ROUND_TRIPS.observe(stats['db_round_trips'], endpoint=endpoint)
+    response.headers['X-DB-Round-Trips'] = str(stats['db_round_trips'])
+    response.headers['X-DB-Writes'] = str(stats['db_writes'])
+    response.headers['Server-Timing'] = f"db;dur={stats['db_seconds'] * 1000:.1f}, app;dur={elapsed * 1000:.1f}"
+    return response
+
+@app.teardown_request
+def end_request_metrics(exception=None):
+    tokens = g.pop('metrics_tokens', None)
+    if tokens:
+        metrics.current_endpoint.reset(tokens[0])
+        metrics.request_stats.reset(tokens[1])
+
+#--Done--
+# These functions time every template render through Flask's before_render_template and
+# template_rendered signals (templates can render other templates, so the start times are a stack).
+def _template_started(sender, template, context, **extra):
+    if 'metrics_start' in g:
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        metrics.TEMPLATE_SECONDS.observe(time.perf_counter() - starts.pop(), endpoint=metrics.current_endpoint.get(), template=template.name)
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
+#--Done--
+# This dictionary declares the indexes every collection needs, keyed by collection name.
+# Each entry lists the fields of one index (with the index name) and covers the filters used
+# by the routes: class codes, school, class members, teachers, subject and year, the
+# subject year boundary documents and test names in the data collection, and school and
+# username or user_id in the accounts collection.
+# Class codes are unique within a school; the index only covers documents with a code, since
+# the subject year boundary documents in the same collection have neither school nor code.
+# Being partial, it cannot serve queries on school alone, which use the school and year index.
+INDEXES = {
+    'data': [
+        IndexModel([('code', ASCENDING)], name='code'),
+        IndexModel([('school', ASCENDING), ('code', ASCENDING)], name='school_code_unique', unique=True, partialFilterExpression={'code': {'$exists': True}}),
+        IndexModel([('school', ASCENDING), ('year', ASCENDING)], name='school_year'),
+        IndexModel([('students', ASCENDING)], name='students'),
+        IndexModel([('teacher', ASCENDING)], name='teacher'),
+        IndexModel([('teachers', ASCENDING)], name='teachers'),
+        IndexModel([('subject', ASCENDING), ('year', ASCENDING)], name='subject_year_fields'),
+        IndexModel([('subject_year', ASCENDING), ('test_name', ASCENDING)], name='subject_year_test_name'),
+        IndexModel([('tests.test_name', ASCENDING)], name='tests_test_name')
+    ],
+    'marks': [
+        IndexModel([('class_code', ASCENDING), ('test_name', ASCENDING), ('student_id', ASCENDING)], name='class_test_student', unique=True),
+        IndexModel([('school', ASCENDING), ('subject', ASCENDING), ('year', ASCENDING)], name='school_subject_year')
+    ],
+    'subject_year_stats': [
+        IndexModel([('school', ASCENDING), ('subject_year', ASCENDING)], name='school_subject_year', unique=True)
+    ],
+    'student_summaries': [
+        IndexModel([('student_id', ASCENDING)], name='student_id', unique=True)
+    ],
+    'page_versions': [
+        IndexModel([('school', ASCENDING), ('subject', ASCENDING), ('year', ASCENDING)], name='school_subject_year', unique=True)
+    ],
+    'jobs': [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at', expireAfterSeconds=0)
+    ],
+    'accounts': [
+        IndexModel([('school', ASCENDING), ('username', ASCENDING)], name='school_username'),
+        IndexModel([('user_id', ASCENDING)], name='user_id')
+    ]
+}
+
+#--Done--
+# This list holds the query shape of every route's lookups, as (description, collection, filter).
+# check_indexes() asks MongoDB to explain each one and reports any that would scan the whole collection.
+QUERY_SHAPES = [
+    ('class by code', 'data', {'code': 'ABCDE'}),
+    ('class code in school', 'data', {'school': 'school', 'code': 'ABCDE'}),
+    ('classes of a school', 'data', {'school': 'school'}),
+    ('named classes of a school', 'data', {'school': 'school', 'classname': {'$ne': '', '$exists': True}}),
+    ('every class (reconcile-boundaries)', 'data', {'code': {'$exists': True}}),
+    ('classes of a student', 'data', {'students': 'user_id'}),
+    ('classes of a student for a subject year', 'data', {'students': 'user_id', 'subject': 'Maths', 'year': '10'}),
+    ('classes of a teacher', 'data', {'$or': [{'teacher': 'user_id'}, {'teachers': 'user_id'}]}),
+    ('classes of a subject', 'data', {'subject': 'Maths'}),
+    ('classes of a subject year', 'data', {'subject': 'Maths', 'year': '10'}),
+    ('class holding a test', 'data', {'subject': 'Maths', 'year': '10', 'tests.test_name': 'Test'}),
+    ('classes holding a test name', 'data', {'tests.test_name': 'Test'}),
+    ('subject year boundaries', 'data', {'subject_year': 'Maths-Y10', 'test_name': None}),
+    ('subject years with boundaries', 'data', {'subject_year': {'$exists': True}, 'test_name': None}),
+    ('marks of classes', 'marks', {'class_code': {'$in': ['ABCDE', 'FGHIJ']}}),
+    ('marks of a student in classes', 'marks', {'class_code': {'$in': ['ABCDE', 'FGHIJ']}, 'student_id': {'$in': ['user_id']}}),
+    ('marks of a school subject year', 'marks', {'school': 'school', 'subject': 'Maths', 'year': '10'}),
+    ('subject year aggregates', 'subject_year_stats', {'school': 'school', 'subject_year': 'Maths-Y10'}),
+    ('classes of a school year', 'data', {'school': 'school', 'year': '10'}),
+    ('classes of a school subject', 'data', {'school': 'school', 'subject': 'Maths'}),
+    ('classes of a school subject year', 'data', {'school': 'school', 'subject': 'Maths', 'year': '10'}),
+    ('student summary', 'student_summaries', {'student_id': 'user_id'}),
+    ('page version of a subject year', 'page_versions', {'school': 'school', 'subject': 'Maths', 'year': '10'}),
+    ('page versions of a subject', 'page_versions', {'school': 'school', 'subject': 'Maths'}),
+    ('student summaries by student_ids', 'student_summaries', {'student_id': {'$in': ['user_id', 'other_user_id']}}),
+    ('login and duplicate username check', 'accounts', {'school': 'school', 'username': 'username'}),
+    ('account by user_id', 'accounts', {'user_id': 'user_id'}),
+    ('accounts by user_ids', 'accounts', {'user_id': {'$in': ['user_id', 'other_user_id']}}),
+    ('students of a school', 'accounts', {'school': 'school', 'type': 'student'}),
+    ('session check', 'accounts', {'username': 'username', 'user_id': 'user_id'})
+]
+
+#--Done--
+# This dictionary lists indexes that were replaced by one in INDEXES on the same keys with
+# different options, or that no query uses any more; ensure_indexes drops them first (MongoDB
+# will not create two indexes on the same keys).
+RETIRED_INDEXES = {
+    'data': ['school_code'],
+    'page_versions': ['subject_year']
+}
+
+#--Done--
+# This function creates every declared index. Creating an index that already exists with the
+# same definition does nothing, so it is safe to run at every startup.
+# Retired indexes (RETIRED_INDEXES) that still exist are dropped first.
+# It returns a dict of collection name to the names of its declared indexes.
+# With an on_error callback, a collection whose indexes cannot be created is reported to
+# on_error(name, error) and the other collections are still indexed; without one the error is raised.
+# Losing the connection to MongoDB always stops the pass.
+def ensure_indexes(on_error=None):
+    created = {}
+    for name, indexes in INDEXES.items():
+        try:
+            existing = set(collection(name).index_information())
+            for index_name in RETIRED_INDEXES.get(name, []):
+                if index_name in existing:
+                    collection(name).drop_index(index_name)
+            created[name] = collection(name).create_indexes(indexes)
+        except ConnectionFailure:
+            raise
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(name, e)
+    return created
+
+#--Done--
+# This function returns True if an explain() plan contains a full collection scan.
+def _plan_has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_plan_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_plan_has_collscan(value) for value in plan)
+    return False
+
+#--Done--
+# This function checks that every route query shape is served by an index.
+# It performs the following steps:
+# 1. Runs explain() on each entry in QUERY_SHAPES.
+# 2. Looks for a COLLSCAN stage in the winning plan.
+# 3. Returns a list of (description, collection, filter, uses_index) tuples.
+def check_indexes():
+    results = []
+    for description, name, query in QUERY_SHAPES:
+        plan = collection(name).find(query).explain()
+        winning_plan = plan.get('queryPlanner', {}).get('winningPlan', plan)
+        results.append((description, name, query, not _plan_has_collscan(winning_plan)))
+    return results
+
+#--Done--
+# This code snippet creates the indexes once per worker process, before its first request,
+# when 'ensureindexes' is enabled in the config. The pass is only ever attempted once: a collection
+# whose indexes cannot be created (for example a unique index over existing duplicates) is logged
+# and skipped, and if MongoDB cannot be reached the pass is abandoned, rather than retried on (and
+# serialising) every later request. Once the cause is fixed, create the indexes with
+# flask --app main ensure-indexes.
+_indexes_attempted = False
+_indexes_lock = threading.Lock()
+
+def _index_creation_failed(name, error):
+    app.logger.error("Creating the %s indexes failed, run 'flask --app main ensure-indexes' once this is fixed: %s", name, error)
+
+@app.before_request
+def ensure_indexes_once():
+    global _indexes_attempted
+    if _indexes_attempted or not config.get('ensureindexes', True):
+        return
+    with _indexes_lock:
+        if _indexes_attempted:
+            return
+        _indexes_attempted = True
+        try:
+            ensure_indexes(on_error=_index_creation_failed)
+        except ConnectionFailure as e:
+            app.logger.error("Creating indexes failed, MongoDB could not be reached; run 'flask --app main ensure-indexes' later: %s", e)
+
+#--Done--
+# This function resolves many student accounts with a single query.
+# It performs the following steps:
+# 1. Uses a per-request memo (stored on flask.g) so an id is never fetched twice in one request.
+# 2. Collects the ids that are not in the memo yet.
+# 3. Fetches all of them with one $in query, projecting only user_id, username and email.
+# 4. Stores the fetched accounts in the memo.
+# 5. Returns a dict mapping each known user_id to its account; unknown ids are left out.
+STUDENT_FIELDS = {'_id': 0, 'user_id': 1, 'username': 1, 'email': 1}
+def get_students(user_ids):
+    memo = g.setdefault('student_memo', {})
+    missing = {user_id for user_id in user_ids if user_id not in memo}
+    if missing:
+        for student in accounts().find({'user_id': {'$in': list(missing)}}, STUDENT_FIELDS):
+            memo[student['user_id']] = student
+        for user_id in missing:
+            memo.setdefault(user_id, None)
+    return {user_id: memo[user_id] for user_id in user_ids if memo.get(user_id)}
+
+#--Done--
+# This dictionary declares, for every route that reads class documents, the only fields it needs.
+# Class documents embed every test and every student's marks, so reads go through
+# find_class/find_classes with one of these names and never fetch whole documents.
+# Adding a field a page uses means adding it here; an undeclared name raises a KeyError.
+CLASS_FIELDS = {
+    'admin_subject_years': ('subject', 'year'),
+    'admin_classes': ('classname', 'year', 'code'),
+    'teacher_index': ('code', 'classname', 'year', 'subject', 'students'),
+    'subject_details': ('code', 'tests.subject', 'tests.test_name', 'tests.students_marks'),
+    'admin_student_performance': ('code', 'year', 'subject', 'tests.subject', 'tests.test_name', 'tests.grading_type', 'tests.grade_boundaries', 'tests.students_marks'),
+    'admin_subject_year_details': ('code', 'tests.subject', 'tests.test_name', 'tests.students_marks'),
+    'join_class': ('_id', 'school', 'subject', 'year'),
+    'view_class': ('code', 'classname', 'year', 'students', 'tests.test_name'),
+    'add_test': ('subject', 'school', 'year'),
+    'add_marks': ('code', 'classname', 'year', 'students'),
+    'submit_marks': ('code', 'school', 'subject', 'year', 'students'),
+    'student_performance': ('code', 'year', 'subject', 'tests.test_name', 'tests.grading_type', 'tests.grade_boundaries', 'tests.students_marks'),
+    'class_tests': ('code', 'classname', 'year', 'subject', 'students', 'tests.subject', 'tests.test_name', 'tests.grading_type', 'tests.grade_boundaries', 'tests.students_marks'),
+    'class_data': ('code', 'classname', 'school', 'subject', 'year', 'students', 'tests.test_name', 'tests.students_marks'),
+    'ensure_grade_boundaries': ('subject', 'year', 'tests.grade_boundaries'),
+    'subject_year_statistics': ('code', 'classname', 'students', 'tests.test_name', 'tests.students_marks'),
+    'school_scores': ('code', 'year', 'tests.subject', 'tests.test_name', 'tests.students_marks'),
+    'student_summaries': ('code', 'classname', 'subject', 'year', 'students', 'tests.subject', 'tests.test_name', 'tests.grade_boundaries', 'tests.students_marks'),
+    'chart_names': ('year', 'subject', 'tests.subject', 'tests.test_name'),
+    'migrate_marks': ('_id', 'code', 'school', 'year', 'tests.subject', 'tests.test_name', 'tests.students_marks')
+}
+
+#--Done--
+# This function builds the projection for a route's class document reads.
+# It performs the following steps:
+# 1. Includes the fields declared for the route in CLASS_FIELDS (and _id only if declared).
+# 2. When a student_id is given, narrows tests.students_marks to that one student's entry,
+#    so classmates' marks are never sent.
+# 3. When a test_name is given, replaces the tests.* fields with an $elemMatch that returns
+#    only that test.
+def class_projection(route, test_name=None, student_id=None):
+    projection = {'_id': 0}
+    for field in CLASS_FIELDS[route]:
+        if test_name is not None and field.startswith('tests.'):
+            continue
+        if student_id is not None and field == 'tests.students_marks':
+            field = f'tests.students_marks.{student_id}'
+        projection[field] = 1
+    if test_name is not None:
+        projection['tests'] = {'$elemMatch': {'test_name': test_name}}
+    return projection
+
+#--Done--
+# This function reads one class by code with the route's projection (see class_projection).
+def find_class(route, class_code, test_name=None, student_id=None):
+    return testdb().find_one({'code': class_code}, class_projection(route, test_name, student_id))
+
+#--Done--
+# This function reads every class matching a query with the route's projection (see class_projection).
+def find_classes(route, query, student_id=None):
+    return list(testdb().find(query, class_projection(route, student_id=student_id)))
+
+#--Done--
+# This function returns the collection that holds marks when 'marksstorage' is 'collection'.
+# There is one document per (class_code, test_name, student_id) with the mark and percentage,
+# plus the school, subject and year so whole subject years can be read without the classes.
+def marks():
+    return collection("marks")
+
+#--Done--
+# This function returns True if marks are kept in the marks collection rather than embedded
+# in each test's students_marks dict ('marksstorage' in config.yaml).
+def marks_in_collection():
+    return config.get('marksstorage', 'embedded') == 'collection'
+
+#--Done--
+# This function fills in the students_marks of every test in the given classes from the marks collection.
+# It performs the following steps:
+# 1. Does nothing when marks are embedded in the class documents.
+# 2. Resets each test's students_marks and fetches the marks of all the classes' loaded tests with
+#    one query, limited to the given students when a page only needs some of them.
+# 3. Puts each mark back into its test's students_marks, so pages read marks the same way in both modes.
+# 4. Returns the classes.
+MARK_FIELDS = {'_id': 0, 'class_code': 1, 'test_name': 1, 'student_id': 1, 'mark': 1, 'percentage': 1}
+def load_marks(class_entries, student_ids=None):
+    if not marks_in_collection() or not class_entries:
+        return class_entries
+    tests = {}
+    for class_entry in class_entries:
+        for test in class_entry.get('tests', []):
+            test['students_marks'] = {}
+            tests[(class_entry['code'], test['test_name'])] = test
+    query = {
+        'class_code': {'$in': list({class_entry['code'] for class_entry in class_entries})},
+        'test_name': {'$in': list({test_name for _, test_name in tests})}
+    }
+    if student_ids is not None:
+        query['student_id'] = {'$in': list(student_ids)}
+    for row in marks().find(query, MARK_FIELDS):
+        test = tests.get((row['class_code'], row['test_name']))
+        if test is not None:
+            test['students_marks'][row['student_id']] = {'mark': row['mark'], 'percentage': row['percentage']}
+    return class_entries
+
+#--Done--
+# This function writes students' marks for one test to the marks collection with unordered bulk
+# writes of at most 'bulkwritebatchsize' upserts, one per student.
+def save_marks(class_entry, test_entry, student_marks):
+    operations = [
+        UpdateOne(
+            {'class_code': class_entry['code'], 'test_name': test_entry['test_name'], 'student_id': student_id},
+            {'$set': {
+                'mark': entry['mark'],
+                'percentage': entry['percentage'],
+                'school': class_entry.get('school'),
+                'subject': test_entry['subject'],
+                'year': class_entry.get('year')
+            }},
+            upsert=True
+        )
+        for student_id, entry in student_marks.items()
+    ]
+    batch_size = config.get('bulkwritebatchsize', 1000)
+    for start in range(0, len(operations), batch_size):
+        try:
+            marks().bulk_write(operations[start:start + batch_size], ordered=False)
+        except BulkWriteError as e:
+            app.logger.error("Saving marks failed: %s", e.details.get('writeErrors'))
+
+#--Done--
+# This function moves every embedded students_marks dict into the marks collection.
+# For each class with embedded marks it upserts the marks (so it can be run again safely) and
+# then empties the students_marks of the tests it moved. Returns the number of marks moved.
+def migrate_marks_to_collection():
+    moved = 0
+    db = testdb()
+    for class_entry in find_classes('migrate_marks', {}):
+        emptied = {}
+        for index, test in enumerate(class_entry.get('tests', [])):
+            if test.get('students_marks'):
+                save_marks(class_entry, test, test['students_marks'])
+                moved += len(test['students_marks'])
+                emptied[f'tests.{index}.students_marks'] = {}
+        if emptied:
+            db.update_one({'_id': class_entry['_id']}, {'$set': emptied})
+    return moved
+
+#--Done--
+# This function moves marks from the marks collection back into each test's students_marks dict
+# and removes them from the collection. Returns the number of marks moved.
+def migrate_marks_to_classes():
+    moved = 0
+    db = testdb()
+    for class_code in marks().distinct('class_code'):
+        class_entry = find_class('migrate_marks', class_code)
+        if not class_entry:
+            continue
+        stored = {}
+        for row in marks().find({'class_code': class_code}, MARK_FIELDS):
+            stored.setdefault(row['test_name'], {})[row['student_id']] = {'mark': row['mark'], 'percentage': row['percentage']}
+        updates = {}
+        for index, test in enumerate(class_entry.get('tests', [])):
+            if test['test_name'] in stored:
+                updates[f'tests.{index}.students_marks'] = {**test.get('students_marks', {}), **stored[test['test_name']]}
+                moved += len(stored[test['test_name']])
+        if updates:
+            db.update_one({'_id': class_entry['_id']}, {'$set': updates})
+        marks().delete_many({'class_code': class_code, 'test_name': {'$in': list(stored)}})
+    return moved
+
+#--Done--
+# This class is a small thread-safe in-process cache with LRU eviction and an optional TTL.
+# It performs the following steps:
+# 1. Stores values in an OrderedDict together with the time they were stored.
+# 2. get() returns a stored value that has not expired and moves it to the most recently used end.
+# 3. set() stores a value and evicts the least recently used entries once maxsize is exceeded or,
+#    when maxbytes is given, once the values weigh more than maxbytes in total (each value is
+#    weighed with weigh, by default len). A value heavier than maxbytes on its own is not stored.
+# 4. invalidate() removes every entry whose key matches the given predicate (or all entries).
+# 5. Counts hits and misses so stats() can report how well the cache is working.
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None, weigh=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.weigh = weigh
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        size = self.weigh(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._entries[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                self.bytes = 0
+                return
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'bytes': self.bytes, 'maxbytes': self.maxbytes, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+#--Done--
+# This code snippet creates the user type cache used by is_logged_in().
+# Entries are keyed by (username, user_id) and hold the account type (or None if the
+# account was not found). The TTL bounds how long another worker process can serve a
+# stale type, since explicit invalidation only reaches the current process.
+user_type_cache = TTLCache(maxsize=config.get('usertypecachesize', 10000), ttl=config.get('usertypecachettl', 60))
+_MISSING = object()
+
+#--Done--
+# This code snippet creates the cache of rendered PDF reports used by generate_report.
+# Entries are keyed by (student_id, report version), so a report is rendered again as soon as
+# the student's marks, grades or account details change, and old versions are evicted as LRU.
+report_cache = TTLCache(maxsize=config.get('reportcachesize', 500))
+
+#--Done--
+# This code snippet creates the cache of the admin subject pages (subject_details and
+# admin_subject_year_details). Entries are keyed by (route, school, subject, year, page version)
+# and hold the response body, so a page is built again as soon as anything it shows changes, in any
+# worker (see page_version); bodies of older versions are no longer read and age out. The cache is
+# bounded both by the number of pages and by their total size in bytes, evicting the least
+# recently used pages first.
+page_cache = TTLCache(maxsize=config.get('pagecachesize', 1000), maxbytes=config.get('pagecachemaxbytes', 64 * 2 ** 20))
+
+#--Done--
+# This code snippet creates the cache of subject year statistics used by class_data. Entries are
+# keyed by (school, subject, year, page version), so every class of a subject year shares one
+# calculation until anything in the subject year changes (see page_version).
+statistics_cache = TTLCache(maxsize=config.get('statisticscachesize', 500))
+
+#--Done--
+# This function removes cached user types for a username, e.g. after an account is created.
+def invalidate_user_type(username):
+    user_type_cache.invalidate(lambda key: key[0] == username)
 
 #--Done--
 # This function checks if a user is logged in.
 # It performs the following steps:
 # 1. Checks if 'user' and 'user_id' are in the session.
-# 2. Connects to the database to retrieve the user information based on the session data.
-# 3. If the user is found, updates the session with the user's type.
-# 4. Returns True if the user is found in the database.
-# 5. Returns False if the user is not found in the session or database.
+# 2. Looks up the user's type in the user type cache, keyed by (username, user_id).
+# 3. On a cache miss, connects to the database to retrieve the user's type and caches it.
+# 4. If the user is found, updates the session with the user's type.
+# 5. Returns True if the user is in the session.
+# 6. Returns False if the user is not found in the session.
 def is_logged_in():
     if 'user' in session and 'user_id' in session:
-        db = accounts()
-        user = db.find_one({'username': session['user'], 'user_id': session['user_id']})
-        if user: 
-            session['user_type'] = user['type'] 
+        key = (session['user'], session['user_id'])
+        user_type = user_type_cache.get(key, _MISSING)
+        if user_type is _MISSING:
+            user = accounts().find_one({'username': key[0], 'user_id': key[1]}, {'type': 1, '_id': 0})
+            user_type = user['type'] if user else None
+            user_type_cache.set(key, user_type)
+        if user_type is not None:
+            session['user_type'] = user_type
         return True
     return False
 
 #--Done--
-# This function calculates grade boundaries and generates a graph of student scores.
+# This code snippet holds the worker process pools, keyed by name.
+# CPU heavy work (drawing charts, hashing passwords) runs in separate processes so it never
+# blocks a request and never touches pyplot's global state inside the web server. The pools
+# use the 'spawn' start method so workers do not inherit MongoDB sockets or threads.
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+#--Done--
+# This function returns the named process pool with the given number of workers, creating it
+# on first use in this process. It returns None when workers is 0, meaning "run inline".
+def process_pool(name, workers):
+    if not workers:
+        return None
+    with _process_pools_lock:
+        if name not in _process_pools:
+            _process_pools[name] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pools[name]
+
+#--Done--
+# This function returns the chart render pool ('renderworkers' processes, 0 draws charts inline).
+def render_pool():
+    return process_pool('render', config.get('renderworkers', 2))
+
+#--Done--
+# This function forgets the parent's process pools in a forked child process.
+def _reset_process_pools_after_fork():
+    global _process_pools_lock
+    _process_pools.clear()
+    _process_pools_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_process_pools_after_fork)
+
+#--Done--
+# This code snippet tracks the charts being drawn, per filename: the key of the render in flight and
+# the latest chart requested while it runs. Only one render per file runs at a time, so an older
+# render can never finish after a newer one and overwrite its PNG and key file.
+_pending_charts = {}
+_pending_charts_lock = threading.Lock()
+
+#--Done--
+# This function queues a histogram to be drawn by the render pool and returns without waiting.
+# It performs the following steps:
+# 1. Converts the scores and boundaries to plain floats so they can be sent to a worker process.
+# 2. Computes the chart's content key from the scores, boundaries, grades and figure parameters.
+# 3. Skips rendering if the PNG on disk was drawn from the same key, or the same chart is the latest
+#    one queued for the file.
+# 4. If a render of the file is in flight, keeps the chart as the file's next render (replacing
+#    any chart queued before it) and returns; _chart_done starts it when the render finishes.
+# 5. Otherwise starts the render (_start_chart) and returns its future (or None when drawn inline
+#    or not started).
+def submit_chart(filename, scores, percentile_ranks, grades):
+    scores = [float(score) for score in scores]
+    percentile_ranks = [float(perc) for perc in percentile_ranks]
+    key = charts.chart_key(scores, percentile_ranks, grades)
+    chart = (filename, scores, percentile_ranks, grades, key, metrics.current_endpoint.get())
+    with _pending_charts_lock:
+        entry = _pending_charts.get(filename)
+        if entry is not None:
+            latest = entry['next'][4] if entry['next'] else entry['key']
+            if latest != key:
+                entry['next'] = chart
+            return None
+        if os.path.exists(filename) and charts.read_chart_key(filename) == key:
+            return None
+        _pending_charts[filename] = {'key': key, 'next': None}
+    return _start_chart(chart)
+
+#--Done--
+# This function draws a chart claimed in _pending_charts.
+# It performs the following steps:
+# 1. If there is no render pool, draws the chart inline.
+# 2. Otherwise submits charts.render_histogram to the pool and logs any render failure when it completes.
+#    The render time is recorded on /metrics under the endpoint (or job) that queued the chart.
+# 3. Hands the file to _chart_done once the render has finished, which starts the next queued chart.
+#    If the pool cannot take the render, the file is released so later charts are not blocked.
+# 4. Returns the future (or None when drawn inline).
+def _start_chart(chart):
+    filename, scores, percentile_ranks, grades, key, endpoint = chart
+    pool = render_pool()
+    if pool is None:
+        try:
+            metrics.CHART_SECONDS.observe(charts.render_histogram(filename, scores, percentile_ranks, grades, key), endpoint=endpoint)
+        except Exception as e:
+            app.logger.error("Rendering %s failed: %s", filename, e)
+        _chart_done(filename)
+        return None
+    try:
+        future = pool.submit(charts.render_histogram, filename, scores, percentile_ranks, grades, key)
+    except Exception:
+        with _pending_charts_lock:
+            _pending_charts.pop(filename, None)
+        raise
+    def on_done(future):
+        if future.exception() is not None:
+            app.logger.error("Rendering %s failed: %s", filename, future.exception())
+        else:
+            metrics.CHART_SECONDS.observe(future.result(), endpoint=endpoint)
+        _chart_done(filename)
+    future.add_done_callback(on_done)
+    return future
+
+#--Done--
+# This function finishes a file's render: it starts the chart queued for the file while the render
+# ran, if there is one, and otherwise clears the file from the pending set.
+def _chart_done(filename):
+    with _pending_charts_lock:
+        entry = _pending_charts[filename]
+        chart = entry['next']
+        if chart is None:
+            del _pending_charts[filename]
+            return
+        entry['key'] = chart[4]
+        entry['next'] = None
+    _start_chart(chart)
+
+#--Done--
+# This function removes charts that no longer belong to a test or subject year of a school.
+# It performs the following steps:
+# 1. Builds the set of chart files that are still valid: one per subject year and one per test,
+#    from the school's classes (projected down to subject, year and test names).
+# 2. Walks static/subject_years/<school> and deletes any other PNG, chart key or leftover temporary file.
+# 3. Removes directories left empty, e.g. for a subject year that no longer exists.
+# 4. Returns the number of files removed.
+def evict_stale_charts(school_name):
+    root = f'static/subject_years/{school_name}'
+    if not os.path.isdir(root):
+        return 0
+    valid = set()
+    for class_entry in find_classes('chart_names', {'school': school_name}):
+        year = class_entry.get('year')
+        if class_entry.get('subject'):
+            subject_year = f"{class_entry['subject']}-Y{year}"
+            valid.add(os.path.join(root, subject_year, f'{subject_year}.png'))
+        for test in class_entry.get('tests', []):
+            subject_year = f"{test['subject']}-Y{year}"
+            valid.add(os.path.join(root, subject_year, f'{subject_year}.png'))
+            valid.add(os.path.join(root, subject_year, f"{test['test_name']}.png"))
+    removed = 0
+    with _pending_charts_lock:
+        pending = set(_pending_charts)
+    for directory, _, filenames in os.walk(root, topdown=False):
+        for name in filenames:
+            path = os.path.join(directory, name)
+            chart = path[:-len('.key')] if name.endswith('.key') else path
+            if chart in valid or chart in pending:
+                continue
+            if name.endswith('.tmp') and time.time() - os.path.getmtime(path) < 3600:
+                continue
+            os.remove(path)
+            removed += 1
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+    return removed
+
+#--Done--
+# These lists hold the percentiles that set curve grade boundaries and the grade each one gives.
+BOUNDARY_PERCENTILES = [90, 80, 70, 60, 50, 40, 0]
+BOUNDARY_GRADES = ['A*', 'A', 'B', 'C', 'D', 'E', 'U']
+
+#--Done--
+# This function calculates grade boundaries and queues a graph of student scores.
 # It performs the following steps:
 # 1. Defines the percentiles and grades for the grade boundaries.
 # 2. Calculates the percentile ranks for the given scores.
-# 3. Defines an inner function to assign grades based on the calculated percentile ranks.
-# 4. Assigns grades to the student scores using the inner function.
-# 5. Creates a DataFrame with the scores and assigned grades.
-# 6. Plots a histogram of the scores and adds vertical lines and labels for the grade boundaries.
-# 7. Constructs the filename for the graph image and creates directories if they do not exist.
-# 8. Saves the histogram plot as a PNG image with a transparent background.
-# 9. Connects to the database to update the grade boundaries for the given subject, year, and test name.
-# 10. Iterates through the student averages and updates their subject information with the average score and assigned grade.
+# 3. Builds a GradeScale from the calculated percentile ranks.
+# 4. Constructs the filename for the graph image.
+# 5. Queues the histogram (scores with the grade boundaries marked) on the render pool; the PNG is written later.
+# 6. For a single test (test_name given), stores its curve boundaries on the school's class test of that
+#    name in the subject year. A whole subject year's curve (test_name None) is kept in subject_year_stats
+#    instead, so no class test is written.
+# 7. Grades every student average in one vectorised call and updates the students' subject information with one bulk write (update_students_subjects).
 def calculate_boundaries_and_graph(scores, subject, year, student_averages, school_name, test_name=None):
-    percentiles = [90, 80, 70, 60, 50, 40, 0]
-    grades = ['A*', 'A', 'B', 'C', 'D', 'E', 'U']
+    percentiles = BOUNDARY_PERCENTILES
+    grades = BOUNDARY_GRADES
     percentile_ranks = np.percentile(scores, percentiles)
-    def assign_grade(score):
-        for i, perc in enumerate(percentile_ranks):
-            if score >= perc:
-                return grades[i]
-    student_grades = [assign_grade(score) for score in scores]
-    df = pd.DataFrame({'Score': scores, 'Grade': student_grades})
-    plt.figure(figsize=(12, 8))
-    sns.histplot(scores, bins=20, kde=True, edgecolor='k', alpha=0.7)
-    for i, perc in enumerate(percentile_ranks):
-        plt.axvline(perc, color='r', linestyle='--', linewidth=1)
-        plt.text(perc, plt.ylim()[1] * 0.9, f'{grades[i]} ({int(perc)})', color='r', ha='center', va='bottom')
-    plt.xlabel('Scores')
-    plt.ylabel('Number of Students')
+    scale = GradeScale(dict(zip(grades, percentile_ranks)))
     subject_year = f"{subject}-Y{year}"
     filename = f'static/subject_years/{school_name}/{subject_year}/{test_name if test_name else subject_year}.png'
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    plt.savefig(filename, transparent=True)
-    db = testdb()
-    grade_boundaries = {grade: rank for grade, rank in zip(grades, percentile_ranks)}
-    db.update_one(
-        {'subject': subject, 'year': year, 'tests.test_name': test_name},
-        {'$set': {'tests.$.grade_boundaries': grade_boundaries}}
-    )
-    for student_id, average_score in student_averages.items():
-        grade = assign_grade(average_score)
-        update_student_subjects(student_id, subject_year, average_score, grade, test_name)
+    submit_chart(filename, scores, percentile_ranks, grades)
+    if test_name is not None:
+        grade_boundaries = {grade: rank for grade, rank in zip(grades, percentile_ranks)}
+        testdb().update_one(
+            {'school': school_name, 'subject': subject, 'year': year, 'tests': {'$elemMatch': {'test_name': test_name}}},
+            {'$set': {'tests.$.grade_boundaries': grade_boundaries}}
+        )
+    student_ids = list(student_averages)
+    average_grades = scale.grade_all([student_averages[student_id] for student_id in student_ids])
+    update_students_subjects(subject_year, {student_id: (student_averages[student_id], grade) for student_id, grade in zip(student_ids, average_grades)}, test_name)
 
 #--Done--
-# This function updates the subject information for a specific student.
+# This function updates the subject information of many students with bulk writes.
 # It performs the following steps:
-# 1. Connects to the database to retrieve student information.
-# 2. Finds the student document based on the student_id.
-# 3. If the student document is not found, exits the function.
-# 4. Checks if the student document has a 'subjects' field that is a list:
-#    - If not, initializes the 'subjects' field as an empty list in the database.
-# 5. Checks if there is an existing subject entry for the given subject year and test name:
-#    - If an existing subject is found, updates the average percentage and grade in the database.
-#    - If no existing subject is found, adds a new subject entry with the subject year, test name, average percentage, and grade to the database.
-def update_student_subjects(student_id, subject_year, average_score, grade, test_name=None):
-    db = testdb()
-    student_doc = db.find_one({'user_id': student_id})
-    if not student_doc:
-        return
-    if 'subjects' not in student_doc or not isinstance(student_doc['subjects'], list):
-        db.update_one(
-            {'user_id': student_id},
-            {'$set': {'subjects': []}}
-        )
-    existing_subject = next((subj for subj in student_doc['subjects'] if subj['subject_year'] == subject_year and subj['test_name'] == test_name), None)
-    if existing_subject:
-        db.update_one(
-            {'user_id': student_id, 'subjects.subject_year': subject_year, 'subjects.test_name': test_name},
+# 1. Builds two conditional updates per student on the accounts collection:
+#    - One that sets the average percentage and grade on an existing entry for the subject year and test name.
+#    - One that pushes a new entry when the student has no entry for the subject year and test name yet.
+#    Exactly one of the two matches, so the order they run in does not matter.
+# 2. Sends the updates with unordered bulk_write calls of at most 'bulkwritebatchsize' operations each.
+# 3. Logs (rather than raises) write errors for individual students so the rest of the batch is applied.
+# Students without an account are left alone; no account documents are created.
+def update_students_subjects(subject_year, student_grades, test_name=None):
+    db = accounts()
+    batch_size = config.get('bulkwritebatchsize', 1000)
+    requests = []
+    for student_id, (average_score, grade) in student_grades.items():
+        match = {'subject_year': subject_year, 'test_name': test_name}
+        requests.append(UpdateOne(
+            {'user_id': student_id, 'subjects': {'$elemMatch': match}},
             {'$set': {
                 'subjects.$.average_percentage': average_score,
                 'subjects.$.grade': grade
             }}
-        )
-    else:
-        db.update_one(
-            {'user_id': student_id},
+        ))
+        requests.append(UpdateOne(
+            {'user_id': student_id, 'subjects': {'$not': {'$elemMatch': match}}},
             {'$push': {
                 'subjects': {
                     'subject_year': subject_year,
@@ -164,25 +874,166 @@ def update_student_subjects(student_id, subject_year, average_score, grade, test
                     'grade': grade
                 }
             }}
-        )
+        ))
+    for start in range(0, len(requests), batch_size):
+        try:
+            db.bulk_write(requests[start:start + batch_size], ordered=False)
+        except BulkWriteError as e:
+            app.logger.error("Updating subjects for %s failed for %d students: %s", subject_year, len(e.details.get('writeErrors', [])), e.details.get('writeErrors', [])[:5])
 
 #--Done--
-# This function performs a mass update of grades for a given school.
+# This code snippet holds the background job runner.
+# Long running work (such as recomputing a whole school's grades) runs on a local
+# thread pool instead of inside the HTTP request. The job records are kept in the 'jobs'
+# collection and the deduplication locks in 'job_locks', so every worker process can report
+# a job's status and two workers never run the same job at once.
+_jobs_lock = threading.Lock()
+_job_executor = None
+
+#--Done--
+# This function returns the collection of job records, one document per job keyed by its job ID.
+# Records expire (through a TTL index on expires_at) 'jobretention' seconds after the job ends.
+def jobs():
+    return collection("jobs")
+
+#--Done--
+# This function returns the collection of job locks, one document per queued or running job keyed
+# by the job's deduplication key, holding its job ID and when the lock goes stale.
+def job_locks():
+    return collection("job_locks")
+
+#--Done--
+# This function returns the job thread pool, creating it on first use in this process.
+def job_executor():
+    global _job_executor
+    with _jobs_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=config.get('jobworkers', 2), thread_name_prefix='job')
+        return _job_executor
+
+#--Done--
+# This function forgets the parent's job pool in a forked child process.
+def _reset_jobs_after_fork():
+    global _job_executor, _jobs_lock
+    _job_executor = None
+    _jobs_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_jobs_after_fork)
+
+#--Done--
+# This function returns when a job record should expire: 'jobretention' seconds after the given time.
+def job_expiry(seconds_from_now=0):
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now + config.get('jobretention', 86400))
+
+#--Done--
+# This function submits a background job, deduplicated by key across every worker process.
 # It performs the following steps:
-# 1. Connects to the databases to retrieve class and student information.
-# 2. Finds all classes for the given school.
-# 3. Initializes a dictionary to store scores for each subject and year combination.
-# 4. Iterates through each class and test to collect student marks and calculate percentages:
-#    - Retrieves the subject and year for each test.
-#    - Stores student IDs and percentages in the subject_year_scores dictionary.
-# 5. Iterates through each subject year and scores to calculate average scores and update grades:
-#    - Calculates the average percentage for each student.
-#    - Prepares a dictionary of student average scores.
-#    - Splits the subject year string to get the subject and year.
-#    - Calls the calculate_boundaries_and_graph function to update grade boundaries and generate graphs.
-def mass_update_grades_for_school(school_name):
-    db = testdb()
-    classes = db.find({'school': school_name})
+# 1. Inserts a job record with a unique job ID, its kind, owner and a 'queued' status.
+# 2. Takes the key's lock by inserting a job_locks document with the key as its _id.
+# 3. If another job holds the lock and is still queued or running (and has reported progress within
+#    'jobtimeout' seconds), deletes the new record and returns that job instead. A lock left by a
+#    job that ended or whose worker died is removed and taken over.
+# 4. Hands the function to this process's job pool; it is called with a progress(done, total=None)
+#    keyword argument.
+# 5. Returns the job record.
+def submit_job(kind, key, func, *args, owner=None, **kwargs):
+    executor = job_executor()
+    now = time.time()
+    job = {
+        'job_id': str(uuid.uuid4()),
+        'kind': kind,
+        'key': json.dumps(list(key), default=str),
+        'owner': owner,
+        'status': 'queued',
+        'progress': 0,
+        'total': None,
+        'result': None,
+        'error': None,
+        'created': now,
+        'started': None,
+        'finished': None
+    }
+    jobs().insert_one(dict(job, _id=job['job_id'], expires_at=job_expiry(config.get('jobtimeout', 3600))))
+    for attempt in range(3):
+        try:
+            job_locks().insert_one({'_id': job['key'], 'job_id': job['job_id'], 'stale_after': now + config.get('jobtimeout', 3600)})
+            break
+        except DuplicateKeyError:
+            lock = job_locks().find_one({'_id': job['key']})
+            if lock is None:
+                continue
+            existing = get_job(lock['job_id'])
+            if existing and existing['status'] in ('queued', 'running') and lock['stale_after'] > now:
+                jobs().delete_one({'_id': job['job_id']})
+                return existing
+            job_locks().delete_one({'_id': job['key'], 'job_id': lock['job_id']})
+    else:
+        jobs().delete_one({'_id': job['job_id']})
+        raise RuntimeError(f"Could not lock job {job['key']}")
+    executor.submit(_run_job, job, func, args, kwargs)
+    return job
+
+#--Done--
+# This function runs a job on the pool and records its status, progress, result or error in its
+# job record. Progress is written at most once a second, and each write keeps the job's lock fresh.
+# When the job ends its lock is released. Its MongoDB commands, charts and reports are recorded on
+# /metrics under 'job:<kind>'.
+def _run_job(job, func, args, kwargs):
+    token = metrics.current_endpoint.set(f"job:{job['kind']}")
+    job['status'] = 'running'
+    job['started'] = time.time()
+    jobs().update_one({'_id': job['job_id']}, {'$set': {'status': 'running', 'started': job['started']}})
+    last_write = [0.0]
+    def progress(done, total=None):
+        job['progress'] = done
+        if total is not None:
+            job['total'] = total
+        now = time.time()
+        if now - last_write[0] >= 1:
+            last_write[0] = now
+            jobs().update_one({'_id': job['job_id']}, {'$set': {'progress': job['progress'], 'total': job['total']}})
+            job_locks().update_one({'_id': job['key'], 'job_id': job['job_id']}, {'$set': {'stale_after': now + config.get('jobtimeout', 3600)}})
+    try:
+        job['result'] = func(*args, progress=progress, **kwargs)
+        job['status'] = 'finished'
+    except Exception as e:
+        app.logger.exception("Job %s (%s) failed", job['job_id'], job['kind'])
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        job['finished'] = time.time()
+        try:
+            jobs().update_one({'_id': job['job_id']}, {'$set': {
+                'status': job['status'], 'progress': job['progress'], 'total': job['total'], 'result': job['result'],
+                'error': job['error'], 'finished': job['finished'], 'expires_at': job_expiry()
+            }})
+        finally:
+            job_locks().delete_one({'_id': job['key'], 'job_id': job['job_id']})
+            metrics.current_endpoint.reset(token)
+
+#--Done--
+# This function returns a job record, or None if there is no such job (or its record has expired).
+JOB_FIELDS = {'_id': 0, 'expires_at': 0}
+def get_job(job_id):
+    return jobs().find_one({'_id': job_id}, JOB_FIELDS)
+
+#--Done--
+# This function returns the public fields of a job record for JSON responses.
+def job_status_data(job):
+    data = {key: job[key] for key in ('job_id', 'kind', 'status', 'progress', 'total', 'result', 'error', 'created', 'started', 'finished')}
+    data['status_url'] = url_for('job_status', job_id=job['job_id'])
+    return data
+
+#--Done--
+# This function collects a school's scores per subject year by loading every class into Python.
+# It performs the following steps:
+# 1. Finds all classes for the given school (with their marks, see load_marks).
+# 2. Iterates through each class and test to collect student IDs and percentages per subject year.
+# 3. Yields (subject year, all percentages, dict of student ID to that student's percentages)
+#    for each subject year that has scores.
+def _python_subject_year_scores(school_name):
+    classes = load_marks(find_classes('school_scores', {'school': school_name}))
     subject_year_scores = {}
     for class_entry in classes:
         year = class_entry.get('year')
@@ -196,15 +1047,331 @@ def mass_update_grades_for_school(school_name):
                 subject_year_scores[subject_year].append((student_id, percentage))
     for subject_year, scores in subject_year_scores.items():
         if scores:
-            percentages = [score[1] for score in scores]
-            student_averages = {}
+            student_scores = {}
             for student_id, percentage in scores:
-                if student_id not in student_averages:
-                    student_averages[student_id] = []
-                student_averages[student_id].append(percentage)
-            average_scores = {student_id: round((sum(percentages) / len(percentages)),1) for student_id, percentages in student_averages.items()}
-            subject, year = subject_year.split('-Y')
-            calculate_boundaries_and_graph(percentages, subject, year, average_scores, school_name)
+                student_scores.setdefault(student_id, []).append(percentage)
+            yield subject_year, [score[1] for score in scores], student_scores
+
+#--Done--
+# This function collects a school's scores per subject year with a MongoDB aggregation.
+# It performs the following steps:
+# 1. Matches the school's classes and keeps only the year and each test's subject and marks.
+# 2. Unwinds the tests, turns each test's students_marks dict into an array and unwinds it.
+#    (When marks are kept in the marks collection, steps 1 and 2 are a single match on that collection.)
+# 3. Groups by (subject year, student ID), pushing the student's percentages.
+# 4. Sorts by subject year, so one subject year's rows arrive together.
+# 5. Streams the (subject_year, student_id, scores) rows back and yields one subject year at a time,
+#    so only a single subject year's scores are held in memory.
+# The average is taken from the returned scores in Python so it matches the Python engine exactly.
+# Passing a subject and year limits the pipeline to that one subject year.
+def _aggregate_subject_year_scores(school_name, subject=None, year=None):
+    match = {'school': school_name}
+    if year is not None:
+        match['year'] = year
+    if marks_in_collection():
+        if subject is not None:
+            match['subject'] = subject
+        source = marks()
+        pipeline = [
+            {'$match': match},
+            {'$group': {
+                '_id': {'subject_year': {'$concat': ['$subject', '-Y', {'$toString': '$year'}]}, 'student_id': '$student_id'},
+                'scores': {'$push': '$percentage'}
+            }}
+        ]
+    else:
+        source = testdb()
+        pipeline = [
+            {'$match': match},
+            {'$project': {'_id': 0, 'year': 1, 'tests.subject': 1, 'tests.students_marks': 1}},
+            {'$unwind': '$tests'},
+            {'$match': {'tests.subject': subject} if subject is not None else {}},
+            {'$project': {
+                'subject_year': {'$concat': ['$tests.subject', '-Y', {'$toString': '$year'}]},
+                'marks': {'$objectToArray': '$tests.students_marks'}
+            }},
+            {'$unwind': '$marks'},
+            {'$group': {
+                '_id': {'subject_year': '$subject_year', 'student_id': '$marks.k'},
+                'scores': {'$push': '$marks.v.percentage'}
+            }}
+        ]
+    pipeline += [
+        {'$sort': {'_id.subject_year': 1}},
+        {'$project': {'_id': 0, 'subject_year': '$_id.subject_year', 'student_id': '$_id.student_id', 'scores': 1}}
+    ]
+    rows = source.aggregate(pipeline, allowDiskUse=True)
+    for subject_year, group in itertools.groupby(rows, key=lambda row: row['subject_year']):
+        student_scores = {row['student_id']: row['scores'] for row in group}
+        percentages = [percentage for scores in student_scores.values() for percentage in scores]
+        if subject_year and percentages:
+            yield subject_year, percentages, student_scores
+
+#--Done--
+# This function recalculates the grades of one subject year from all of its marks.
+# It performs the following steps:
+# 1. Calculates the average percentage for each student (average_percentage, as incremental updates do).
+# 2. Splits the subject year string to get the subject and year.
+# 3. Calls the calculate_boundaries_and_graph function to update grade boundaries and generate graphs.
+# 4. Rebuilds the subject year's running aggregates (rebuild_subject_year_stats) used by incremental updates.
+# 5. Marks the subject year's pages in the school as changed (bump_page_version).
+def update_subject_year(school_name, subject_year, percentages, student_scores):
+    average_scores = {student_id: average_percentage(sum(percentage_tenths(score) for score in scores), len(scores)) for student_id, scores in student_scores.items()}
+    subject, year = subject_year.split('-Y')
+    calculate_boundaries_and_graph(percentages, subject, year, average_scores, school_name)
+    rebuild_subject_year_stats(school_name, subject_year, student_scores)
+    bump_page_version(school_name, subject, year)
+
+#--Done--
+# This function performs a mass update of grades for a given school.
+# It performs the following steps:
+# 1. Collects the scores for each subject and year combination with the configured engine:
+#    - 'aggregate' (the default) streams per student scores from a MongoDB aggregation.
+#    - 'python' loads every class document and collects the scores in Python.
+# 2. Updates each subject year in turn with update_subject_year, reporting progress (subject years done)
+#    through the optional progress callback.
+# 3. Rebuilds the summaries of every student in the school.
+# 4. Evicts charts left over from deleted tests or subject years.
+def mass_update_grades_for_school(school_name, progress=None):
+    if config.get('gradeengine', 'aggregate') == 'python':
+        subject_year_scores = _python_subject_year_scores(school_name)
+    else:
+        subject_year_scores = _aggregate_subject_year_scores(school_name)
+    done = 0
+    for subject_year, percentages, student_scores in subject_year_scores:
+        update_subject_year(school_name, subject_year, percentages, student_scores)
+        done += 1
+        if progress:
+            progress(done)
+    refresh_student_summaries(testdb().distinct('students', {'school': school_name}))
+    return {'subject_years': done, 'charts_evicted': evict_stale_charts(school_name)}
+
+#--Done--
+# This function returns the collection of per subject year running aggregates.
+# There is one document per (school, subject_year) holding:
+# - students: each student's sum (in tenths of a percent) and count of percentages in the subject year,
+# - hist: how many marks there are at each percentage (keyed by the percentage x 10, since
+#   percentages are stored to one decimal place, so the distribution is exact),
+# - grade_boundaries: the curve boundaries last computed from that distribution,
+# - sums: 'tenths', marking documents whose sums are integers (SUBJECT_YEAR_SUMS); older documents
+#   with floating point sums are rebuilt the next time a mark in the subject year changes.
+def subject_year_stats():
+    return collection("subject_year_stats")
+
+SUBJECT_YEAR_SUMS = 'tenths'
+
+#--Done--
+# This function returns a percentage in whole tenths of a percent. Percentages are stored to one
+# decimal place, so sums of these are exact however many marks are added and taken away, where
+# floating point sums would drift.
+def percentage_tenths(percentage):
+    return int(round(percentage * 10))
+
+#--Done--
+# This function returns an average percentage, rounded to one decimal place, from a sum in tenths.
+def average_percentage(total_tenths, count):
+    return round(total_tenths / count / 10, 1)
+
+#--Done--
+# This function returns the histogram key of a percentage (the percentage x 10, as a string).
+def histogram_key(percentage):
+    return str(percentage_tenths(percentage))
+
+#--Done--
+# This function calculates percentiles from a histogram of marks.
+# It gives the same result as np.percentile (linear interpolation) on the full list of marks,
+# but only walks the distinct values, so it does not depend on how many marks there are.
+def histogram_percentiles(hist, percentiles):
+    items = sorted((int(key), count) for key, count in hist.items() if count > 0)
+    if not items:
+        return None
+    values = np.array([key / 10 for key, _ in items])
+    cumulative = np.cumsum([count for _, count in items])
+    ranks = np.array(percentiles, dtype=float) / 100 * (cumulative[-1] - 1)
+    lower = values[np.searchsorted(cumulative, np.floor(ranks), side='right')]
+    upper = values[np.searchsorted(cumulative, np.ceil(ranks), side='right')]
+    return lower + (upper - lower) * (ranks - np.floor(ranks))
+
+#--Done--
+# This function expands a histogram back into the list of marks it counts (used to draw the chart).
+def histogram_scores(hist):
+    return [int(key) / 10 for key, count in hist.items() for _ in range(max(count, 0))]
+
+#--Done--
+# This function replaces a subject year's running aggregates with ones built from every mark.
+# It performs the following steps:
+# 1. Sums (in tenths) and counts each student's percentages.
+# 2. Counts the marks at each percentage into the histogram.
+# 3. Calculates the curve grade boundaries from all the marks.
+# 4. Replaces (or creates) the subject year's aggregates document.
+def rebuild_subject_year_stats(school_name, subject_year, student_scores):
+    hist = {}
+    for scores in student_scores.values():
+        for percentage in scores:
+            key = histogram_key(percentage)
+            hist[key] = hist.get(key, 0) + 1
+    ranks = histogram_percentiles(hist, BOUNDARY_PERCENTILES)
+    subject_year_stats().replace_one(
+        {'school': school_name, 'subject_year': subject_year},
+        {
+            'school': school_name,
+            'subject_year': subject_year,
+            'students': {student_id: {'sum': sum(percentage_tenths(score) for score in scores), 'count': len(scores)} for student_id, scores in student_scores.items()},
+            'hist': hist,
+            'grade_boundaries': dict(zip(BOUNDARY_GRADES, ranks.tolist())) if ranks is not None else {},
+            'sums': SUBJECT_YEAR_SUMS
+        },
+        upsert=True
+    )
+
+#--Done--
+# This function applies changed marks to a subject year's running aggregates and regrades the
+# students whose grade may have changed.
+# It performs the following steps:
+# 1. Builds one $inc update from the changes (student_id, old percentage or None, new percentage or None):
+#    the old mark is taken out of the student's sum (in tenths), count and the histogram, and the new one added.
+# 2. Applies it in one update; if the subject year has no aggregates yet (or only ones with floating
+#    point sums), recalculates the whole subject year from the marks in the database instead (which
+#    already include the new marks) and stops.
+# 3. Reads back the histogram, the previous grade boundaries and the changed students' sums and counts.
+# 4. Recalculates the curve grade boundaries from the histogram and stores them.
+# 5. If the boundaries moved, reads back every student's sum and count, since any of their grades
+#    may have changed; otherwise only the changed students' averages need grading.
+# 6. Grades those averages and writes them with one bulk write.
+# 7. Queues the subject year chart, which is skipped if the distribution did not change.
+# Unless the boundaries move, the work depends on the number of changed students and distinct marks,
+# not the size of the school; when they do, it matches recalculating the subject year from every mark.
+def apply_mark_changes(school_name, subject, year, changes):
+    subject_year = f"{subject}-Y{year}"
+    increments = {}
+    def add(field, amount):
+        increments[field] = increments.get(field, 0) + amount
+    for student_id, old_percentage, new_percentage in changes:
+        for percentage, sign in ((old_percentage, -1), (new_percentage, 1)):
+            if percentage is not None:
+                add(f'students.{student_id}.sum', sign * percentage_tenths(percentage))
+                add(f'students.{student_id}.count', sign)
+                add(f'hist.{histogram_key(percentage)}', sign)
+    if not increments:
+        return
+    stats = subject_year_stats()
+    result = stats.update_one({'school': school_name, 'subject_year': subject_year, 'sums': SUBJECT_YEAR_SUMS}, {'$inc': increments})
+    if not result.matched_count:
+        for _, percentages, student_scores in _aggregate_subject_year_scores(school_name, subject, year):
+            update_subject_year(school_name, subject_year, percentages, student_scores)
+        return
+    changed = {student_id for student_id, _, _ in changes}
+    projection = {'hist': 1, 'grade_boundaries': 1, '_id': 0}
+    projection.update({f'students.{student_id}': 1 for student_id in changed})
+    entry = stats.find_one({'school': school_name, 'subject_year': subject_year}, projection)
+    ranks = histogram_percentiles(entry.get('hist', {}), BOUNDARY_PERCENTILES)
+    if ranks is None:
+        return
+    grade_boundaries = dict(zip(BOUNDARY_GRADES, ranks.tolist()))
+    students = entry.get('students', {})
+    if grade_boundaries != entry.get('grade_boundaries'):
+        stats.update_one({'school': school_name, 'subject_year': subject_year}, {'$set': {'grade_boundaries': grade_boundaries}})
+        students = stats.find_one({'school': school_name, 'subject_year': subject_year}, {'students': 1, '_id': 0}).get('students', {})
+    averages = {}
+    for student_id, totals in students.items():
+        if totals.get('count', 0) > 0:
+            averages[student_id] = average_percentage(totals['sum'], totals['count'])
+    scale = GradeScale(grade_boundaries)
+    student_ids = list(averages)
+    grades = scale.grade_all([averages[student_id] for student_id in student_ids])
+    update_students_subjects(subject_year, {student_id: (averages[student_id], grade) for student_id, grade in zip(student_ids, grades)})
+    submit_chart(f'static/subject_years/{school_name}/{subject_year}/{subject_year}.png', histogram_scores(entry['hist']), ranks, BOUNDARY_GRADES)
+
+#--Done--
+# This function returns the collection of materialised per-student summaries.
+# There is one document per student holding everything the student pages and report need:
+# - classes: the code, name, subject and year of every class the student is in,
+# - tests: every marked test, in class order, with the student's percentage and the test grade,
+# - subjects_years: the total, count, average percentage and grade of each subject year.
+def student_summaries():
+    return collection("student_summaries")
+
+#--Done--
+# This function rebuilds the summaries of many students at once.
+# It performs the following steps:
+# 1. Loads every class the students are in with one $in query, projecting only the fields used.
+# 2. Collects each student's classes and marked tests (grading each test with its own boundaries)
+#    and totals their percentages per subject year.
+# 3. Loads the boundaries of all the subject years involved with one $in query and grades each
+#    subject year average ('N/A' if the subject year has no boundaries).
+# 4. Stamps each summary with a version (a SHA-256 hash of its contents) and the time it was built,
+#    which identify the student's report (see generate_report).
+# 5. Replaces the summaries with unordered bulk writes of at most 'bulkwritebatchsize' operations.
+# 6. Returns the rebuilt summaries keyed by student id.
+def refresh_student_summaries(student_ids):
+    student_ids = list(set(student_ids))
+    if not student_ids:
+        return {}
+    db = testdb()
+    summaries = {student_id: {'student_id': student_id, 'classes': [], 'tests': [], 'subjects_years': {}} for student_id in student_ids}
+    for class_entry in load_marks(find_classes('student_summaries', {'students': {'$in': student_ids}}), student_ids):
+        year = class_entry.get('year')
+        for student_id in class_entry.get('students', []):
+            summary = summaries.get(student_id)
+            if summary is None:
+                continue
+            summary['classes'].append({'code': class_entry.get('code'), 'classname': class_entry.get('classname'), 'subject': class_entry.get('subject'), 'year': year})
+            for test in class_entry.get('tests', []):
+                if student_id in test.get('students_marks', {}):
+                    percentage = test['students_marks'][student_id]['percentage']
+                    subject = test['subject']
+                    summary['tests'].append({
+                        'class_code': class_entry.get('code'),
+                        'classname': class_entry.get('classname', 'N/A'),
+                        'class_subject': class_entry.get('subject'),
+                        'year': year,
+                        'subject': subject,
+                        'test_name': test['test_name'],
+                        'percentage': percentage,
+                        'grade': grade_scale(test.get('grade_boundaries', {})).grade(percentage)
+                    })
+                    subject_year = f"{subject}-Y{year if year is not None else 'N/A'}"
+                    totals = summary['subjects_years'].setdefault(subject_year, {'total_percentage': 0, 'count': 0})
+                    totals['total_percentage'] += percentage
+                    totals['count'] += 1
+    subject_years = {subject_year for summary in summaries.values() for subject_year in summary['subjects_years']}
+    boundaries = {}
+    for entry in db.find({'subject_year': {'$in': list(subject_years)}, 'test_name': None}, {'subject_year': 1, 'grade_boundaries': 1, '_id': 0}):
+        boundaries.setdefault(entry['subject_year'], entry.get('grade_boundaries', {}))
+    for summary in summaries.values():
+        for subject_year, totals in summary['subjects_years'].items():
+            totals['average_percentage'] = round((totals['total_percentage'] / totals['count']), 1)
+            if subject_year in boundaries:
+                totals['grade'] = grade_scale(boundaries[subject_year]).grade(totals['average_percentage'])
+            else:
+                totals['grade'] = 'N/A'
+    updated = datetime.now(timezone.utc)
+    for summary in summaries.values():
+        content = json.dumps([summary['classes'], summary['tests'], summary['subjects_years']], sort_keys=True, default=str)
+        summary['version'] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        summary['updated'] = updated
+    operations = [ReplaceOne({'student_id': student_id}, summary, upsert=True) for student_id, summary in summaries.items()]
+    batch_size = config.get('bulkwritebatchsize', 1000)
+    for start in range(0, len(operations), batch_size):
+        try:
+            student_summaries().bulk_write(operations[start:start + batch_size], ordered=False)
+        except BulkWriteError as e:
+            app.logger.error("Updating student summaries failed: %s", e.details.get('writeErrors'))
+    return summaries
+
+#--Done--
+# This function returns a student's summary with a single indexed read, building it the first
+# time it is asked for (for example for data created before summaries or their versions existed).
+def get_student_summary(student_id):
+    summary = student_summaries().find_one({'student_id': student_id}, {'_id': 0})
+    if summary is None or 'version' not in summary:
+        summary = refresh_student_summaries([student_id])[student_id]
+    return summary
+
+#--Done--
+# This function rebuilds the summaries of every student in classes of the given subject and year.
+def refresh_subject_year_summaries(subject, year):
+    refresh_student_summaries(testdb().distinct('students', {'subject': subject, 'year': year}))
 
 #--Done--
 # This function handles the main index page and redirects users based on their user type.
@@ -212,21 +1379,21 @@ def mass_update_grades_for_school(school_name):
 # 1. Defines the route for the index function.
 # 2. Checks if the user is logged in and retrieves their user type from the session.
 # 3. If the user type is 'admin':
-#    - Connects to the database to retrieve subject and year data.
+#    - Connects to the database to retrieve the subject and year data of the admin's school.
 #    - Constructs a set and dictionary of subject years with available images.
-#    - Retrieves a list of students and classes.
-#    - Attempts to retrieve and remove 'existing_users' and 'caerror' from the session.
+#    - Retrieves the school's students and named classes (each query uses a school index).
+#    - Looks up the admin's CSV import job in the job records (shared by every worker); once it has finished,
+#      shows its existing users and errors and forgets the job. The job is only forgotten otherwise once its
+#      record has expired ('jobretention'), as it is then gone for every worker.
+#    - Attempts to retrieve and remove 'caerror' from the session.
 #    - Renders the 'admin.html' template with the gathered data.
 # 4. If the user type is 'teacher':
 #    - Connects to the database to retrieve a list of classes taught by the teacher.
 #    - Counts the number of students in each class.
 #    - Renders the 'teacher.html' template with the list of classes.
 # 5. If the user type is 'student':
-#    - Connects to the database to retrieve the list of classes the student is enrolled in.
-#    - Constructs a dictionary to store the student's average percentage and grade for each subject year.
-#    - Calculates the average percentage for each subject year.
-#    - Defines an inner function to assign grades based on percentage and grade boundaries.
-#    - Retrieves and assigns grades for each subject year.
+#    - Reads the student's materialised summary (get_student_summary), which already holds their
+#      classes and the average percentage and grade of each subject year.
 #    - Renders the 'student.html' template with the list of classes and subjects years data.
 # 6. If the user is not logged in, renders the 'index.html' template.
 @app.route('/')
@@ -235,8 +1402,8 @@ def index():
     if is_logged_in():
         user_type = session.get('user_type')
         if user_type == 'admin':
-            db = testdb()
-            subjects_years_cursor = db.find({}, {'subject': 1, 'year': 1})
+            school_name = session['school']
+            subjects_years_cursor = find_classes('admin_subject_years', {'school': school_name})
             subjects_year_data = {}
             subject_years = set()
             for entry in subjects_years_cursor:
@@ -244,7 +1411,6 @@ def index():
                 year = entry.get('year')
                 if subject and year:
                     subject_year = f"{subject}-Y{year}"
-                    school_name=session['school']
                     image_path = f'static/subject_years/{school_name}/{subject_year}/{subject_year}.png'
                     if os.path.exists(image_path):
                         subject_years.add(subject_year)
@@ -252,64 +1418,35 @@ def index():
                             subjects_year_data[subject] = []
                         if year not in subjects_year_data[subject]:
                             subjects_year_data[subject].append(year)
-            students = list(accounts().find({'type': 'student'}, {'username': 1, 'user_id': 1}))
-            classes = list(testdb().find({'classname': {'$ne': '', '$exists': True}}, {'classname': 1, 'year': 1, 'code': 1}))
-            try:
-                existing_users = session.get('existing_users', [])
-                session.pop('existing_users')
-            except:
-                existing_users=[]
+            students = list(accounts().find({'school': school_name, 'type': 'student'}, {'username': 1, 'user_id': 1}))
+            classes = find_classes('admin_classes', {'school': school_name, 'classname': {'$ne': '', '$exists': True}})
+            existing_users = []
+            import_job = get_job(session['import_job']) if 'import_job' in session else None
+            if import_job and import_job['status'] in ('finished', 'failed'):
+                session.pop('import_job')
+                if import_job['result']:
+                    existing_users = import_job['result']['existing_users']
+            elif 'import_job' in session and not import_job:
+                session.pop('import_job')
             try:
                 caerror=session.get('caerror', '')
                 session.pop('caerror')
             except:
                 caerror=None
-            return render_template('admin.html', subjects_year_data=subjects_year_data, subject_years=subject_years, students=students, classes=classes, existing_users=existing_users,caerror=caerror, school_name=session['school'])
+            return render_template('admin.html', subjects_year_data=subjects_year_data, subject_years=subject_years, students=students, classes=classes, existing_users=existing_users,caerror=caerror, import_job=import_job, school_name=session['school'])
         elif user_type == 'teacher':
-            db = testdb()
-            classes = list(db.find({
+            classes = find_classes('teacher_index', {
                 '$or': [
                     {'teacher': session['user_id']},
                     {'teachers': session['user_id']}
                 ]
-            }))
+            })
             for class_entry in classes:
                 class_entry['num_students'] = len(class_entry.get('students', []))
             return render_template('teacher.html', classes=classes)
         elif user_type == 'student':
-            db = testdb()
-            student_id = session['user_id']
-            classes = list(db.find({'students': student_id}))
-            subjects_years = {}
-            for class_entry in classes:
-                year = class_entry.get('year', 'N/A')
-                for test in class_entry.get('tests', []):
-                    if student_id in test['students_marks']:
-                        percentage = test['students_marks'][student_id]['percentage']
-                        subject = test['subject']
-                        subject_year = f"{subject}-Y{year}"
-                        if subject_year not in subjects_years:
-                            subjects_years[subject_year] = {'total_percentage': 0, 'count': 0}
-                        subjects_years[subject_year]['total_percentage'] += percentage
-                        subjects_years[subject_year]['count'] += 1
-            for subject_year in subjects_years:
-                subjects_years[subject_year]['average_percentage'] = round((subjects_years[subject_year]['total_percentage'] / subjects_years[subject_year]['count']), 1)
-            def assign_grade(percentage, grade_boundaries):
-                for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                    if percentage >= boundary:
-                        return grade_letter
-                return 'U'
-            for subject_year in subjects_years:
-                subject, year = subject_year.split('-Y')
-                grade_boundaries = db.find_one({'subject_year': subject_year, 'test_name': None}, {'grade_boundaries': 1, '_id': 0})
-                if grade_boundaries:
-                    grade_boundaries = grade_boundaries.get('grade_boundaries', {})
-                    average_percentage = subjects_years[subject_year]['average_percentage']
-                    grade = assign_grade(average_percentage, grade_boundaries)
-                    subjects_years[subject_year]['grade'] = grade
-                else:
-                    subjects_years[subject_year]['grade'] = 'N/A'
-            return render_template('student.html', classes=classes, subjects_years=subjects_years)
+            summary = get_student_summary(session['user_id'])
+            return render_template('student.html', classes=summary['classes'], subjects_years=summary['subjects_years'])
     return render_template('index.html')
 
 #--Done--
@@ -367,6 +1504,7 @@ def signup():
         'type': "student"
     }
     db.insert_one(user)
+    invalidate_user_type(username)
     return redirect('/')
 
 #--Done--
@@ -470,6 +1608,7 @@ def create_account():
             'type': user_type
         }
         db.insert_one(user)
+        invalidate_user_type(username)
         return redirect('/')
     return redirect('/')
 
@@ -479,67 +1618,144 @@ def create_account():
 # 1. Defines the route and method for the update_school function.
 # 2. Checks if the user is logged in and if their user type is 'admin'.
 # 3. Retrieves the school name from the session.
-# 4. Calls the mass_update_grades_for_school function to update the grades for the school.
-# 5. Redirects to the home page upon successful grade update.
+# 4. Submits mass_update_grades_for_school as a background job for the school.
+#    - A second request while the school's recompute is still queued or running returns the same job.
+# 5. Returns the job handle (ID, status and status URL) as JSON with a 202 status.
 # 6. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/update_school', methods=['POST'])
 def update_school():
     if is_logged_in() and session.get('user_type') == 'admin':
         school = session['school']
-        mass_update_grades_for_school(school)
-        return redirect('/')
+        job = submit_job('update_school', ('update_school', school), mass_update_grades_for_school, school, owner=school)
+        return jsonify(job_status_data(job)), 202
+    return redirect('/')
+
+#--Done--
+# This function reports the status and progress of a background job as JSON.
+# It verifies the user is an admin of the school that started the job and returns
+# a 404 error if the job is unknown (or its record has expired).
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if is_logged_in() and session.get('user_type') == 'admin':
+        job = get_job(job_id)
+        if not job or job['owner'] != session['school']:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job_status_data(job))
     return redirect('/')
 
+#--Done--
+# This function returns the collection of page version stamps, one document per school, subject
+# and year. A document's version is incremented whenever something shown on that subject year's
+# admin pages changes, which tells every worker that its cached copies are stale (see page_cache).
+def page_versions():
+    return collection("page_versions")
+
+#--Done--
+# This function marks the admin pages of a subject year as changed (see page_versions).
+# Without a school it marks the subject year in every school that has classes in it, for changes
+# shared by all schools such as the subject year's grade boundaries.
+def bump_page_version(school, subject, year):
+    schools = [school] if school is not None else testdb().distinct('school', {'subject': subject, 'year': year})
+    operations = [UpdateOne({'school': name, 'subject': subject, 'year': year}, {'$inc': {'version': 1}}, upsert=True) for name in schools if name is not None]
+    if operations:
+        page_versions().bulk_write(operations, ordered=False)
+
+#--Done--
+# This function returns the version stamp of a school's subject year, or of every year of the
+# subject when year is None. It only reads: a subject year without a stamp has not changed since
+# stamps were introduced and is at version 0 until its first change creates the stamp.
+def page_version(school, subject, year=None):
+    if year is None:
+        return [(entry['year'], entry['version']) for entry in page_versions().find({'school': school, 'subject': subject}, {'year': 1, 'version': 1, '_id': 0}).sort('year', ASCENDING)]
+    entry = page_versions().find_one({'school': school, 'subject': subject, 'year': year}, {'version': 1, '_id': 0})
+    return entry['version'] if entry else 0
+
+#--Done--
+# This function returns a page body from the page cache if it was built from the given version,
+# and otherwise builds it with build() and caches it. build() returns None for a page that is
+# not to be cached (such as a redirect).
+def cached_page(key, version, build):
+    key = key + (json.dumps(version),)
+    body = page_cache.get(key)
+    if body is None:
+        body = build()
+        if body is not None:
+            page_cache.set(key, body)
+    return body
+
+#--Done--
+# This function returns the statistics of a school's subject year (analytics.subject_year_statistics),
+# calculated from all of the subject year's classes in one query and cached until the subject year's
+# version stamp changes. Cached statistics that do not include class_code (a class written without
+# its stamp being bumped) are calculated again.
+def subject_year_statistics(school, subject, year, scale, class_code=None):
+    key = (school, subject, year, json.dumps(page_version(school, subject, year)), tuple(scale.thresholds.tolist()), tuple(scale.labels.tolist()))
+    statistics = statistics_cache.get(key)
+    if statistics is None or (class_code is not None and class_code not in statistics['classes']):
+        classes = load_marks(find_classes('subject_year_statistics', {'school': school, 'subject': subject, 'year': year}))
+        statistics = analytics.subject_year_statistics(classes, scale)
+        statistics_cache.set(key, statistics)
+    return statistics
+
+#--Done--
+# This function builds the JSON of the subject_details view for a school.
+# It performs the following steps:
+# 1. Connects to the database to retrieve the school's classes for the given subject.
+# 2. Initializes dictionaries to store student information and test data.
+# 3. Looks up the subject's grade boundaries once and builds a GradeScale from them.
+# 4. Iterates through each class and test to collect student marks and calculate percentages and grades (students are resolved with one bulk lookup):
+#    - Retrieves the student's mark and percentage for each test.
+#    - Initializes the grade and stores student information in the students dictionary.
+# 5. Calculates the average percentage for each student and grades all the averages in one vectorised call.
+# 6. Prepares the response data with students and tests information.
+# 7. Returns the response data as JSON bytes.
+def subject_details_json(school, subject):
+    db = testdb()
+    classes = load_marks(find_classes('subject_details', {'school': school, 'subject': subject}))
+    students = {}
+    tests = []
+    boundaries_entry = db.find_one({'subject': subject}, {'grade_boundaries': 1, '_id': 0}) or {}
+    scale = grade_scale(boundaries_entry.get('grade_boundaries', {}), default='N/A')
+    student_docs = get_students({student_id for class_entry in classes for test in class_entry.get('tests', []) if test['subject'] == subject for student_id in test['students_marks']})
+    for class_entry in classes:
+        for test in class_entry.get('tests', []):
+            if test['subject'] == subject:
+                tests.append({'test_name': test['test_name']})
+                for student_id, marks in test['students_marks'].items():
+                    if student_id not in student_docs:
+                        continue
+                    if student_id not in students:
+                        students[student_id] = {
+                            'username': student_docs[student_id]['username'],
+                            'marks': {},
+                            'average_percentage': 0,
+                            'grade': 'N/A'
+                        }
+                    students[student_id]['marks'][test['test_name']] = marks['percentage']
+    for student_id, student in students.items():
+        total_percentage = sum(student['marks'].values())
+        test_count = len(student['marks'])
+        student['average_percentage'] = total_percentage / test_count if test_count > 0 else 0
+    for student, grade in zip(students.values(), scale.grade_all([student['average_percentage'] for student in students.values()])):
+        student['grade'] = grade
+    response = {'students': list(students.values()), 'tests': tests}
+    return jsonify(response).get_data()
+
 #--Done--
 # This function handles the view for detailed subject information for admins.
 # It performs the following steps:
 # 1. Defines the route for the subject_details function.
 # 2. Checks if the user is logged in and if their user type is 'admin'.
-# 3. Connects to the database to retrieve class information for the given subject.
-# 4. Initializes dictionaries to store student information and test data.
-# 5. Defines an inner function to assign grades based on percentage and grade boundaries.
-# 6. Iterates through each class and test to collect student marks and calculate percentages and grades:
-#    - Retrieves the student's mark and percentage for each test.
-#    - Initializes the grade and stores student information in the students dictionary.
-# 7. Calculates the average percentage and grade for each student.
-# 8. Prepares the response data with students and tests information.
-# 9. Returns the response data as JSON.
-# 10. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 3. Reads the version stamps of the subject's years in the admin's school (page_version).
+# 4. Returns the cached JSON if it was built from those versions, and otherwise builds it with
+#    subject_details_json and caches it.
+# 5. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/subject_details/<subject>')
 def subject_details(subject):
     if is_logged_in() and session.get('user_type') == 'admin':
-        db = testdb()
-        classes = list(db.find({'subject': subject}))
-        students = {}
-        tests = []
-        def assign_grade(percentage, subject):
-            db = testdb()
-            grade_boundaries = db.find_one({'subject': subject}, {'grade_boundaries': 1, '_id': 0}).get('grade_boundaries', {})
-            for grade_letter, boundary in grade_boundaries.items():
-                if percentage >= boundary:
-                    return grade_letter
-            return 'N/A'
-        for class_entry in classes:
-            for test in class_entry.get('tests', []):
-                if test['subject'] == subject:
-                    tests.append({'test_name': test['test_name']})
-                    for student_id, marks in test['students_marks'].items():
-                        if student_id not in students:
-                            student_doc = accounts().find_one({'user_id': student_id}, {'username': 1, 'user_id': 1})
-                            students[student_id] = {
-                                'username': student_doc['username'],
-                                'marks': {},
-                                'average_percentage': 0,
-                                'grade': 'N/A'
-                            }
-                        students[student_id]['marks'][test['test_name']] = marks['percentage']
-        for student_id, student in students.items():
-            total_percentage = sum(student['marks'].values())
-            test_count = len(student['marks'])
-            student['average_percentage'] = total_percentage / test_count if test_count > 0 else 0
-            student['grade'] = assign_grade(student['average_percentage'], subject)
-        response = {'students': list(students.values()), 'tests': tests}
-        return jsonify(response)
+        school = session['school']
+        body = cached_page(('subject_details', school, subject, None), page_version(school, subject), lambda: subject_details_json(school, subject))
+        return app.response_class(body, mimetype='application/json')
     return redirect('/')
 
 #--done--
@@ -547,37 +1763,26 @@ def subject_details(subject):
 # It performs the following steps:
 # 1. Defines the route for the admin_student_performance function.
 # 2. Checks if the user is logged in and if their user type is 'admin'.
-# 3. Defines a dictionary for grade conversion from letter grades to numerical values for under Year 11 students.
-# 4. Connects to the databases to retrieve student and class information.
-# 5. Retrieves the student's basic information using the student_id.
-# 6. Retrieves the list of classes the student is enrolled in.
-# 7. Initializes lists and variables to store student marks, total percentage, and test count.
-# 8. Iterates through each class and test to collect student marks and calculate percentages and grades:
+# 3. Connects to the databases to retrieve student and class information.
+# 4. Retrieves the student's basic information using the student_id.
+# 5. Retrieves the list of classes the student is enrolled in.
+# 6. Initializes lists and variables to store student marks, total percentage, and test count.
+# 7. Iterates through each class and test to collect student marks and calculate percentages and grades:
 #    - Retrieves the student's mark and percentage for each test.
 #    - Initializes the grade and image path.
 #    - If the test has a percentage, processes the grade and image path based on the grading type.
 #    - Assigns grades based on the grade boundaries if they exist.
 #    - Converts grades to numerical values for under Year 11 students.
 #    - Updates the student's marks and the total percentage and test count.
-# 9. Calculates the student's average percentage across all tests.
-# 10. Renders the 'admin_student_performance.html' template with the student data, marks, average percentage, and class entry.
-# 11. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 8. Calculates the student's average percentage across all tests.
+# 9. Renders the 'admin_student_performance.html' template with the student data, marks, average percentage, and class entry.
+# 10. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/admin_student_performance/<student_id>')
 def admin_student_performance(student_id):
     if is_logged_in() and session.get('user_type') == 'admin':
-        GRADE_CONVERSION = {
-        "A*": 9,
-        "A": 8,
-        "B": 7,
-        "C": 6,
-        "D": 5,
-        "E": 4,
-        "U": "U"
-    }
-        db = testdb()
         accounts_db = accounts()
         student = accounts_db.find_one({'user_id': student_id}, {'username': 1, 'email': 1, 'user_id': 1})
-        classes = list(db.find({'students': student_id}))
+        classes = load_marks(find_classes('admin_student_performance', {'students': student_id}, student_id), [student_id])
         student_marks = []
         total_percentage = 0
         test_count = 0
@@ -596,15 +1801,11 @@ def admin_student_performance(student_id):
                         image_path = f'/static/subject_years/{school_name}/{class_entry["subject"]}-Y{class_entry["year"]}/{test["test_name"]}.png'
                     else:
                         grade_boundaries = test.get('grade_boundaries', {})
+                    numeric = uses_numeric_grades(class_entry['year'])
                     if grade_boundaries:
-                        for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                            if percentage >= boundary:
-                                grade = grade_letter
-                                break   
-                    if int(class_entry['year']) <= 11 and grade in GRADE_CONVERSION:
-                            grade = GRADE_CONVERSION[grade]
-                    if int(class_entry['year']) <= 11:
-                        grade_boundaries = {GRADE_CONVERSION[grade]: boundary for grade, boundary in grade_boundaries.items()}     
+                        grade = grade_scale(grade_boundaries, default='N/A', numeric=numeric).grade(percentage)
+                    if numeric:
+                        grade_boundaries = convert_boundaries(grade_boundaries)
                     student_marks.append({
                         'subject': test['subject'],
                         'test_name': test['test_name'],
@@ -621,113 +1822,168 @@ def admin_student_performance(student_id):
         return render_template('admin_student_performance.html', student=student, student_marks=student_marks, average_percentage=average_percentage)
     return redirect('/')
 
+#--done--
+# This function builds the admin_subject_year_details page of a school's subject year.
+# It performs the following steps:
+# 1. Connects to the database to retrieve grade boundaries and class information.
+# 2. Retrieves the grade boundaries entry for the subject and year combination.
+# 3. If grade boundaries are found:
+#    - Builds a GradeScale from the grade boundaries.
+#    - Retrieves the list of the school's classes for the subject and year.
+#    - Initializes dictionaries to store student information and test data.
+#    - Iterates through each class and test to collect student marks, resolving all students with one bulk lookup.
+#    - Calculates the average percentage for each student and grades all averages in one vectorised call.
+#    - Calculates the average percentage for each test and grades all test averages in one vectorised call.
+#    - Prepares the response data with subject, year, students, and tests information.
+#    - Renders the 'admin_subject_year_details.html' template with the response data and returns it as bytes.
+# 4. Returns None if the subject year has no grade boundaries.
+def admin_subject_year_page(school, subject, year):
+    db = testdb()
+    subject_year = f"{subject}-Y{year}"
+    grade_boundaries_entry = db.find_one({'subject_year': subject_year, 'test_name': None}, {'grade_boundaries': 1, '_id': 0})
+    if grade_boundaries_entry:
+        scale = grade_scale(grade_boundaries_entry['grade_boundaries'])
+        classes = load_marks(find_classes('admin_subject_year_details', {'school': school, 'subject': subject, 'year': year}))
+        students = {}
+        tests = []
+        student_docs = get_students({student_id for class_entry in classes for test in class_entry.get('tests', []) if test['subject'] == subject for student_id in test.get('students_marks', {})})
+        for class_entry in classes:
+            for test in class_entry.get('tests', []):
+                if test['subject'] == subject:
+                    tests.append({
+                        'test_name': test['test_name'],
+                        'average_percentage': 0,
+                        'grade': 'N/A'
+                    })
+                    for student_id, marks in test.get('students_marks', {}).items():
+                        if student_id not in student_docs:
+                            continue
+                        if student_id not in students:
+                            students[student_id] = {
+                                'username': student_docs[student_id]['username'],
+                                'marks': {},
+                                'average_percentage': 0,
+                                'grade': 'N/A'
+                            }
+                        students[student_id]['marks'][test['test_name']] = marks['percentage']
+        for student_id, student_data in students.items():
+            total_percentage = sum(student_data['marks'].values())
+            test_count = len(student_data['marks'])
+            student_data['average_percentage'] = round((total_percentage / test_count), 1) if test_count > 0 else 0
+        for student_data, grade in zip(students.values(), scale.grade_all([student_data['average_percentage'] for student_data in students.values()])):
+            student_data['grade'] = grade
+        graded_tests = []
+        for test in tests:
+            test_name = test['test_name']
+            test_scores = [student_data['marks'][test_name] for student_data in students.values() if test_name in student_data['marks']]
+            if test_scores:
+                test['average_percentage'] = sum(test_scores) / len(test_scores)
+                graded_tests.append(test)
+        for test, grade in zip(graded_tests, scale.grade_all([test['average_percentage'] for test in graded_tests])):
+            test['grade'] = grade
+        response = {'subject': subject, 'year': year, 'students': list(students.values()), 'tests': tests}
+        return render_template('admin_subject_year_details.html', data=response).encode('utf-8')
+    return None
+
 #--done--
 # This function handles the view for detailed subject and year information for admins.
 # It performs the following steps:
 # 1. Defines the route for the admin_subject_year_details function.
 # 2. Checks if the user is logged in and if their user type is 'admin'.
-# 3. Connects to the database to retrieve grade boundaries and class information.
-# 4. Converts the year to a string and constructs a subject_year string.
-# 5. Retrieves the grade boundaries entry for the subject and year combination.
-# 6. Defines an inner function to assign grades based on percentage and grade boundaries.
-# 7. If grade boundaries are found:
-#    - Retrieves the list of classes for the subject and year.
-#    - Initializes dictionaries to store student information and test data.
-#    - Iterates through each class and test to collect student marks.
-#    - Calculates the average percentage and grade for each student.
-#    - Calculates the average percentage and grade for each test.
-#    - Prepares the response data with subject, year, students, and tests information.
-#    - Renders the 'admin_subject_year_details.html' template with the response data.
-# 8. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 3. Converts the year to a string and reads the subject year's version stamp in the admin's school (page_version).
+# 4. Returns the cached page if it was built from that version, and otherwise builds it with
+#    admin_subject_year_page and caches it.
+# 5. Redirects to the home page if the subject year has no grade boundaries, or if the user is not
+#    logged in or does not have the correct user type.
 @app.route('/admin_subject_year_details/<subject>/<year>')
 def admin_subject_year_details(subject, year):
     if is_logged_in() and session.get('user_type') == 'admin':
-        db = testdb()
+        school = session['school']
         year = str(year)
-        subject_year = f"{subject}-Y{year}"
-        grade_boundaries_entry = db.find_one({'subject_year': subject_year, 'test_name': None})
-        def assign_grade(percentage, grade_boundaries):
-            for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                if percentage >= boundary:
-                    return grade_letter
-            return 'U'
-        if grade_boundaries_entry:
-            grade_boundaries = grade_boundaries_entry['grade_boundaries']
-            classes = list(db.find({'subject': subject, 'year': year}))
-            students = {}
-            tests = []
-            for class_entry in classes:
-                for test in class_entry.get('tests', []):
-                    if test['subject'] == subject:
-                        tests.append({
-                            'test_name': test['test_name'],
-                            'average_percentage': 0,
-                            'grade': 'N/A'
-                        })
-                        for student_id, marks in test.get('students_marks', {}).items():
-                            if student_id not in students:
-                                student_doc = accounts().find_one({'user_id': student_id}, {'username': 1, 'user_id': 1})
-                                if student_doc:
-                                    students[student_id] = {
-                                        'username': student_doc['username'],
-                                        'marks': {},
-                                        'average_percentage': 0,
-                                        'grade': 'N/A'
-                                    }
-                            students[student_id]['marks'][test['test_name']] = marks['percentage']
-            for student_id, student_data in students.items():
-                total_percentage = sum(student_data['marks'].values())
-                test_count = len(student_data['marks'])
-                student_data['average_percentage'] = round((total_percentage / test_count), 1) if test_count > 0 else 0
-                student_data['grade'] = assign_grade(student_data['average_percentage'], grade_boundaries)
-            for test in tests:
-                test_name = test['test_name']
-                test_scores = [student_data['marks'][test_name] for student_data in students.values() if test_name in student_data['marks']]
-                if test_scores:
-                    test['average_percentage'] = sum(test_scores) / len(test_scores)
-                    test['grade'] = assign_grade(test['average_percentage'], grade_boundaries)
-            response = {'subject': subject, 'year': year, 'students': list(students.values()), 'tests': tests}
-            return render_template('admin_subject_year_details.html', data=response)
+        body = cached_page(('admin_subject_year_details', school, subject, year), page_version(school, subject, year), lambda: admin_subject_year_page(school, subject, year))
+        if body is not None:
+            return Response(body, mimetype='text/html')
     return redirect('/')
 
+#--Done--
+# These values set the characters and length of class codes.
+CLASS_CODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+CLASS_CODE_LENGTH = 5
+CLASS_CODE_ATTEMPTS = 10
+
+#--Done--
+# This function generates random class codes from the operating system's CSPRNG.
+# It draws all the random bytes for the requested codes with one os.urandom call and maps each
+# byte to a character, rejecting bytes at or above the largest multiple of the alphabet size
+# so every character is equally likely.
+def random_class_codes(count):
+    limit = 256 - 256 % len(CLASS_CODE_ALPHABET)
+    characters = []
+    needed = count * CLASS_CODE_LENGTH
+    while len(characters) < needed:
+        characters.extend(CLASS_CODE_ALPHABET[byte % len(CLASS_CODE_ALPHABET)] for byte in os.urandom(needed + needed // 4) if byte < limit)
+    return [''.join(characters[i:i + CLASS_CODE_LENGTH]) for i in range(0, needed, CLASS_CODE_LENGTH)]
+
+#--Done--
+# This function returns the next candidate class code.
+# With 'classcodeblock' above 0, each worker generates that many codes at once and hands them out
+# in turn; otherwise a code is generated per call. Candidates are not reserved: the unique
+# (school, code) index decides whether one is free when the class is inserted.
+_class_code_block = []
+_class_code_lock = threading.Lock()
+def next_class_code():
+    block_size = config.get('classcodeblock', 0)
+    if not block_size:
+        return random_class_codes(1)[0]
+    with _class_code_lock:
+        if not _class_code_block:
+            _class_code_block.extend(random_class_codes(block_size))
+        return _class_code_block.pop()
+
+#--Done--
+# This function inserts a new class with a class code that is unique within its school.
+# It performs the following steps:
+# 1. Gives the class the next candidate code and inserts it, which is a single round trip when
+#    the code is free.
+# 2. If the unique (school, code) index rejects the insert, retries with a new code, up to
+#    CLASS_CODE_ATTEMPTS times, so concurrent creators can never end up sharing a code.
+# 3. Returns the code the class was inserted with.
+def insert_class(class_entry):
+    for _ in range(CLASS_CODE_ATTEMPTS):
+        class_entry['code'] = next_class_code()
+        try:
+            testdb().insert_one(class_entry)
+            return class_entry['code']
+        except DuplicateKeyError:
+            class_entry.pop('_id', None)
+    raise RuntimeError(f"No free class code found for {class_entry.get('school')} after {CLASS_CODE_ATTEMPTS} attempts")
+
 # This function handles the creation of a new class.
 # It performs the following steps:
 # 1. Defines the route and method for the create_class function.
 # 2. Checks if the user is logged in and if their user type is 'teacher'.
-# 3. Defines an inner function to generate a unique class code for the school:
-#    - Connects to the database and generates a random 5-character code.
-#    - Ensures the generated code is unique for the school by checking the database.
-# 4. Retrieves the classname, year, school, and subject from the submitted form data.
-# 5. Generates a unique class code using the inner function.
-# 6. Creates a class entry dictionary with the class details and teacher's user ID.
-# 7. Inserts the class entry into the database.
-# 8. Redirects to the home page upon successful class creation.
-# 9. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 3. Retrieves the classname, year, school, and subject from the submitted form data.
+# 4. Creates a class entry dictionary with the class details and teacher's user ID.
+# 5. Inserts the class entry into the database with a unique class code (insert_class).
+# 6. Marks the subject year's pages as changed (bump_page_version), since the class is now one of its classes.
+# 7. Redirects to the home page upon successful class creation.
+# 8. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/create_class', methods=['POST'])
 def create_class():
     if is_logged_in() and session.get('user_type') == 'teacher':
-        def generate_unique_code(school):
-            db = testdb()
-            while True:
-                code = ''.join(np.random.choice(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'), size=5))
-                if not db.find_one({'school': school, 'code': code}):
-                    break
-            return code
         classname = request.form['classname']
         year = request.form['year']
         school = session['school']
         subject = request.form['subject']
-        class_code = generate_unique_code(school)
         class_entry = {
             'classname': classname,
             'year': year,
             'subject': subject,
-            'code': class_code,
             'school': school,
             'teacher': session['user_id']
         }
-        db = testdb()
-        db.insert_one(class_entry)
+        insert_class(class_entry)
+        bump_page_version(school, subject, year)
         return redirect('/')  
     return redirect('/')
 
@@ -736,18 +1992,18 @@ def create_class():
 # 1. Defines the route and method for the join_class function.
 # 2. Retrieves the class code from the submitted form data.
 # 3. Checks if the class code is provided; if not, returns a 400 error.
-# 4. Connects to the database to retrieve the class entry based on the class code.
+# 4. Looks up the class by code, fetching only its _id, school, subject and year.
 # 5. Extracts the user_id and user_type from the session.
 # 6. If the class entry is found, processes the join request based on the user type:
 #    - If the user is a teacher:
-#      - Adds the teacher to the class entry if not already present.
-#      - Updates the class entry in the database.
-#      - Adds the class to the teacher's entry if not already present.
-#      - Updates the teacher's entry in the database.
+#      - Adds the teacher to the class's teachers with a single atomic $addToSet.
+#      - Adds the class to the teacher's account classes with a single atomic $addToSet.
 #      - Redirects to the view_class page with the class code.
 #    - If the user is a student:
-#      - Adds the student to the class entry if not already present.
-#      - Updates the class entry in the database.
+#      - Adds the student to the class's students with a single atomic $addToSet, so concurrent
+#        joins never overwrite each other.
+#      - Rebuilds the student's summary and marks the class's subject year pages as changed
+#        (bump_page_version) if they were not in the class already.
 #      - Redirects to the class_tests page with the class code.
 # 7. Returns an error message if the class is not found.
 @app.route('/join_class', methods=['POST'])
@@ -756,30 +2012,19 @@ def join_class():
     if not class_code:
         return "Class code is required", 400
     db = testdb()
-    class_entry = db.find_one({'code': class_code})
+    class_entry = find_class('join_class', class_code)
     user_id = session['user_id']
     user_type = session.get('user_type')
     if class_entry:
         if user_type == 'teacher':
-            if 'teachers' not in class_entry:
-                class_entry['teachers'] = []
-            if user_id not in class_entry['teachers']:
-                class_entry['teachers'].append(user_id)
-                db.update_one({'code': class_code}, {'$set': {'teachers': class_entry['teachers']}})
-            accounts_db = accounts()
-            teacher_entry = accounts_db.find_one({'user_id': user_id})
-            if 'classes' not in teacher_entry:
-                teacher_entry['classes'] = []
-            if class_code not in teacher_entry['classes']:
-                teacher_entry['classes'].append(class_code)
-                accounts_db.update_one({'user_id': user_id}, {'$set': {'classes': teacher_entry['classes']}})
+            db.update_one({'_id': class_entry['_id']}, {'$addToSet': {'teachers': user_id}})
+            accounts().update_one({'user_id': user_id}, {'$addToSet': {'classes': class_code}})
             return redirect(url_for('view_class', class_code=class_code))
         elif user_type == 'student':
-            if 'students' not in class_entry:
-                class_entry['students'] = []
-            if user_id not in class_entry['students']:
-                class_entry['students'].append(user_id)
-                db.update_one({'code': class_code}, {'$set': {'students': class_entry['students']}})
+            result = db.update_one({'_id': class_entry['_id']}, {'$addToSet': {'students': user_id}})
+            if result.modified_count:
+                refresh_student_summaries([user_id])
+                bump_page_version(class_entry.get('school'), class_entry.get('subject'), class_entry.get('year'))
             return redirect(url_for('class_tests', class_code=class_code))
     return "Class not found", 404
 
@@ -790,7 +2035,7 @@ def join_class():
 # 3. Connects to the databases to retrieve class and student information.
 # 4. Retrieves the class entry based on the class code.
 # 5. If the class entry is found, retrieves the list of students in the class.
-# 6. Iterates through the list of students and retrieves their information from the database.
+# 6. Resolves every student in the class with a single bulk lookup (get_students).
 # 7. Stores the student information in a list.
 # 8. Counts the number of students and adds this information to the class entry.
 # 9. Renders the 'view_class.html' template with the class entry and student data.
@@ -799,13 +2044,12 @@ def join_class():
 @app.route('/view_class/<class_code>')
 def view_class(class_code):
     if is_logged_in() and session.get('user_type') == 'teacher':
-        db = testdb()
-        accounts_db = accounts() 
-        class_entry = db.find_one({'code': class_code})
+        class_entry = find_class('view_class', class_code)
         if class_entry:
             students = []
+            student_docs = get_students(class_entry.get('students', []))
             for student_id in class_entry.get('students', []):
-                student = accounts_db.find_one({'user_id': student_id})
+                student = student_docs.get(student_id)
                 if student:
                     students.append({
                         'username': student.get('username'),
@@ -830,8 +2074,10 @@ def view_class(class_code):
 # 8. Retrieves the subject from the class entry.
 # 9. Updates the class entry in the database to add the new test information:
 #    - Includes subject, test name, test type, maximum mark, grading type, grade boundaries, and an empty dictionary for student marks.
-# 10. Redirects to the view_class page with the class code.
-# 11. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 10. Sets the subject year's grade boundaries to the new test's boundaries, if it has any (ensure_grade_boundaries).
+# 11. Marks the class's subject year pages as changed (bump_page_version).
+# 12. Redirects to the view_class page with the class code.
+# 13. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/add_test', methods=['POST'])
 def add_test():
     if is_logged_in() and session.get('user_type') == 'teacher':
@@ -852,26 +2098,29 @@ def add_test():
                 'U': 0
             }
         db = testdb()
-        class_entry = db.find_one({'code': class_code})
+        class_entry = find_class('add_test', class_code)
         if not class_entry:
             return "Class not found", 404
         subject = class_entry['subject']
+        test_entry = {
+            'subject': subject,
+            'test_name': test_name,
+            'test_type':test_type,
+            'max_mark': max_mark,
+            'grading_type': grading_type,
+            'grade_boundaries': grade_boundaries,
+            'students_marks': {}
+        }
         db.update_one(
             {'code': class_code},
             {
                 '$push': {
-                    'tests': {
-                        'subject': subject,
-                        'test_name': test_name,
-                        'test_type':test_type,
-                        'max_mark': max_mark,
-                        'grading_type': grading_type,
-                        'grade_boundaries': grade_boundaries,
-                        'students_marks': {}
-                    }
+                    'tests': test_entry
                 }
             }
         )
+        ensure_grade_boundaries(db, subject, class_entry.get('year'), [test_entry])
+        bump_page_version(class_entry.get('school'), subject, class_entry.get('year'))
         return redirect(url_for('view_class', class_code=class_code))
     return redirect('/')
 
@@ -882,7 +2131,7 @@ def add_test():
 # 3. Connects to the databases to retrieve class and student information.
 # 4. Retrieves the class entry based on the class code.
 # 5. If the class entry is found, retrieves the list of students in the class.
-# 6. Iterates through the list of students and retrieves their information from the database.
+# 6. Resolves every student in the class with a single bulk lookup (get_students).
 # 7. Stores the student information in a list.
 # 8. Retrieves the test entry based on the test name.
 # 9. If the test entry is not found, returns a 404 error.
@@ -892,20 +2141,20 @@ def add_test():
 @app.route('/add_marks/<class_code>?=<test_name>')
 def add_marks(class_code, test_name):
     if is_logged_in() and session.get('user_type') == 'teacher':
-        db = testdb()
-        accounts_db = accounts()
-        class_entry = db.find_one({'code': class_code})
+        class_entry = find_class('add_marks', class_code, test_name=test_name)
         if class_entry:
+            load_marks([class_entry])
             students = []
+            student_docs = get_students(class_entry.get('students', []))
             for student_id in class_entry.get('students', []):
-                student = accounts_db.find_one({'user_id': student_id})
+                student = student_docs.get(student_id)
                 if student:
                     students.append({
                         'user_id': student.get('user_id'),
                         'username': student.get('username'),
                         'email': student.get('email')
                     })
-            test_entry = next((test for test in class_entry['tests'] if test['test_name'] == test_name), None)
+            test_entry = next((test for test in class_entry.get('tests', []) if test['test_name'] == test_name), None)
             if not test_entry:
                 return "Test not found", 404
             return render_template('add_marks.html', class_entry=class_entry, students=students, test_entry=test_entry)
@@ -927,19 +2176,27 @@ def add_marks(class_code, test_name):
 #    - Updates the test entry with the student's mark and percentage.
 #    - Stores the student's percentage in the scores and averages lists.
 # 9. If the grading type is 'curve' and there are student scores, calculates average scores and grade boundaries.
-# 10. Updates the database with the modified student marks in the test entry.
-# 11. Redirects to the view_class page with the class code.
-# 12. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 10. Updates the database with the modified student marks in the test entry, or, when marks are
+#     kept in the marks collection, upserts only the marks that changed (save_marks).
+# 11. For a curve test, whose boundaries were just recalculated, brings the subject year's grade
+#     boundaries in line with the class's tests (ensure_grade_boundaries).
+# 12. Applies the marks that changed to the subject year's running aggregates (apply_mark_changes),
+#     which regrades the students whose average moved, or every student if the boundaries moved.
+# 13. Marks the class's subject year pages as changed (bump_page_version).
+# 14. Rebuilds the summaries of the students in the class (refresh_student_summaries).
+# 15. Redirects to the view_class page with the class code.
+# 16. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/submit_marks', methods=['POST'])
 def submit_marks():
     if is_logged_in() and session.get('user_type') == 'teacher':
         class_code = request.form['class_code']
         test_name = request.form['test_name']
         marks = request.form.to_dict(flat=False)
-        print(marks)
+        app.logger.debug("Marks submitted for %s %s: %s", class_code, test_name, marks)
         db = testdb()
-        class_entry = db.find_one({'code': class_code})
-        test_entry = next((test for test in class_entry['tests'] if test['test_name'] == test_name), None)
+        class_entry = find_class('submit_marks', class_code, test_name=test_name)
+        load_marks([class_entry])
+        test_entry = next((test for test in class_entry.get('tests', []) if test['test_name'] == test_name), None)
         if not test_entry:
             return "Test not found", 404
         grading_type = test_entry.get('grading_type', 'boundaries') 
@@ -947,6 +2204,8 @@ def submit_marks():
         student_scores = []
         student_averages = {}
         year = class_entry.get('year', 'N/A')
+        old_marks = dict(test_entry['students_marks'])
+        old_percentages = {student_id: entry['percentage'] for student_id, entry in old_marks.items()}
         for student_id, mark in marks.items():
             if student_id.startswith('marks['):
                 student_id = student_id[6:-1]
@@ -959,10 +2218,19 @@ def submit_marks():
         if grading_type == 'curve' and student_scores:
             subject = class_entry['subject']
             calculate_boundaries_and_graph(student_scores, subject, year, student_averages, session['school'], test_name=test_name)
-        db.update_one(
-            {'code': class_code, 'tests.test_name': test_name},
-            {'$set': {'tests.$.students_marks': test_entry['students_marks']}}
-        )
+        if marks_in_collection():
+            save_marks(class_entry, test_entry, {student_id: entry for student_id, entry in test_entry['students_marks'].items() if old_marks.get(student_id) != entry})
+        else:
+            db.update_one(
+                {'code': class_code, 'tests.test_name': test_name},
+                {'$set': {'tests.$.students_marks': test_entry['students_marks']}}
+            )
+        if grading_type == 'curve' and student_scores:
+            ensure_grade_boundaries(db, class_entry['subject'], year, find_class('ensure_grade_boundaries', class_code)['tests'])
+        changes = [(student_id, old_percentages.get(student_id), percentage) for student_id, percentage in student_averages.items() if old_percentages.get(student_id) != percentage]
+        apply_mark_changes(class_entry['school'], test_entry['subject'], year, changes)
+        bump_page_version(class_entry['school'], class_entry['subject'], class_entry.get('year'))
+        refresh_student_summaries(set(class_entry.get('students', [])) | set(test_entry['students_marks']))
         return redirect(url_for('view_class', class_code=class_code))
     return redirect('/')
 
@@ -979,44 +2247,34 @@ def select_test(class_code):
 
 # This function retrieves and processes performance data for a specific student in a given class.
 # It performs the following steps:
-# 1. Defines a dictionary for grade conversion from letter grades to numerical values for under Year 11 students.
-# 2. Checks if the user is logged in and if their user type is 'teacher'.
-# 3. Connects to the databases to retrieve class and student information.
-# 4. Retrieves the class entry based on the class code.
-# 5. If the class entry is found, retrieves the student's account information using the student_id.
-# 6. If the student is found, processes their test marks:
+# 1. Checks if the user is logged in and if their user type is 'teacher'.
+# 2. Connects to the databases to retrieve class and student information.
+# 3. Retrieves the class entry based on the class code.
+# 4. If the class entry is found, retrieves the student's account information using the student_id.
+# 5. If the student is found, processes their test marks:
 #    - Iterates through each test in the class entry.
 #    - Retrieves the student's mark and percentage for the test, initializing grade and image path.
 #    - If the test has a percentage, processes the grade and image path based on the grading type.
 #    - Assigns grades based on the grade boundaries if they exist.
 #    - Converts grades to numerical values for under Year 11 students.
-# 7. Appends the test information to the student's marks list.
-# 8. Calculates the student's average percentage across all tests.
-# 9. Renders the 'student_performance.html' template with the student data, marks, average percentage, and class entry.
-# 10. Returns an error message if the class or student is not found.
-# 11. Redirects to the home page if the user is not logged in or does not have the correct user type.s
+# 6. Appends the test information to the student's marks list.
+# 7. Calculates the student's average percentage across all tests.
+# 8. Renders the 'student_performance.html' template with the student data, marks, average percentage, and class entry.
+# 9. Returns an error message if the class or student is not found.
+# 10. Redirects to the home page if the user is not logged in or does not have the correct user type.s
 @app.route('/student_performance/<class_code>/<student_id>')
 def student_performance(class_code, student_id):
-    GRADE_CONVERSION = {
-        "A*": 9,
-        "A": 8,
-        "B": 7,
-        "C": 6,
-        "D": 5,
-        "E": 4,
-        "U": "U"
-    }
-
     if is_logged_in() and session.get('user_type') == 'teacher':
-        db = testdb()
         accounts_db = accounts()
-        class_entry = db.find_one({'code': class_code})
+        class_entry = find_class('student_performance', class_code, student_id=student_id)
         if class_entry:
             student = accounts_db.find_one({'user_id': student_id})
             if student:
+                load_marks([class_entry], [student_id])
                 student_marks = []
                 total_percentage = 0
-                test_count = 0      
+                test_count = 0
+                numeric = uses_numeric_grades(class_entry['year'])
                 for test in class_entry.get('tests', []):
                     mark_entry = test['students_marks'].get(student_id, {'mark': 'X', 'percentage': 0})
                     percentage = round(mark_entry['percentage'], 2) if mark_entry['mark'] != 'X' else 'X'
@@ -1031,15 +2289,9 @@ def student_performance(class_code, student_id):
                         else:
                             grade_boundaries = test.get('grade_boundaries', {})
                         if grade_boundaries:
-                            for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                                if percentage >= boundary:
-                                    grade = grade_letter
-                                    break
-                        
-                        if int(class_entry['year']) <= 11 and grade in GRADE_CONVERSION:
-                            grade = GRADE_CONVERSION[grade]
-                    if int(class_entry['year']) <= 11:
-                        grade_boundaries = {GRADE_CONVERSION[grade]: boundary for grade, boundary in grade_boundaries.items()}
+                            grade = grade_scale(grade_boundaries, default='N/A', numeric=numeric).grade(percentage)
+                    if numeric:
+                        grade_boundaries = convert_boundaries(grade_boundaries)
                     student_marks.append({
                         'test_name': test['test_name'],
                         'test_type': test['grading_type'].title(),
@@ -1083,10 +2335,10 @@ def student_performance(class_code, student_id):
 @app.route('/class_tests/<class_code>')
 def class_tests(class_code):
     if is_logged_in() and session.get('user_type') == 'student':
-        db = testdb()
-        class_entry = db.find_one({'code': class_code})
         student_id = session['user_id']
+        class_entry = find_class('class_tests', class_code, student_id=student_id)
         if class_entry and 'students' in class_entry and student_id in class_entry['students']:
+            load_marks([class_entry], [student_id])
             tests = []
             year = class_entry.get('year', 'N/A')
             subject = class_entry.get('subject', 'N/A')
@@ -1105,10 +2357,7 @@ def class_tests(class_code):
                         if grade_boundaries_entry:
                             grade_boundaries = grade_boundaries_entry
                     if grade_boundaries:
-                        for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                            if percentage >= boundary:
-                                grade = grade_letter
-                                break   
+                        grade = grade_scale(grade_boundaries, default='N/A').grade(percentage)
                 tests.append({
                     'subject': test['subject'],
                     'test_name': test['test_name'],
@@ -1142,10 +2391,7 @@ def update_student_grades_and_averages(student_id, class_entry):
             subject = test['subject']
             grade = 'N/A'
             if test['grading_type'] == 'boundaries':
-                for grade_letter, boundary in test['grade_boundaries'].items():
-                    if percentage >= boundary:
-                        grade = grade_letter
-                        break
+                grade = grade_scale(test['grade_boundaries'], default='N/A').grade(percentage)
             db.update_one(
                 {'_id': student_id, 'subjects.subject': subject},
                 {'$set': {'subjects.$.average_percentage': percentage, 'subjects.$.grade': grade}},
@@ -1155,66 +2401,81 @@ def update_student_grades_and_averages(student_id, class_entry):
 # This function retrieves and processes test data for a specific subject and year for a student.
 # It performs the following steps:
 # 1. Checks if the user is logged in and if their user type is 'student'.
-# 2. Connects to the database to retrieve class information based on the subject and year.
-# 3. Extracts the student_id from the session.
-# 4. Splits the subject_year string to get the subject and year.
-# 5. Retrieves the classes that the student is part of for the given subject and year.
-# 6. Initializes a list to store test information and variables for total percentage and test count.
-# 7. Iterates through each class entry and its tests to find the student's test scores.
-#    - If the test matches the subject and includes the student's marks, it adds the test information to the list.
+# 2. Splits the subject_year string to get the subject and year.
+# 3. Reads the student's materialised summary (get_student_summary).
+# 4. Initializes a list to store test information and variables for total percentage and test count.
+# 5. Iterates through the summary's tests to find the student's scores in classes of the subject and year.
+#    - If the test matches the subject, it adds the test information to the list.
 #    - Accumulates the total percentage and increments the test count.
-# 8. Calculates the average percentage of the student's test scores.
-# 9. Constructs the image path for the subject year.
-# 10. Renders the 'subject_tests.html' template with the test data, average percentage, and image path.
-# 11. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 6. Calculates the average percentage of the student's test scores.
+# 7. Constructs the image path for the subject year.
+# 8. Renders the 'subject_tests.html' template with the test data, average percentage, and image path.
+# 9. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/subject_tests/<subject_year>')
 def subject_tests(subject_year):
     if is_logged_in() and session.get('user_type') == 'student':
-        db = testdb()
-        student_id = session['user_id']
         subject, year = subject_year.split('-Y')
-        classes = list(db.find({'students': student_id, 'subject': subject, 'year': year}))
+        summary = get_student_summary(session['user_id'])
         tests = []
         total_percentage = 0
         test_count = 0
-        for class_entry in classes:
-            for test in class_entry.get('tests', []):
-                if test['subject'] == subject and student_id in test['students_marks']:
-                    percentage = test['students_marks'][student_id]['percentage']
-                    total_percentage += percentage
-                    test_count += 1
-                    test_info = {
-                        'test_name': test['test_name'],
-                        'percentage': percentage
-                    }
-                    tests.append(test_info)
+        for test in summary['tests']:
+            if test['class_subject'] == subject and test['year'] == year and test['subject'] == subject:
+                total_percentage += test['percentage']
+                test_count += 1
+                test_info = {
+                    'test_name': test['test_name'],
+                    'percentage': test['percentage']
+                }
+                tests.append(test_info)
         average_percentage = round(total_percentage / test_count, 2) if test_count > 0 else 0
         school_name=session['school']
         image_path = f'/static/subject_years/{school_name}/{subject_year}/{subject_year}.png' 
         return render_template('subject_tests.html', subject_year=subject_year, tests=tests, average_percentage=average_percentage, image_path=image_path)
     return redirect('/')
 
-# This function ensures that grade boundaries for a given class are updated in the database.
+# This function ensures that the subject year's grade boundaries match a class's tests.
+# It is called where tests' boundaries are written (add_test, and submit_marks for curve tests) and by
+# the reconcile-boundaries command, so pages only ever read the boundaries.
 # It performs the following steps:
-# 1. Constructs a subject_year string from the class's subject and year.
-# 2. Retrieves the list of tests from the class entry.
-# 3. Iterates through each test entry in the list.
-# 4. Checks if grade boundaries exist for the test.
-# 5. If grade boundaries are found, updates the grade boundaries in the database.
+# 1. Constructs a subject_year string from the subject and year.
+# 2. Finds the last of the given tests that has grade boundaries (the one that decided the subject
+#    year's boundaries when every test was written in turn).
+# 3. If grade boundaries are found, updates the grade boundaries in the database.
 #    - Uses the subject_year and a None test_name to find or create the document.
 #    - Sets the grade boundaries in the document, using the upsert option to insert if it does not exist.
-def ensure_grade_boundaries(db, class_entry):
-    subject_year = f"{class_entry['subject']}-Y{class_entry['year']}"
-    test_entries = class_entry.get('tests', [])
-    
-    for test in test_entries:
-        grade_boundaries = test.get('grade_boundaries')
-        if grade_boundaries:
-            db.update_one(
-                {'subject_year': subject_year, 'test_name': None},
-                {'$set': {'grade_boundaries': grade_boundaries}},
-                upsert=True
-            )
+# 4. If the boundaries changed, rebuilds the summaries of the subject year's students and marks the
+#    subject year's pages as changed in every school, since the boundaries are shared.
+def ensure_grade_boundaries(db, subject, year, test_entries):
+    subject_year = f"{subject}-Y{year}"
+    grade_boundaries = next((test['grade_boundaries'] for test in reversed(test_entries) if test.get('grade_boundaries')), None)
+    if not grade_boundaries:
+        return
+    result = db.update_one(
+        {'subject_year': subject_year, 'test_name': None},
+        {'$set': {'grade_boundaries': grade_boundaries}},
+        upsert=True
+    )
+    if result.modified_count or result.upserted_id is not None:
+        refresh_subject_year_summaries(subject, year)
+        bump_page_version(None, subject, year)
+
+#--Done--
+# This function creates the grade boundaries of subject years that have none yet from their classes'
+# tests (ensure_grade_boundaries), for data written before class_data stopped doing so on every view.
+# Subject years that already have boundaries are left alone. It returns the number of subject years
+# it set the boundaries of.
+def reconcile_grade_boundaries():
+    db = testdb()
+    existing = set(db.distinct('subject_year', {'subject_year': {'$exists': True}, 'test_name': None}))
+    reconciled = 0
+    for class_entry in find_classes('ensure_grade_boundaries', {'code': {'$exists': True}}):
+        subject_year = f"{class_entry['subject']}-Y{class_entry['year']}"
+        if subject_year not in existing and any(test.get('grade_boundaries') for test in class_entry.get('tests', [])):
+            ensure_grade_boundaries(db, class_entry['subject'], class_entry['year'], class_entry['tests'])
+            existing.add(subject_year)
+            reconciled += 1
+    return reconciled
 
 #--done--
 # This function retrieves and processes class data for a given class code.
@@ -1222,44 +2483,40 @@ def ensure_grade_boundaries(db, class_entry):
 # 1. Checks if the user is logged in and if they have the correct user type (admin or teacher).
 # 2. Connects to the database to retrieve class information based on the class code.
 # 3. If the class is not found, it prints an error message and returns a 404 error.
-# 4. Ensures grade boundaries are set for the class.
+# 4. Reads the class's marks (load_marks). The page only reads: the subject year's boundaries are
+#    kept up to date when tests are added or marked (ensure_grade_boundaries).
 # 5. Retrieves grade boundaries for the class's subject and year.
-# 6. Defines a function to assign grades based on percentage and grade boundaries.
-# 7. If grade boundaries are found, processes student data:
-#     - Retrieves student information and initializes their marks and grades.
-#     - Processes test scores and assigns grades to students based on their percentages.
-#     - Calculates the class total and average percentages.
-#     - Calculates the school average percentage and class rank.
-# 8. Prepares the response data, including class entry, students, tests, and averages.
-# 9. Renders the response using the 'class_data.html' template.
-# 10. If grade boundaries are not found, returns a 404 error.
-# 11. Redirects to the home page if the user is not logged in or does not have the correct user type.
+# 6. If grade boundaries are found, builds a GradeScale from them and processes student data:
+#     - Resolves all students with a single bulk lookup and initializes their marks and grades.
+#     - Processes test scores and grades every mark in the class in one vectorised call.
+#     - Reads the statistics of the school's subject year (subject_year_statistics), which are calculated
+#       once for all of its classes and cached: the students' averages and percentiles, the class
+#       average, spread and rank among the year's classes, the year's average and the test statistics.
+#     - Grades every student's average in one vectorised call.
+# 7. Prepares the response data, including class entry, students, tests, averages and statistics.
+# 8. Renders the response using the 'class_data.html' template.
+# 9. If grade boundaries are not found, returns a 404 error.
+# 10. Redirects to the home page if the user is not logged in or does not have the correct user type.
 @app.route('/class_data/<class_code>')
 def class_data(class_code):
     if is_logged_in() and session.get('user_type') in ['admin', 'teacher']:
         db = testdb()
-        class_entry = db.find_one({'code': class_code})
+        class_entry = find_class('class_data', class_code)
         if not class_entry:
-            print(f"Class not found for code: {class_code}")
+            app.logger.warning("Class not found for code: %s", class_code)
             return "Class not found", 404
-
-        ensure_grade_boundaries(db, class_entry)
+        load_marks([class_entry])
 
         subject_year = f"{class_entry['subject']}-Y{class_entry['year']}"
 
-        grade_boundaries_entry = db.find_one({'subject_year': subject_year, 'test_name': None})
+        grade_boundaries_entry = db.find_one({'subject_year': subject_year, 'test_name': None}, {'grade_boundaries': 1, '_id': 0})
 
-        def assign_grade(percentage, grade_boundaries):
-            for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-                if percentage >= boundary:
-                    return grade_letter
-            return 'U'
-        
         if grade_boundaries_entry:
-            grade_boundaries = grade_boundaries_entry['grade_boundaries']
+            scale = grade_scale(grade_boundaries_entry['grade_boundaries'])
             students = {}
+            student_docs = get_students(class_entry.get('students', []))
             for student_id in class_entry.get('students', []):
-                student_doc = accounts().find_one({'user_id': student_id})
+                student_doc = student_docs.get(student_id)
                 if student_doc:
                     students[student_id] = {
                         'username': student_doc['username'],
@@ -1268,37 +2525,39 @@ def class_data(class_code):
                         'grade': 'N/A'
                     }
             tests = class_entry.get('tests', [])
+            graded_marks = []
             for test in tests:
                 for student_id, marks in test.get('students_marks', {}).items():
                     if student_id in students:
                         percentage = marks['percentage']
                         students[student_id]['marks'][test['test_name']] = percentage
-                        grade = assign_grade(percentage, grade_boundaries)
-                        students[student_id]['marks'][f"{test['test_name']}_grade"] = grade
+                        graded_marks.append((student_id, test['test_name'], percentage))
+            for (student_id, test_name, _), grade in zip(graded_marks, scale.grade_all([mark[2] for mark in graded_marks])):
+                students[student_id]['marks'][f"{test_name}_grade"] = grade
 
-            class_total_percentage = 0
-            class_total_students = 0
+            statistics = subject_year_statistics(class_entry['school'], class_entry['subject'], class_entry['year'], scale, class_entry['code'])
+            class_statistics = statistics['classes'][class_entry['code']]
+            averages = statistics['students'][class_entry['code']]
+            graded_students = []
             for student_id, student_data in students.items():
-                numeric_marks = [value for value in student_data['marks'].values() if isinstance(value, (int, float))]
-                if numeric_marks:
-                    test_percentage = sum(numeric_marks) / len(numeric_marks)
-                    student_data['average_percentage'] = round(test_percentage, 1)
-                    student_data['grade'] = assign_grade(student_data['average_percentage'], grade_boundaries)
-                    class_total_percentage += student_data['average_percentage']
-                    class_total_students += 1
-
-            class_average_percentage = round(class_total_percentage / class_total_students, 1) if class_total_students > 0 else 0
-            school_average_percentage = class_average_percentage
-            class_averages = [class_average_percentage]
-            sorted_class_averages = sorted(class_averages, reverse=True)
-            class_rank = sorted_class_averages.index(class_average_percentage) + 1 if class_average_percentage in sorted_class_averages else 'N/A'
+                if student_id in averages:
+                    student_data['average_percentage'] = averages[student_id]['average']
+                    student_data['percentile'] = averages[student_id]['percentile']
+                    graded_students.append(student_data)
+            for student_data, grade in zip(graded_students, scale.grade_all([student_data['average_percentage'] for student_data in graded_students])):
+                student_data['grade'] = grade
+
             response = {
                 'class_entry': class_entry,
                 'students': students,
                 'tests': tests,
-                'class_average_percentage': class_average_percentage,
-                'school_average_percentage': school_average_percentage,
-                'class_rank': class_rank,
+                'class_average_percentage': class_statistics['average'] if class_statistics['average'] is not None else 0,
+                'school_average_percentage': statistics['year']['average'] if statistics['year']['average'] is not None else 0,
+                'class_rank': class_statistics['rank'] or 'N/A',
+                'class_statistics': class_statistics,
+                'year_statistics': statistics['year'],
+                'ranking': statistics['ranking'],
+                'test_statistics': statistics['tests'][class_entry['code']],
                 'school_name': session['school']
             }
             return render_template('class_data.html', data=response)
@@ -1306,143 +2565,345 @@ def class_data(class_code):
             return "Grade boundaries not found", 404
     return redirect('/')
 
+#--Done--
+# This function returns the version of a student's report: a hash of their summary version and
+# the account details printed on the report. It is used as the report's cache key and ETag.
+def report_version(student, summary):
+    content = json.dumps([summary['version'], student.get('username'), student.get('email')])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+#--Done--
 # This function generates a PDF report for a student's performance.
 # It performs the following steps:
-# 1. Sets up a dictionary for grade conversion from letter grades to numerical values.
-# 2. Creates an in-memory buffer to store the PDF data.
-# 3. Initializes the PDF document with landscape orientation and A4 page size.
-# 4. Prepares styles for the title and normal text.
-# 5. Connects to the databases to retrieve student information and test data.
-# 6. Retrieves the student's account information using the provided student_id.
-# 7. If the student is not found, returns None.
-# 8. Adds the report title and the student's email to the PDF elements.
-# 9. Retrieves all classes the student is part of and initializes a dictionary to store subjects and years.
-# 10. Iterates through each class and its tests to calculate the student's performance percentages.
-# 11. Calculates the average percentage for each subject and year combination.
-# 12. Defines a function to assign grades based on the calculated percentages and grade boundaries.
-# 13. Assigns grades for each subject and year based on the average percentages.
-# 14. Creates tables for each subject and year with the student's test scores and calculated grades.
-# 15. Adds the tables to the PDF elements, ensuring a structured layout.
-# 16. Builds the PDF document with all the prepared elements.
-# 17. Resets the buffer position to the beginning and returns the PDF data as a byte string.
-def generate_student_report(student_id):
-    GRADE_CONVERSION = {
-        "A*": 9,
-        "A": 8,
-        "B": 7,
-        "C": 6,
-        "D": 5,
-        "E": 4,
-        "U": "U"
-    }
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-    elements = []
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    normal_style = styles['Normal']
-    db = testdb()
-    accounts_db = accounts()
-    student = accounts_db.find_one({'user_id': student_id})
-    if not student:
-        return None
-    title = Paragraph(f"Performance Report for {student['username']}", title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 12))
-    email = Paragraph(f"Email: {student['email']}", normal_style)
-    elements.append(email)
-    elements.append(Spacer(1, 12))
-    classes = list(db.find({'students': student_id}))
-    subjects_years = {}
-    for class_entry in classes:
-        year = class_entry.get('year', 'N/A')
-        for test in class_entry.get('tests', []):
-            if student_id in test['students_marks']:
-                percentage = test['students_marks'][student_id]['percentage']
-                subject = test['subject']
-                subject_year = f"{subject}-Y{year}"
-                if subject_year not in subjects_years:
-                    subjects_years[subject_year] = {'total_percentage': 0, 'count': 0}
-                subjects_years[subject_year]['total_percentage'] += percentage
-                subjects_years[subject_year]['count'] += 1
-    for subject_year in subjects_years:
-        subjects_years[subject_year]['average_percentage'] = round(
-            subjects_years[subject_year]['total_percentage'] / subjects_years[subject_year]['count'], 1)
-    def assign_grade(percentage, grade_boundaries):
-        for grade_letter, boundary in sorted(grade_boundaries.items(), key=lambda x: x[1], reverse=True):
-            if percentage >= boundary:
-                if int(class_entry['year']) <= 11:
-                    return GRADE_CONVERSION[grade_letter]
-                return grade_letter
-        return 'U'
-    for subject_year in subjects_years:
-        subject, year = subject_year.split('-Y')
-        grade_boundaries = db.find_one({'subject_year': subject_year, 'test_name': None}, {'grade_boundaries': 1, '_id': 0})
-        if grade_boundaries:
-            grade_boundaries = grade_boundaries.get('grade_boundaries', {})
-            average_percentage = subjects_years[subject_year]['average_percentage']
-            grade = assign_grade(average_percentage, grade_boundaries)
-            subjects_years[subject_year]['grade'] = grade
-        else:
-            subjects_years[subject_year]['grade'] = 'N/A'
-    column_width = 4.5 * inch
-    row_tables = []
-    for subject_year, values in subjects_years.items():
-        subject, year = subject_year.split('-Y')
-        data = [["Class", "Year", "Test Name", "Percentage", "Grade"]]
-        for class_entry in classes:
-            if class_entry.get('subject') == subject and class_entry.get('year') == year:
-                class_name = class_entry.get('classname', 'N/A')
-                for test in class_entry.get('tests', []):
-                    if student_id in test['students_marks']:
-                        student_mark = test['students_marks'][student_id]
-                        percentage = student_mark['percentage']
-                        grade_boundaries = test.get('grade_boundaries', {})
-                        grade = assign_grade(percentage, grade_boundaries)
-                        data.append([class_name, year, test['test_name'], f"{percentage}%", grade])
-        data.append(["Average", year, "", f"{values['average_percentage']}%", values['grade']])
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkgreen),  
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white), 
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),  
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'), 
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.lightgreen, colors.whitesmoke]),  
-            ('GRID', (0, 0), (-1, -1), 1, colors.black), 
-        ]))
-        subject_title = Paragraph(f"Subject: {subject}", title_style)
-        year_title = Paragraph(f"Year: {year}", normal_style)
-        row_tables.append([subject_title, Spacer(1, 6), year_title, Spacer(1, 12), table])
-    for i in range(0, len(row_tables), 2):
-        row = []
-        for j in range(2):
-            if i + j < len(row_tables):
-                row.append(row_tables[i + j])
-        elements.append(Table([row], colWidths=[column_width] * len(row)))
-        elements.append(Spacer(1, 12))
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer.getvalue()
+# 1. Renders the PDF with reports.render_student_report. The reports module (and ReportLab) is
+#    imported here, on first use, rather than when the app starts.
+# 2. Caches the PDF under the report version, so it is only rendered again when the student's
+#    data changes.
+# 3. Records the render time on /metrics.
+def generate_student_report(student, summary, version):
+    key = (summary['student_id'], version)
+    pdf_data = report_cache.get(key)
+    if pdf_data is None:
+        import reports
+        start = time.perf_counter()
+        pdf_data = reports.render_student_report(student, summary)
+        metrics.REPORT_SECONDS.observe(time.perf_counter() - start, endpoint=metrics.current_endpoint.get(), kind='student')
+        report_cache.set(key, pdf_data)
+    return pdf_data
 
+#--Done--
 # This function generates a report for a specific student in PDF format.
-# It verifies if the user is logged in and if they are an admin or the student themselves.
-# If the student is found, it returns the PDF file as a response.
-# If the student is not found, it returns a 404 error.
+# It performs the following steps:
+# 1. Verifies if the user is logged in and if they are an admin or a student.
+# 2. Retrieves the student's username and email; if the student is not found, returns a 404 error.
+# 3. Reads the student's materialised summary (get_student_summary) and works out the report version.
+# 4. Answers with 304 Not Modified, without rendering, if the browser already has this version
+#    (If-None-Match / If-Modified-Since).
+# 5. Otherwise returns the (cached) PDF as an attachment with its ETag and Last-Modified headers;
+#    'private, no-cache' makes browsers revalidate each download instead of reusing a stale copy.
 @app.route('/generate_report/<student_id>')
 def generate_report(student_id):
     if is_logged_in() and session.get('user_type') in ['admin', 'student']:
-        pdf_data = generate_student_report(student_id)
-        if pdf_data:
-            return Response(pdf_data, mimetype='application/pdf', headers={"Content-Disposition": f"attachment; filename=report_{student_id}.pdf"})
-        return "Student not found", 404
+        student = accounts().find_one({'user_id': student_id}, {'username': 1, 'email': 1, '_id': 0})
+        if not student:
+            return "Student not found", 404
+        summary = get_student_summary(student_id)
+        version = report_version(student, summary)
+        response = Response(mimetype='application/pdf', headers={"Content-Disposition": f"attachment; filename=report_{student_id}.pdf"})
+        response.set_etag(version)
+        response.last_modified = summary['updated']
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code != 304:
+            response.set_data(generate_student_report(student, summary, version))
+        return response
+    return redirect('/')
+
+#--Done--
+# This function returns the report export pool ('reportworkers' processes, 0 renders inline).
+def report_pool():
+    return process_pool('report', config.get('reportworkers', os.cpu_count() or 1))
+
+#--Done--
+# This function returns the directory report exports are written to ('exportdir', by default a
+# folder in the system temporary directory), creating it if needed.
+def export_dir():
+    path = config.get('exportdir') or os.path.join(tempfile.gettempdir(), 'test-tracking-exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+#--Done--
+# This function deletes report exports older than 'exportretention' seconds.
+def cleanup_exports():
+    path = export_dir()
+    cutoff = time.time() - config.get('exportretention', 3600)
+    for name in os.listdir(path):
+        try:
+            if os.path.getmtime(os.path.join(path, name)) < cutoff:
+                os.remove(os.path.join(path, name))
+        except OSError:
+            pass
+
+#--Done--
+# This function returns the file name of a report export, for example reports_Y10.zip.
+def export_name(school, class_code=None, year=None, merged=False):
+    if class_code is not None:
+        scope = class_code
+    elif year is not None:
+        scope = f"Y{year}"
+    else:
+        scope = school
+    return f"reports_{secure_filename(scope) or 'school'}.{'pdf' if merged else 'zip'}"
+
+#--Done--
+# This function loads everything needed to render the reports of a class, a year group or a
+# whole school, with one query per collection instead of one per student.
+# It performs the following steps:
+# 1. Finds the students of the class or year group with one distinct query over the school's
+#    classes, or every student account of the school.
+# 2. Reads their usernames and emails with one query, sorted by username.
+# 3. Reads their materialised summaries with one $in query, and rebuilds the missing ones together
+#    (refresh_student_summaries reads all of their classes with one more query).
+# 4. Returns a list of (student, summary) pairs.
+def report_export_data(school, class_code=None, year=None):
+    if class_code is not None or year is not None:
+        query = {'school': school}
+        if class_code is not None:
+            query['code'] = class_code
+        if year is not None:
+            query['year'] = year
+        account_query = {'user_id': {'$in': testdb().distinct('students', query)}, 'school': school, 'type': 'student'}
+    else:
+        account_query = {'school': school, 'type': 'student'}
+    students = list(accounts().find(account_query, {'user_id': 1, 'username': 1, 'email': 1, '_id': 0}).sort('username', ASCENDING))
+    student_ids = [student['user_id'] for student in students]
+    summaries = {summary['student_id']: summary for summary in student_summaries().find({'student_id': {'$in': student_ids}}, {'_id': 0}) if 'version' in summary}
+    summaries.update(refresh_student_summaries([student_id for student_id in student_ids if student_id not in summaries]))
+    return [(student, summaries[student['user_id']]) for student in students]
+
+#--Done--
+# This function renders the reports of every student in a class, a year group or a whole school
+# into one file: a ZIP archive with a PDF per student, or with merged=True one merged PDF.
+# It performs the following steps:
+# 1. Deletes old exports (cleanup_exports) and loads the students and summaries once (report_export_data).
+# 2. For a ZIP archive:
+#    - Takes the reports already in this worker's report cache as they are.
+#    - Renders the rest in the report export pool, spread over the workers in chunks.
+#    - Writes each PDF into the archive as soon as it is ready, in username order, so the archive
+#      is never held in memory. PDFs are already compressed, so they are stored uncompressed.
+#    - Reports progress after each report.
+# 3. For a merged PDF, renders every report into one document in the pool (each student starts
+#    on a new page) and writes it.
+# 4. Deletes the partly written file if rendering fails, or records the export's render time on /metrics.
+# 5. Returns the number of reports, the export file's name and the name to download it as.
+def export_student_reports(school, path, class_code=None, year=None, merged=False, progress=None):
+    cleanup_exports()
+    data = report_export_data(school, class_code, year)
+    if progress:
+        progress(0, len(data))
+    import reports
+    pool = report_pool()
+    start = time.perf_counter()
+    try:
+        if merged:
+            if pool is None:
+                pdf_data = reports.render_merged_report(data)
+            else:
+                pdf_data = pool.submit(reports.render_merged_report, data).result()
+            with open(path, 'wb') as f:
+                f.write(pdf_data)
+            if progress:
+                progress(len(data))
+        else:
+            cached = [report_cache.get((summary['student_id'], report_version(student, summary))) for student, summary in data]
+            pending = [pair for pair, pdf_data in zip(data, cached) if pdf_data is None]
+            if pool is None:
+                rendered = (reports.render_student_report(student, summary) for student, summary in pending)
+            else:
+                chunksize = max(1, len(pending) // (4 * config.get('reportworkers', os.cpu_count() or 1)))
+                rendered = pool.map(reports.render_student_report, [student for student, _ in pending], [summary for _, summary in pending], chunksize=chunksize)
+            names = set()
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for done, ((student, summary), pdf_data) in enumerate(zip(data, cached), 1):
+                    if pdf_data is None:
+                        pdf_data = next(rendered)
+                    name = secure_filename(student['username']) or student['user_id']
+                    if name in names:
+                        name = f"{name}_{student['user_id']}"
+                    names.add(name)
+                    archive.writestr(f"{name}.pdf", pdf_data)
+                    if progress:
+                        progress(done)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    metrics.REPORT_SECONDS.observe(time.perf_counter() - start, endpoint=metrics.current_endpoint.get(), kind='merged' if merged else 'zip')
+    return {'reports': len(data), 'file': os.path.basename(path), 'download_name': export_name(school, class_code, year, merged)}
+
+#--Done--
+# This function starts a bulk export of student reports for admins.
+# It performs the following steps:
+# 1. Checks if the user is logged in and if their user type is 'admin'.
+# 2. Reads the scope from the form: a class code, a year, or neither for the whole school; a class
+#    that is not in the admin's school returns a 404 error.
+# 3. Reads the format from the form: 'zip' (the default) or 'pdf' for one merged PDF.
+# 4. Submits export_student_reports as a background job writing to a new file in the export directory.
+#    - A second request for the same export while it is still queued or running returns the same job.
+# 5. Returns the job handle with its download URL as JSON with a 202 status; the job's progress
+#    counts the reports written.
+# 6. Redirects to the home page if the user is not logged in or does not have the correct user type.
+@app.route('/export_reports', methods=['POST'])
+def export_reports():
+    if is_logged_in() and session.get('user_type') == 'admin':
+        school = session['school']
+        class_code = request.form.get('class_code') or None
+        year = request.form.get('year') or None
+        merged = request.form.get('format') == 'pdf'
+        if class_code is not None and not testdb().find_one({'school': school, 'code': class_code}, {'_id': 1}):
+            return jsonify({'error': 'Class not found'}), 404
+        path = os.path.join(export_dir(), f"{uuid.uuid4()}.{'pdf' if merged else 'zip'}")
+        job = submit_job('export_reports', ('export_reports', school, class_code, year, merged), export_student_reports, school, path, class_code, year, merged, owner=school)
+        data = job_status_data(job)
+        data['download_url'] = url_for('download_export', job_id=job['job_id'])
+        return jsonify(data), 202
     return redirect('/')
 
+#--Done--
+# This function downloads a finished report export.
+# It performs the following steps:
+# 1. Checks if the user is logged in and if their user type is 'admin'.
+# 2. Returns a 404 error if the export job is unknown, belongs to another school
+#    or its file has been deleted, and a 409 error with the job status while it is still running.
+# 3. Streams the file from disk as an attachment.
+# 4. Redirects to the home page if the user is not logged in or does not have the correct user type.
+@app.route('/export_reports/<job_id>')
+def download_export(job_id):
+    if is_logged_in() and session.get('user_type') == 'admin':
+        job = get_job(job_id)
+        if not job or job['owner'] != session['school'] or job['kind'] != 'export_reports':
+            return jsonify({'error': 'Export not found'}), 404
+        if job['status'] != 'finished':
+            return jsonify(job_status_data(job)), 409
+        path = os.path.join(export_dir(), job['result']['file'])
+        if not os.path.exists(path):
+            return jsonify({'error': 'Export expired'}), 404
+        mimetype = 'application/pdf' if path.endswith('.pdf') else 'application/zip'
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=job['result']['download_name'])
+    return redirect('/')
+
+#--Done--
+# This list holds the columns every row of a user CSV must fill in, and the account types it may create.
+CSV_COLUMNS = ['name', 'password', 'email', 'account_type']
+ACCOUNT_TYPES = {'student', 'teacher', 'admin'}
+
+#--Done--
+# This function returns the password hashing pool ('hashworkers' processes, 0 hashes inline).
+def hash_pool():
+    return process_pool('hash', config.get('hashworkers', os.cpu_count() or 1))
+
+#--Done--
+# This function imports the users in a CSV file into a school, in batches.
+# It performs the following steps:
+# 1. Opens the file as a text stream so it is decoded incrementally rather than read into memory.
+# 2. Checks the header has every required column; otherwise the import fails.
+# 3. Reads the rows in batches of 'csvbatchsize':
+#    - Records a validation error (with the line number) for rows with a missing value or an unknown account type.
+#    - Finds usernames that already exist in the school with one $in query per batch, and
+#      usernames repeated in the file, and skips them.
+#    - Hashes the passwords of the remaining rows in the hash process pool.
+#    - Inserts the new accounts with insert_many(ordered=False), recording any rows the database rejects.
+#    - Clears cached account types for the new usernames and reports progress (rows read).
+# 4. Deletes the file and returns the number of users added, the existing users and the row errors.
+#    Only the first 'importreportlimit' existing users and errors are listed (with their full counts),
+#    so the result stays well within a MongoDB document when it is stored in the job record.
+def import_users_csv(path, school, progress=None):
+    db = accounts()
+    batch_size = config.get('csvbatchsize', 500)
+    report_limit = config.get('importreportlimit', 1000)
+    inserted = 0
+    existing_users = []
+    existing_count = 0
+    errors = []
+    error_count = 0
+    seen = set()
+    rows_read = 0
+
+    def report(items, item):
+        if len(items) < report_limit:
+            items.append(item)
+
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            missing_columns = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or [])]
+            if missing_columns:
+                raise ValueError(f"CSV is missing column(s): {', '.join(missing_columns)}")
+            rows = ((reader.line_num, row) for row in reader)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                rows_read += len(batch)
+                valid = []
+                for line, row in batch:
+                    empty = [column for column in CSV_COLUMNS if not (row.get(column) or '').strip()]
+                    if empty:
+                        error_count += 1
+                        report(errors, {'line': line, 'error': f"Missing {', '.join(empty)}"})
+                    elif row['account_type'] not in ACCOUNT_TYPES:
+                        error_count += 1
+                        report(errors, {'line': line, 'error': f"Unknown account type '{row['account_type']}'"})
+                    else:
+                        valid.append((line, row))
+                usernames = [row['name'] for _, row in valid]
+                existing = {user['username'] for user in db.find({'school': school, 'username': {'$in': usernames}}, {'username': 1, '_id': 0})}
+                new_rows = []
+                for line, row in valid:
+                    if row['name'] in existing or row['name'] in seen:
+                        existing_count += 1
+                        report(existing_users, row['name'])
+                        continue
+                    seen.add(row['name'])
+                    new_rows.append((line, row))
+                passwords = [row['password'] for _, row in new_rows]
+                pool = hash_pool()
+                if pool is None:
+                    hashes = [generate_password_hash(password) for password in passwords]
+                else:
+                    hashes = list(pool.map(generate_password_hash, passwords, chunksize=max(1, len(passwords) // (4 * config.get('hashworkers', os.cpu_count() or 1)))))
+                users = [{
+                    'user_id': str(uuid.uuid4()),
+                    'username': row['name'],
+                    'email': row['email'],
+                    'password': password,
+                    'school': school,
+                    'type': row['account_type']
+                } for (_, row), password in zip(new_rows, hashes)]
+                if users:
+                    try:
+                        inserted += len(db.insert_many(users, ordered=False).inserted_ids)
+                    except BulkWriteError as e:
+                        inserted += e.details.get('nInserted', 0)
+                        for error in e.details.get('writeErrors', []):
+                            error_count += 1
+                            report(errors, {'line': new_rows[error['index']][0], 'error': error.get('errmsg', 'Insert failed')})
+                    for user in users:
+                        invalidate_user_type(user['username'])
+                if progress:
+                    progress(rows_read)
+    finally:
+        os.remove(path)
+    return {'inserted': inserted, 'existing_users': existing_users, 'existing_count': existing_count, 'errors': errors, 'error_count': error_count}
+
 #--Done--
 # This function handles the upload of a CSV file containing user data.
 # It verifies if the user is logged in and if they are an admin.
 # If the file is missing, it redirects to the home page.
-# It processes the CSV file and adds the users to the database, avoiding duplicates.
-# It addes all exsisting users to session to be returned to admin homepage
+# It streams the upload to a temporary file and imports it as a background job
+# (import_users_csv), remembering the job in the session so the admin homepage can
+# show its progress, the users that already existed and any rows that failed validation.
 @app.route('/upload_csv', methods=['POST'])
 def upload_csv():
     if is_logged_in() and session.get('user_type') == 'admin':
@@ -1452,33 +2913,33 @@ def upload_csv():
         if file.filename == '':
             return redirect('/')
         if file and file.filename.endswith('.csv'):
-            db = accounts()
             school = session['school']
-            reader = csv.DictReader(file.read().decode('utf-8').splitlines())
-            existing_users = []
-            for row in reader:
-                username = row['name']
-                password = generate_password_hash(row['password'])
-                email = row['email']
-                user_type = row['account_type']
-                user_id = str(uuid.uuid4())
-                existing_user = db.find_one({'username': username, 'school': school})
-                if existing_user:
-                    existing_users.append(username)
-                    continue
-                user = {
-                    'user_id': user_id,
-                    'username': username,
-                    'email': email,
-                    'password': password,
-                    'school': school,
-                    'type': user_type
-                }
-                db.insert_one(user)
-            session['existing_users'] = existing_users
+            fd, path = tempfile.mkstemp(suffix='.csv')
+            with os.fdopen(fd, 'wb') as f:
+                file.save(f)
+            job = submit_job('import_csv', ('import_csv', path), import_users_csv, path, school, owner=school)
+            session['import_job'] = job['job_id']
             return redirect('/')
     return redirect('/')
 
+#--Done--
+# This function reports hit/miss counters for the in-process caches as JSON.
+# It is admin only and reflects the worker process that served the request.
+@app.route('/cache_stats')
+def cache_stats():
+    if is_logged_in() and session.get('user_type') == 'admin':
+        return jsonify({'user_type_cache': user_type_cache.stats(), 'report_cache': report_cache.stats(), 'page_cache': page_cache.stats(), 'statistics_cache': statistics_cache.stats()})
+    return redirect('/')
+
+#--Done--
+# This function serves the request metrics in the Prometheus text format for scraping.
+# The histograms are per worker process; it returns a 404 error when 'metrics' is disabled.
+@app.route('/metrics')
+def prometheus_metrics():
+    if not config.get('metrics', True):
+        return "Metrics are disabled", 404
+    return Response(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 #--Done--
 # This Flask function handles 404 errors, which occur when a requested page 
 # is not found on the server. When such an error happens, the function captures 
@@ -1498,6 +2959,69 @@ def logout():
     session.clear()
     return redirect('/')
 
+#--Done--
+# This command creates every declared index: flask --app main ensure-indexes
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    for name, indexes in ensure_indexes().items():
+        click.echo(f"{name}: {', '.join(indexes)}")
+
+#--Done--
+# This command explains every route query shape and exits with an error if any of them
+# would scan a whole collection: flask --app main check-indexes
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    failed = 0
+    for description, name, query, uses_index in check_indexes():
+        click.echo(f"{'ok      ' if uses_index else 'COLLSCAN'} {name}: {description} {query}")
+        if not uses_index:
+            failed += 1
+    if failed:
+        raise click.ClickException(f"{failed} query shape(s) use a collection scan")
+
+#--Done--
+# This command moves marks between the class documents and the marks collection:
+# flask --app main migrate-marks (or --reverse to move them back into the class documents).
+# Run it with the app stopped, then set 'marksstorage' in config.yaml to match.
+@app.cli.command('migrate-marks')
+@click.option('--reverse', is_flag=True, help='Move marks from the marks collection back into the class documents.')
+def migrate_marks_command(reverse):
+    if reverse:
+        click.echo(f"Moved {migrate_marks_to_classes()} marks into the class documents; set marksstorage: embedded")
+    else:
+        ensure_indexes()
+        click.echo(f"Moved {migrate_marks_to_collection()} marks into the marks collection; set marksstorage: collection")
+
+#--Done--
+# This command creates the grade boundaries of subject years that have none yet from their classes'
+# tests: flask --app main reconcile-boundaries. Run it once after upgrading, since the boundaries
+# are now only written when tests are added or marked (see ensure_grade_boundaries).
+@app.cli.command('reconcile-boundaries')
+def reconcile_boundaries_command():
+    click.echo(f"Set the grade boundaries of {reconcile_grade_boundaries()} subject year(s)")
+
+#--Done--
+# This command renders the reports of a class, a year group or a whole school into a ZIP archive
+# (or one merged PDF with --merged), showing progress and the throughput in PDFs per second.
+@app.cli.command('export-reports')
+@click.argument('school')
+@click.option('--class', 'class_code', help='Export the students of this class code.')
+@click.option('--year', help='Export the students of classes in this year.')
+@click.option('--merged', is_flag=True, help='Write one merged PDF instead of a ZIP archive of PDFs.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Output file (default reports_<class, year or school>.zip).')
+def export_reports_command(school, class_code, year, merged, output):
+    output = output or export_name(school, class_code, year, merged)
+    totals = {}
+    def progress(done, total=None):
+        if total is not None:
+            totals['total'] = total
+        click.echo(f"\rRendered {done}/{totals['total']} reports", nl=False, err=True)
+    start = time.perf_counter()
+    result = export_student_reports(school, output, class_code, year, merged, progress=progress)
+    elapsed = time.perf_counter() - start
+    click.echo('', err=True)
+    click.echo(f"Exported {result['reports']} reports to {output} in {elapsed:.2f}s ({result['reports'] / elapsed:.1f} PDFs/sec)")
+
 #--Done--
 # This condition ensures that the script runs only if it is executed directly,
 # and not when it is imported as a module.
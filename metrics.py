@@ -0,0 +1,122 @@
+import bisect
+import threading
+from contextvars import ContextVar
+from pymongo import monitoring
+
+#--Done--
+# This module holds the request instrumentation behind the /metrics endpoint.
+# Histograms are kept in the memory of each worker process and rendered in the Prometheus text
+# format. Every observation is attributed to the Flask endpoint (or background job) that was
+# running in the current thread or context when it was made.
+
+#--Done--
+# These are the default histogram buckets: durations in seconds, and round trips per request.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+#--Done--
+# These are the MongoDB commands that write, counted separately for each request.
+WRITE_COMMANDS = frozenset(['insert', 'update', 'delete', 'findAndModify', 'createIndexes', 'dropIndexes', 'drop'])
+
+#--Done--
+# These context variables hold the endpoint observations are attributed to, and the per-request
+# counters (MongoDB round trips, writes and time) while a request is being handled.
+current_endpoint = ContextVar('current_endpoint', default='background')
+request_stats = ContextVar('request_stats', default=None)
+
+#--Done--
+# This function escapes a label value for the Prometheus text format.
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+#--Done--
+# This function formats a bucket bound the way Prometheus clients do (1.0, 0.005, +Inf).
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+#--Done--
+# This list holds every histogram, in the order they are rendered.
+REGISTRY = []
+
+#--Done--
+# This class is a thread-safe histogram with labels.
+# It performs the following steps:
+# 1. Keeps, for each combination of label values, a count per bucket, the sum and the count.
+# 2. observe() finds the value's bucket with a binary search and adds it under the lock.
+# 3. render() returns the HELP and TYPE lines and the cumulative _bucket, _sum and _count samples.
+# 4. Registers itself in REGISTRY so render_metrics() includes it.
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{_bound(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+#--Done--
+# These are the histograms the app records.
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time spent handling a request.', ['endpoint', 'method', 'status'])
+REQUEST_ROUND_TRIPS = Histogram('http_request_db_round_trips', 'MongoDB commands sent while handling a request.', ['endpoint'], ROUND_TRIP_BUCKETS)
+MONGODB_COMMAND_SECONDS = Histogram('mongodb_command_duration_seconds', 'Duration of MongoDB commands.', ['endpoint', 'command', 'outcome'])
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Time spent rendering Jinja templates.', ['endpoint', 'template'])
+CHART_SECONDS = Histogram('chart_render_duration_seconds', 'Time spent drawing a chart with matplotlib.', ['endpoint'])
+REPORT_SECONDS = Histogram('report_render_duration_seconds', 'Time spent building PDF reports with ReportLab.', ['endpoint', 'kind'])
+
+#--Done--
+# This function returns every histogram in the Prometheus text exposition format.
+def render_metrics():
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+#--Done--
+# This class is the pymongo command listener that times every MongoDB command.
+# pymongo calls it in the thread that sent the command, so the command is attributed to the
+# current endpoint and counted as a round trip (and, for WRITE_COMMANDS, a write) of the current
+# request (if there is one).
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'success')
+
+    def failed(self, event):
+        self._record(event, 'failure')
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        MONGODB_COMMAND_SECONDS.observe(seconds, endpoint=current_endpoint.get(), command=event.command_name, outcome=outcome)
+        stats = request_stats.get()
+        if stats is not None:
+            stats['db_round_trips'] += 1
+            stats['db_writes'] += event.command_name in WRITE_COMMANDS
+            stats['db_seconds'] += seconds
@@ -0,0 +1,98 @@
+import io
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet
+from grading import GRADE_CONVERSION, uses_numeric_grades
+
+#--Done--
+# This module renders the student PDF reports.
+# main.py only imports it the first time a report is generated, so ReportLab is not loaded
+# by workers that never serve one. It takes plain data and never touches the database, so its
+# functions can also run in the report export process pool (see export_reports in main.py).
+
+#--Done--
+# These are the paragraph styles, column width and table style of every report. They are
+# built once when the module is imported instead of for every report.
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = STYLES['Title']
+NORMAL_STYLE = STYLES['Normal']
+COLUMN_WIDTH = 4.5 * inch
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkgreen),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.lightgreen, colors.whitesmoke]),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+#--Done--
+# This function builds the flowables of a student's performance report.
+# It performs the following steps:
+# 1. Uses the prebuilt styles for the title, normal text and tables.
+# 2. Adds the report title and the student's email to the PDF elements.
+# 3. For each subject year in the student's summary, builds a table of the student's tests in
+#    classes of that subject and year, followed by their average percentage and grade.
+# 4. Shows the test and subject year grades on the GCSE 9-4 scale for Year 11 and below.
+# 5. Adds the tables to the PDF elements two per row, ensuring a structured layout.
+# 6. Returns the list of elements.
+def report_elements(student, summary):
+    elements = []
+    title_style = TITLE_STYLE
+    normal_style = NORMAL_STYLE
+    title = Paragraph(f"Performance Report for {student['username']}", title_style)
+    elements.append(title)
+    elements.append(Spacer(1, 12))
+    email = Paragraph(f"Email: {student['email']}", normal_style)
+    elements.append(email)
+    elements.append(Spacer(1, 12))
+    column_width = COLUMN_WIDTH
+    row_tables = []
+    for subject_year, values in summary['subjects_years'].items():
+        subject, year = subject_year.split('-Y')
+        convert = GRADE_CONVERSION if uses_numeric_grades(year) else {}
+        data = [["Class", "Year", "Test Name", "Percentage", "Grade"]]
+        for test in summary['tests']:
+            if test['class_subject'] == subject and test['year'] == year:
+                data.append([test['classname'], year, test['test_name'], f"{test['percentage']}%", convert.get(test['grade'], test['grade'])])
+        data.append(["Average", year, "", f"{values['average_percentage']}%", convert.get(values['grade'], values['grade'])])
+        table = Table(data)
+        table.setStyle(TABLE_STYLE)
+        subject_title = Paragraph(f"Subject: {subject}", title_style)
+        year_title = Paragraph(f"Year: {year}", normal_style)
+        row_tables.append([subject_title, Spacer(1, 6), year_title, Spacer(1, 12), table])
+    for i in range(0, len(row_tables), 2):
+        row = []
+        for j in range(2):
+            if i + j < len(row_tables):
+                row.append(row_tables[i + j])
+        elements.append(Table([row], colWidths=[column_width] * len(row)))
+        elements.append(Spacer(1, 12))
+    return elements
+
+#--Done--
+# This function renders the given elements as a landscape A4 PDF and returns its bytes.
+def build_pdf(elements):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+#--Done--
+# This function renders a student's performance report as a PDF and returns the PDF data.
+def render_student_report(student, summary):
+    return build_pdf(report_elements(student, summary))
+
+#--Done--
+# This function renders the reports of several students as one PDF, each starting on a new page.
+# It takes a list of (student, summary) pairs and returns the PDF data.
+def render_merged_report(reports):
+    elements = []
+    for student, summary in reports:
+        if elements:
+            elements.append(PageBreak())
+        elements.extend(report_elements(student, summary))
+    return build_pdf(elements)
@@ -0,0 +1,100 @@
+# These fixtures run the app against mongomock, swapped in before main is imported, and build the
+# schools the tests use with the benchmarks' synthetic school generator.
+import argparse
+import os
+import sys
+import uuid
+
+import mongomock
+import pymongo
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+pymongo.MongoClient = mongomock.MongoClient
+
+import main  # noqa: E402
+import synthetic_school  # noqa: E402
+
+# Charts, reports and password hashes are made inline rather than in process pools, and mongomock
+# does not support every index the app declares.
+main.config.update(ensureindexes=False, renderworkers=0, reportworkers=0, hashworkers=0)
+
+# These are the collection methods the recording fixture sees; the write methods are the ones that
+# send insert, update, delete, findAndModify or index commands.
+READ_METHODS = frozenset(['find', 'find_one', 'aggregate', 'distinct', 'count_documents'])
+WRITE_METHODS = frozenset(['insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+                           'bulk_write', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete',
+                           'create_index', 'create_indexes', 'drop_index', 'drop'])
+
+
+# This class wraps a collection and records every read and write method called on it as
+# (collection name, method, args, kwargs).
+class RecordingCollection:
+    def __init__(self, collection, calls):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in READ_METHODS | WRITE_METHODS:
+            return attr
+
+        def recorded(*args, **kwargs):
+            self._calls.append((self._collection.name, name, args, kwargs))
+            return attr(*args, **kwargs)
+        return recorded
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir(tmp_path_factory):
+    # Charts are written under static/ relative to the working directory.
+    previous = os.getcwd()
+    path = tmp_path_factory.mktemp('app')
+    os.chdir(path)
+    yield path
+    os.chdir(previous)
+
+
+@pytest.fixture
+def app():
+    for cache in (main.user_type_cache, main.report_cache, main.page_cache, main.statistics_cache):
+        cache.invalidate()
+    return main
+
+
+@pytest.fixture
+def school(app):
+    parser = argparse.ArgumentParser()
+    synthetic_school.add_arguments(parser)
+    args = parser.parse_args(['--students', '60', '--years', '10', '--subjects', '2', '--tests', '3', '--class-size', '20'])
+    description = synthetic_school.generate_school(app, f'test-{uuid.uuid4().hex[:8]}', args)
+    yield description
+    synthetic_school.delete_school(app, description)
+
+
+# This fixture returns a function that logs a user of the school in on a new test client.
+@pytest.fixture
+def login(app, school):
+    def login_as(username):
+        client = app.app.test_client()
+        client.post('/login', data={'school': school['school'], 'username': username, 'password': synthetic_school.PASSWORD})
+        client.get('/')
+        return client
+    return login_as
+
+
+# This fixture records every call made through main.collection() for the rest of the test.
+@pytest.fixture
+def db_calls(app, monkeypatch):
+    calls = []
+    collection = app.collection
+    monkeypatch.setattr(app, 'collection', lambda name: RecordingCollection(collection(name), calls))
+    return calls
+
+
+# This fixture returns a function listing the writes recorded so far (see db_calls).
+@pytest.fixture
+def db_writes(db_calls):
+    return lambda: [(name, method, args) for name, method, args, kwargs in db_calls if method in WRITE_METHODS]
@@ -0,0 +1,18 @@
+# These tests check that the admin homepage only lists the admin's own school.
+
+
+def test_admin_index_lists_only_its_school(app, school, login, db_calls):
+    app.testdb().insert_one({'classname': 'Other school class', 'year': '10', 'subject': 'Maths', 'code': 'OTHER', 'school': 'other school', 'teacher': 'teacher', 'students': [], 'tests': []})
+    app.accounts().insert_one({'user_id': 'other-student', 'username': 'Other school student', 'school': 'other school', 'type': 'student'})
+    try:
+        client = login(school['admin'])
+        db_calls.clear()
+        html = client.get('/').get_data(as_text=True)
+        assert school['students'][0] in html
+        assert 'Other school class' not in html
+        assert 'Other school student' not in html
+        reads = [args[0] for name, method, args, kwargs in db_calls if name in ('data', 'accounts') and method == 'find']
+        assert reads and all(query.get('school') == school['school'] for query in reads)
+    finally:
+        app.testdb().delete_one({'code': 'OTHER'})
+        app.accounts().delete_one({'user_id': 'other-student'})
@@ -0,0 +1,25 @@
+# These tests check that viewing a class's data page only reads: the subject year's grade
+# boundaries are written when tests are, never when the page is opened.
+
+
+def test_class_data_sends_no_writes(app, school, login, db_writes):
+    class_entry = school['classes'][0]
+    for username in (class_entry['teacher'], school['admin']):
+        client = login(username)
+        app.statistics_cache.invalidate()
+        app.page_cache.invalidate()
+        # Once with the subject year's statistics calculated and once with them cached.
+        for _ in range(2):
+            response = client.get(f"/class_data/{class_entry['code']}")
+            assert response.status_code == 200
+    assert db_writes() == []
+
+
+def test_class_data_without_boundaries_sends_no_writes(app, school, login, db_calls, db_writes):
+    class_entry = school['classes'][0]
+    entry = app.testdb().find_one({'code': class_entry['code']}, {'subject': 1, 'year': 1, '_id': 0})
+    app.testdb().delete_one({'subject_year': f"{entry['subject']}-Y{entry['year']}", 'test_name': None})
+    client = login(class_entry['teacher'])
+    db_calls.clear()
+    assert client.get(f"/class_data/{class_entry['code']}").status_code == 404
+    assert db_writes() == []
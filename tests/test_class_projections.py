@@ -0,0 +1,70 @@
+# These tests go through the class routes and check that every read of the class documents (the
+# data collection) names the fields it needs, so no route loads whole classes with every mark.
+
+
+def projection_of(method, args, kwargs):
+    if len(args) > 1:
+        return args[1]
+    return kwargs.get('projection')
+
+
+def assert_projected(db_calls, responses):
+    for path, response in responses:
+        assert response.status_code < 400, (path, response.status_code)
+    reads = [(method, args) for name, method, args, kwargs in db_calls if name == 'data' and method in ('find', 'find_one')]
+    assert reads
+    unprojected = [(method, args) for name, method, args, kwargs in db_calls
+                   if name == 'data' and method in ('find', 'find_one') and not projection_of(method, args, kwargs)]
+    assert not unprojected
+
+
+def test_teacher_class_routes_project_class_reads(school, login, db_calls):
+    class_entry = school['classes'][0]
+    code = class_entry['code']
+    test_name = class_entry['tests'][0]
+    student_id = class_entry['students'][0]
+    client = login(class_entry['teacher'])
+    db_calls.clear()
+    responses = [(path, client.get(path, follow_redirects=True)) for path in [
+        '/',
+        f'/view_class/{code}',
+        f'/select_test/{code}?test_name={test_name}',
+        f'/student_performance/{code}/{student_id}',
+        f'/class_data/{code}'
+    ]]
+    responses += [(path, client.post(path, data=data)) for path, data in [
+        ('/add_test', {'class_code': code, 'test_name': 'Projection test', 'max_mark': '50', 'grading_type': 'boundaries', 'test_type': 'test',
+                       'A_star': 90, 'A': 80, 'B': 70, 'C': 60, 'D': 50, 'E': 40}),
+        ('/submit_marks', {'class_code': code, 'test_name': 'Projection test', f'marks[{student_id}]': '40'}),
+        ('/join_class', {'class_code': school['classes'][1]['code']}),
+        ('/create_class', {'classname': 'Projection class', 'year': '10', 'subject': 'Maths'})
+    ]]
+    assert_projected(db_calls, responses)
+
+
+def test_student_class_routes_project_class_reads(school, login, db_calls):
+    class_entry = school['classes'][0]
+    student = school['students'][school['student_ids'].index(class_entry['students'][0])]
+    subject, year = school['subject_years'][0]
+    client = login(student)
+    db_calls.clear()
+    responses = [(path, client.get(path)) for path in [
+        '/',
+        f"/class_tests/{class_entry['code']}",
+        f'/subject_tests/{subject}-Y{year}'
+    ]]
+    responses.append(('/join_class', client.post('/join_class', data={'class_code': class_entry['code']})))
+    assert_projected(db_calls, responses)
+
+
+def test_admin_class_routes_project_class_reads(school, login, db_calls):
+    subject, year = school['subject_years'][0]
+    client = login(school['admin'])
+    db_calls.clear()
+    responses = [(path, client.get(path)) for path in [
+        '/',
+        f'/subject_details/{subject}',
+        f"/admin_student_performance/{school['student_ids'][0]}",
+        f'/admin_subject_year_details/{subject}/{year}'
+    ]]
+    assert_projected(db_calls, responses)
@@ -0,0 +1,59 @@
+# These tests check that students joining a class at the same time are all added to it.
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# This class wraps a collection and delays every read, as the round trip to a MongoDB server would,
+# so that requests running at the same time overlap between reading a class and writing it.
+class SlowReadCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in ('find', 'find_one'):
+            return attr
+
+        def slow(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            time.sleep(0.005)
+            return result
+        return slow
+
+
+def test_concurrent_joins_do_not_lose_students(app, school, monkeypatch):
+    class_code = app.insert_class({'classname': 'Joined', 'year': '10', 'subject': 'Maths', 'school': school['school'], 'teacher': 'teacher', 'students': [], 'tests': []})
+    student_ids = [str(uuid.uuid4()) for _ in range(200)]
+    collection = app.collection
+    monkeypatch.setattr(app, 'collection', lambda name: SlowReadCollection(collection(name)) if name == 'data' else collection(name))
+
+    def join(user_id):
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session['user'] = user_id
+            session['user_id'] = user_id
+            session['school'] = school['school']
+            session['user_type'] = 'student'
+        return client.post('/join_class', data={'class_code': class_code}).status_code
+
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            statuses = list(pool.map(join, student_ids))
+
+        assert statuses == [302] * len(student_ids)
+        joined = app.testdb().find_one({'code': class_code}, {'students': 1, '_id': 0})['students']
+        assert sorted(joined) == sorted(student_ids)
+        assert app.student_summaries().count_documents({'student_id': {'$in': student_ids}, 'classes.code': class_code}) == len(student_ids)
+    finally:
+        app.student_summaries().delete_many({'student_id': {'$in': student_ids}})
+
+
+def test_joining_twice_adds_the_student_once(app, school, login):
+    class_entry = school['classes'][0]
+    user_id = class_entry['students'][0]
+    client = login(school['students'][school['student_ids'].index(user_id)])
+    for _ in range(2):
+        assert client.post('/join_class', data={'class_code': class_entry['code']}).status_code == 302
+    students = app.testdb().find_one({'code': class_entry['code']}, {'students': 1, '_id': 0})['students']
+    assert students.count(user_id) == 1
@@ -0,0 +1,24 @@
+# These tests check marking the first test of a subject year, which calculates the whole subject
+# year's grades, when the subject year also has a class with no tests.
+
+
+def test_first_marks_in_subject_year_with_an_empty_class(app, school, login):
+    teacher = school['classes'][0]['teacher']
+    client = login(teacher)
+    for classname in ('Empty', 'Marked'):
+        assert client.post('/create_class', data={'classname': classname, 'year': '10', 'subject': 'Physics'}).status_code == 302
+    class_code = app.testdb().find_one({'school': school['school'], 'classname': 'Marked'}, {'code': 1, '_id': 0})['code']
+    student_ids = school['student_ids'][:5]
+    app.testdb().update_one({'code': class_code}, {'$addToSet': {'students': {'$each': student_ids}}})
+    assert client.post('/add_test', data={'class_code': class_code, 'test_name': 'Forces', 'max_mark': '50', 'grading_type': 'boundaries', 'test_type': 'test',
+                                          'A_star': 90, 'A': 80, 'B': 70, 'C': 60, 'D': 50, 'E': 40}).status_code == 302
+    version = app.page_version(school['school'], 'Physics', '10')
+
+    marks = {f'marks[{student_id}]': str(10 + 5 * i) for i, student_id in enumerate(student_ids)}
+    response = client.post('/submit_marks', data=dict(marks, class_code=class_code, test_name='Forces'), follow_redirects=True)
+
+    assert response.status_code == 200
+    assert app.page_version(school['school'], 'Physics', '10') != version
+    summary = app.student_summaries().find_one({'student_id': student_ids[0]}, {'tests': 1, '_id': 0})
+    assert [test['percentage'] for test in summary['tests'] if test['test_name'] == 'Forces'] == [20.0]
+    assert app.mass_update_grades_for_school(school['school'])['subject_years'] > 0